@@ -1,19 +1,30 @@
 """
 API Gateway - Receives webhooks and queues jobs
 """
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, HTTPException, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
+import base64
+import json
 import logging
 import sys
+import time
 from datetime import datetime
+from typing import Optional
 import uuid
 from fastapi.middleware.cors import CORSMiddleware
 
 # Add parent directory to path
 sys.path.append('/app')
 
-from shared import settings, redis_client, init_db, db_health_check
+from shared import settings, init_db, dispose_async_engine, RedisSemaphore, PRAnalysis, metrics
+from shared.database import get_async_engine
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from shared.async_redis_client import async_redis_client
+from shared.metrics import CONTENT_TYPE
+from app.snapshot import StatusSnapshot
 
 # Setup logging
 logging.basicConfig(
@@ -22,6 +33,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Same semaphore the workers hold while talking to Ollama
+llm_slots = RedisSemaphore("llm", settings.llm_max_concurrency)
+
+REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "Gateway request latency", ["method", "route", "status"]
+)
+WEBHOOKS_TOTAL = metrics.counter(
+    "webhooks_total", "Webhooks received by outcome and review mode", ["outcome", "mode"]
+)
+
+# Probed once per interval no matter how many dashboards are open
+status_snapshot = StatusSnapshot(settings.HEALTH_SNAPSHOT_INTERVAL, llm_slots)
+
+# Longest Retry-After we hand out to rejected webhooks
+MAX_RETRY_AFTER_SECONDS = 600
+
+# An SSE comment this often keeps idle streams from being cut by proxies
+EVENTS_KEEPALIVE_SECONDS = 15
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -29,15 +59,22 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("🚀 Starting API Gateway...")
     try:
-        init_db()
+        # Sync DDL, kept off the event loop
+        await run_in_threadpool(init_db)
         logger.info("✅ Database initialized")
     except Exception as e:
         logger.error(f"❌ Database init failed: {e}")
     
+    await status_snapshot.refresh()
+    status_snapshot.start()
+    
     yield
     
     # Shutdown
     logger.info("👋 API Gateway shutting down...")
+    await status_snapshot.stop()
+    await async_redis_client.close()
+    await dispose_async_engine()
 
 
 # Create FastAPI app
@@ -58,6 +95,25 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    """Time every request, labelled by route template to keep series bounded"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status=status
+        )
+
+
 @app.get("/")
 async def root():
     """Root endpoint - shows API info"""
@@ -72,20 +128,43 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Health check - verifies Redis and DB are working"""
-    redis_healthy = redis_client.health_check()
-    db_healthy = db_health_check()
-    queue_length = redis_client.get_queue_length()
+    """Health check - latest snapshot of Redis and DB status"""
+    if status_snapshot.health is None:
+        raise HTTPException(status_code=503, detail="Status not available yet")
+    return status_snapshot.health
+
+
+def over_limit(value, limit):
+    """True if a limit is enabled (non-zero) and value exceeds it"""
+    return bool(limit) and value is not None and value > limit
+
+
+def admission_decision():
+    """
+    Decide what to do with a new webhook given the current backlog
     
-    healthy = redis_healthy and db_healthy
+    Uses the status snapshot, so admission adds no Redis round trips.
     
-    return {
-        "status": "healthy" if healthy else "unhealthy",
-        "redis": redis_healthy,
-        "database": db_healthy,
-        "queue_length": queue_length,
-        "timestamp": datetime.utcnow().isoformat()
-    }
+    Returns:
+        ("accept" | "degrade" | "reject", retry-after seconds for rejections)
+    """
+    queue = status_snapshot.queue or {}
+    depth = queue.get("queue_length", 0)
+    drain = status_snapshot.drain_seconds
+    
+    if over_limit(depth, settings.ADMISSION_MAX_QUEUE_DEPTH) or \
+            over_limit(drain, settings.ADMISSION_MAX_DRAIN_SECONDS):
+        # Come back once the excess could have drained
+        retry_after = 60
+        if drain:
+            retry_after = drain - (settings.ADMISSION_MAX_DRAIN_SECONDS or drain) + 60
+        return "reject", int(min(max(retry_after, 60), MAX_RETRY_AFTER_SECONDS))
+    
+    if over_limit(depth, settings.ADMISSION_DEGRADE_QUEUE_DEPTH) or \
+            over_limit(drain, settings.ADMISSION_DEGRADE_DRAIN_SECONDS):
+        return "degrade", None
+    
+    return "accept", None
 
 
 @app.post("/webhook")
@@ -99,9 +178,27 @@ async def github_webhook(request: Request):
         
         logger.info("📨 Webhook received")
         
+        # Shed load before doing any work for this event
+        decision, retry_after = admission_decision()
+        if decision == "reject":
+            logger.warning(f"🚫 Rejected webhook, backlog over limit (retry in {retry_after}s)")
+            WEBHOOKS_TOTAL.inc(outcome="rejected", mode="none")
+            return JSONResponse(
+                content={"message": "Review queue is full, retry later"},
+                status_code=429,
+                headers={"Retry-After": str(retry_after)}
+            )
+        mode = "static_only" if decision == "degrade" else "full"
+        
         # Extract PR info
         pr_number = payload.get("number", 0)
-        pr_title = payload.get("pull_request", {}).get("title", "Unknown")
+        pull_request = payload.get("pull_request", {})
+        pr_title = pull_request.get("title", "Unknown")
+        head_sha = pull_request.get("head", {}).get("sha", "")
+        # Changed lines, used to schedule small PRs ahead of big ones
+        pr_size = None
+        if "additions" in pull_request:
+            pr_size = pull_request.get("additions", 0) + pull_request.get("deletions", 0)
         action = payload.get("action", "unknown")
         
         # Extract GitHub repository info
@@ -118,19 +215,32 @@ async def github_webhook(request: Request):
             "action": action,
             "repo_owner": repo_owner,
             "repo_name": repo_name,
+            "head_sha": head_sha,
+            "pr_size": pr_size,
+            # static_only skips the LLM while the system is overloaded
+            "mode": mode,
             "queued_at": datetime.utcnow().isoformat()
         }
         
-        # Push to Redis queue
-        success = redis_client.push_job(job_data)
+        # Push to Redis queue - repeated events for a PR that is still
+        # waiting replace the pending job instead of queueing another review
+        coalesce_key = f"{repo_owner}/{repo_name}#{pr_number}" if repo_owner and repo_name else None
+        status = await async_redis_client.push_job(job_data, coalesce_key=coalesce_key)
         
-        if success:
-            logger.info(f"✅ Queued: PR #{pr_number} (job: {job_id})")
+        if status:
+            coalesced = status == "coalesced"
+            WEBHOOKS_TOTAL.inc(outcome=status, mode=mode)
+            if coalesced:
+                logger.info(f"🔁 Coalesced: PR #{pr_number} (job: {job_id})")
+            else:
+                logger.info(f"✅ Queued: PR #{pr_number} (job: {job_id})")
             return JSONResponse(
                 content={
-                    "message": "PR queued for analysis",
+                    "message": "Pending analysis updated" if coalesced else "PR queued for analysis",
                     "pr_number": pr_number,
-                    "job_id": job_id
+                    "job_id": job_id,
+                    "coalesced": coalesced,
+                    "mode": mode
                 },
                 status_code=202  # Accepted
             )
@@ -139,22 +249,123 @@ async def github_webhook(request: Request):
     
     except Exception as e:
         logger.error(f"❌ Webhook failed: {e}")
+        WEBHOOKS_TOTAL.inc(outcome="failed", mode="none")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/queue/status")
 async def queue_status():
-    """Get current queue status"""
+    """Get current queue status from the latest snapshot"""
+    if status_snapshot.queue is None:
+        raise HTTPException(status_code=503, detail="Status not available yet")
+    return status_snapshot.queue
+
+
+@app.get("/events")
+async def status_events(request: Request):
+    """
+    Server-Sent Events stream of health and queue status
+    
+    Sends the current snapshot on connect, then again whenever it changes.
+    """
+    async def stream():
+        version = None
+        while not await request.is_disconnected():
+            if version != status_snapshot.version:
+                version = status_snapshot.version
+                data = json.dumps({"health": status_snapshot.health, "queue": status_snapshot.queue})
+                yield f"event: status\ndata: {data}\n\n"
+            elif not await status_snapshot.wait_for_change(version, EVENTS_KEEPALIVE_SECONDS):
+                yield ": keepalive\n\n"
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def encode_cursor(analysis):
+    """Opaque keyset cursor pointing just past this row"""
+    raw = f"{analysis.created_at.isoformat()}|{analysis.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor, returns (created_at, id)"""
     try:
-        queue_length = redis_client.get_queue_length()
-        return {
-            "queue_length": queue_length,
-            "status": "processing" if queue_length > 0 else "idle",
-            "timestamp": datetime.utcnow().isoformat()
-        }
+        created_at, analysis_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(analysis_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@app.get("/analyses")
+async def list_analyses(
+    repo_owner: Optional[str] = None,
+    repo_name: Optional[str] = None,
+    pr_number: Optional[int] = None,
+    status: Optional[str] = None,
+    head_sha: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None
+):
+    """
+    List reviews, newest first
+    
+    Uses keyset pagination on (created_at, id): pass next_cursor from the
+    previous page to continue. Each page is an index range scan, so deep
+    pages cost the same as the first one.
+    """
+    query = select(PRAnalysis)
+    if repo_owner:
+        query = query.where(PRAnalysis.repo_owner == repo_owner)
+    if repo_name:
+        query = query.where(PRAnalysis.repo_name == repo_name)
+    if pr_number is not None:
+        query = query.where(PRAnalysis.pr_number == pr_number)
+    if status:
+        query = query.where(PRAnalysis.status == status)
+    if head_sha:
+        query = query.where(PRAnalysis.head_sha == head_sha)
+    if cursor:
+        query = query.where(tuple_(PRAnalysis.created_at, PRAnalysis.id) < decode_cursor(cursor))
+    # One extra row tells us whether there is another page
+    query = query.order_by(PRAnalysis.created_at.desc(), PRAnalysis.id.desc()).limit(limit + 1)
+    
+    try:
+        async with AsyncSession(get_async_engine()) as session:
+            rows = (await session.execute(query)).scalars().all()
     except Exception as e:
-        logger.error(f"Failed to get queue status: {e}")
+        logger.error(f"Failed to list analyses: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    page = rows[:limit]
+    return {
+        "items": [analysis.to_dict() for analysis in page],
+        "next_cursor": encode_cursor(page[-1]) if len(rows) > limit else None
+    }
+
+
+@app.get("/analyses/{analysis_id}")
+async def get_analysis(analysis_id: int):
+    """A single review including its issues"""
+    try:
+        async with AsyncSession(get_async_engine()) as session:
+            analysis = await session.get(PRAnalysis, analysis_id)
+    except Exception as e:
+        logger.error(f"Failed to get analysis {analysis_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if analysis is None:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    return analysis.to_dict(include_issues=True)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), headers={"Content-Type": CONTENT_TYPE})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,125 @@
+"""
+Status snapshot - one background probe of Redis/DB shared by every viewer
+"""
+import asyncio
+import logging
+import sys
+from datetime import datetime
+
+sys.path.append('/app')
+
+from shared import async_db_health_check
+from shared.async_redis_client import async_redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class StatusSnapshot:
+    """Health and queue status refreshed on a fixed interval"""
+    
+    def __init__(self, interval, llm_slots):
+        """
+        Args:
+            interval: Seconds between probes
+            llm_slots: RedisSemaphore whose usage is reported with the queue
+        """
+        self.interval = interval
+        self.llm_slots = llm_slots
+        self.health = None
+        self.queue = None
+        # Estimated seconds to work through the queue (None if unknown)
+        self.drain_seconds = None
+        # Bumped whenever the content changes, so streams only push changes
+        self.version = 0
+        self._changed = asyncio.Event()
+        self._task = None
+    
+    async def refresh(self):
+        """Probe the backends once and publish the result if it changed"""
+        try:
+            (redis_healthy, db_healthy, queue_length, coalesced_events,
+             llm_stats, lanes, completion_rate) = await asyncio.gather(
+                async_redis_client.health_check(),
+                async_db_health_check(),
+                async_redis_client.get_queue_length(),
+                async_redis_client.get_coalesced_count(),
+                async_redis_client.semaphore_stats(self.llm_slots),
+                async_redis_client.get_lane_depths(),
+                async_redis_client.get_completion_rate()
+            )
+        except Exception as e:
+            logger.error(f"❌ Status refresh failed: {e}")
+            return
+        
+        healthy = redis_healthy and db_healthy
+        if completion_rate > 0:
+            self.drain_seconds = queue_length / completion_rate
+        else:
+            # No recent throughput to estimate from
+            self.drain_seconds = None
+        health = {
+            "status": "healthy" if healthy else "unhealthy",
+            "redis": bool(redis_healthy),
+            "database": db_healthy,
+            "queue_length": queue_length
+        }
+        queue = {
+            "queue_length": queue_length,
+            "status": "processing" if queue_length > 0 else "idle",
+            "coalesced_events": coalesced_events,
+            "jobs_per_minute": round(completion_rate * 60, 2),
+            "drain_seconds": round(self.drain_seconds) if self.drain_seconds is not None else None,
+            "llm": llm_stats
+        }
+        if lanes is not None:
+            queue["lanes"] = lanes
+        
+        changed = health != self._strip(self.health) or queue != self._strip(self.queue)
+        timestamp = datetime.utcnow().isoformat()
+        self.health = {**health, "timestamp": timestamp}
+        self.queue = {**queue, "timestamp": timestamp}
+        
+        if changed:
+            self.version += 1
+            # Wake every waiting stream, then arm a fresh event for the next change
+            self._changed.set()
+            self._changed = asyncio.Event()
+    
+    async def wait_for_change(self, version, timeout):
+        """
+        Wait until the snapshot is newer than version
+        
+        Returns:
+            True if it changed, False on timeout
+        """
+        if self.version != version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+    
+    def start(self):
+        """Start refreshing in the background"""
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the background refresh"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.refresh()
+    
+    def _strip(self, data):
+        """Drop the timestamp so unchanged content compares equal"""
+        if data is None:
+            return None
+        return {key: value for key, value in data.items() if key != "timestamp"}
@@ -0,0 +1,417 @@
+"""
+Fake services - Local stand-ins for GitHub, Ollama and Slack
+"""
+import difflib
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+class FakeService:
+    """Threaded HTTP server with a fixed artificial latency per request"""
+    
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        # Conditional GETs answered with 304
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        service = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def do_GET(self):
+                service._dispatch(self, "GET")
+            
+            def do_HEAD(self):
+                service._dispatch(self, "HEAD")
+            
+            def do_POST(self):
+                service._dispatch(self, "POST")
+            
+            def do_PATCH(self):
+                service._dispatch(self, "PATCH")
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    
+    def start(self):
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self.server.shutdown()
+    
+    def handle(self, method, path, body):
+        """Return (status, payload) - payload is a dict/list (JSON) or str"""
+        raise NotImplementedError
+    
+    def admit(self, method, path):
+        """Return (allowed, extra response headers) - rate limited services override this"""
+        return True, {}
+    
+    def _dispatch(self, handler, method):
+        # A HEAD is answered like a GET, minus the body
+        head = method == "HEAD"
+        if head:
+            method = "GET"
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        
+        allowed, headers = self.admit(method, handler.path)
+        if allowed:
+            status, payload = self.handle(method, handler.path, body)
+        else:
+            status, payload = 403, {"message": "API rate limit exceeded"}
+        if isinstance(payload, (dict, list)):
+            data = json.dumps(payload).encode()
+            content_type = "application/json"
+        else:
+            data = (payload or "").encode()
+            content_type = "text/plain; charset=utf-8"
+        
+        # JSON reads carry an ETag and honour If-None-Match, like the GitHub API
+        etag = None
+        if method == "GET" and status == 200 and content_type == "application/json":
+            etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+            if handler.headers.get("If-None-Match") == etag:
+                with self._lock:
+                    self.not_modified += 1
+                handler.send_response(304)
+                handler.send_header("ETag", etag)
+                for name, value in headers.items():
+                    handler.send_header(name, value)
+                handler.send_header("Content-Length", "0")
+                handler.end_headers()
+                return
+        
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(data)))
+        if etag:
+            handler.send_header("ETag", etag)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        if not head:
+            handler.wfile.write(data)
+
+
+class PRShape:
+    """Size and issue density of a generated pull request"""
+    
+    def __init__(self, files, lines_per_file, issue_density, changed_ratio=0.1):
+        """
+        Args:
+            files: Number of changed code files
+            lines_per_file: Lines in each file
+            issue_density: Fraction of lines that trigger an analysis rule
+            changed_ratio: Fraction of lines the PR adds (shows up in the patch)
+        """
+        self.files = files
+        self.lines_per_file = lines_per_file
+        self.issue_density = issue_density
+        self.changed_ratio = changed_ratio
+
+
+ISSUE_LINES = [
+    "    console.log('value', value);",
+    "    // TODO: handle the error case",
+    "    password = \"hunter2\"",
+    "    const message = '" + "x" * 130 + "';",
+]
+PLAIN_LINES = [
+    "    const total = items.reduce((sum, item) => sum + item.price, 0);",
+    "    if (!user) { return null; }",
+    "    return render(template, { user, total });",
+    "function handler(request, response) {",
+    "}",
+]
+
+
+def random_line(rng, shape):
+    return rng.choice(ISSUE_LINES) if rng.random() < shape.issue_density else rng.choice(PLAIN_LINES)
+
+
+def generate_file(shape, seed):
+    """Build file content and a unified-diff patch adding some of its lines"""
+    rng = random.Random(seed)
+    lines = [random_line(rng, shape) for _ in range(shape.lines_per_file)]
+    content = "\n".join(lines) + "\n"
+    
+    added = max(1, int(shape.lines_per_file * shape.changed_ratio))
+    start = rng.randint(1, max(1, shape.lines_per_file - added + 1))
+    hunk = [f"@@ -{start},0 +{start},{added} @@"]
+    hunk += ["+" + line for line in lines[start - 1:start - 1 + added]]
+    return content, "\n".join(hunk)
+
+
+def edit_file(content, shape, seed):
+    """Rewrite, insert and delete a few lines of a file, like a follow-up commit"""
+    rng = random.Random(seed)
+    lines = content.split("\n")[:-1]
+    for _ in range(max(1, int(shape.lines_per_file * shape.changed_ratio / 4))):
+        position = rng.randrange(len(lines) + 1)
+        action = rng.choice(("rewrite", "insert", "delete")) if position < len(lines) else "insert"
+        if action == "rewrite":
+            lines[position] = random_line(rng, shape)
+        elif action == "insert":
+            lines.insert(position, random_line(rng, shape))
+        elif len(lines) > 1:
+            del lines[position]
+    return "\n".join(lines) + "\n"
+
+
+def diff_patch(old, new):
+    """Unified-diff patch between two file contents, as GitHub's APIs return it"""
+    lines = difflib.unified_diff(old.split("\n")[:-1], new.split("\n")[:-1], lineterm="")
+    # Without the ---/+++ file header
+    return "\n".join(list(lines)[2:])
+
+
+class FakeGitHub(FakeService):
+    """Serves the subset of the GitHub REST API the worker uses"""
+    
+    def __init__(self, latency=0.0, seed=0, rate_limit=5000, rate_window=3600):
+        super().__init__(latency)
+        self.seed = seed
+        # API calls allowed per window, reported in X-RateLimit-* headers
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.rate_used = 0
+        self.rate_reset = 0
+        # Calls rejected because the limit was used up
+        self.rate_limited = 0
+        self.pulls = {}
+        # Blob contents are regenerated from their seed on request so large
+        # benchmark runs don't inflate the process's memory
+        self.blobs = {}
+        self.comments = []
+        self.comment_edits = 0
+    
+    def add_pull(self, owner, repo, number, shape, head_sha):
+        """Register a generated PR with the given shape"""
+        files = []
+        for index in range(shape.files):
+            seed = f"{self.seed}:{owner}/{repo}#{number}:{index}"
+            _, patch = generate_file(shape, seed)
+            files.append(self._make_file(owner, repo, number, index, (shape, seed, ()), patch))
+        self.pulls[(owner, repo, number)] = {
+            "files": files, "head_sha": head_sha, "shape": shape,
+            # Files at every head the PR had, for the compare API
+            "history": [(head_sha, files)]
+        }
+    
+    def push(self, owner, repo, number, head_sha, changed_files=1):
+        """Add a commit to a PR that edits a few lines of its first changed_files files"""
+        pull = self.pulls[(owner, repo, number)]
+        push_index = len(pull["history"])
+        files = list(pull["files"])
+        for index in range(min(changed_files, len(files))):
+            shape, seed, edits = self.blobs[files[index]["sha"]]
+            blob = (shape, seed, edits + (f"{seed}:push{push_index}",))
+            # The delta stands in for the patch against the PR's base
+            patch = diff_patch(self._content(files[index]["sha"]), self._blob_content(blob))
+            files[index] = self._make_file(owner, repo, number, index, blob, patch)
+        pull["files"] = files
+        pull["head_sha"] = head_sha
+        pull["history"].append((head_sha, files))
+    
+    def _make_file(self, owner, repo, number, index, blob, patch):
+        """File entry of the PR files API for a blob (shape, seed, edit seeds)"""
+        sha = hashlib.sha1(self._blob_content(blob).encode()).hexdigest()
+        self.blobs[sha] = blob
+        filename = f"src/module_{number}_{index}.js"
+        added = patch.count("\n+")
+        removed = patch.count("\n-")
+        return {
+            "sha": sha,
+            "filename": filename,
+            "status": "modified",
+            "additions": added,
+            "deletions": removed,
+            "changes": added + removed,
+            "blob_url": f"{self.url}/blob/{sha}",
+            "raw_url": f"{self.url}/raw/{owner}/{repo}/{sha}/{filename}",
+            "contents_url": f"{self.url}/contents/{filename}",
+            "patch": patch
+        }
+    
+    def _blob_content(self, blob):
+        shape, seed, edits = blob
+        content, _ = generate_file(shape, seed)
+        for edit_seed in edits:
+            content = edit_file(content, shape, edit_seed)
+        return content
+    
+    def _content(self, sha):
+        return self._blob_content(self.blobs[sha])
+    
+    def _compare(self, owner, repo, base, head):
+        """Files changed between two heads of one PR, with the diff between them"""
+        for (pull_owner, pull_repo, _), pull in self.pulls.items():
+            if (pull_owner, pull_repo) != (owner, repo):
+                continue
+            heads = [sha for sha, _ in pull["history"]]
+            if base not in heads or head not in heads:
+                continue
+            base_index, head_index = heads.index(base), heads.index(head)
+            if base_index > head_index:
+                return 200, {"status": "behind", "total_commits": 0, "files": []}
+            base_files = {file["filename"]: file["sha"] for file in pull["history"][base_index][1]}
+            changed = [
+                {**file, "patch": diff_patch(
+                    self._content(base_files[file["filename"]]), self._content(file["sha"])
+                )}
+                for file in pull["history"][head_index][1]
+                if base_files.get(file["filename"]) != file["sha"]
+            ]
+            return 200, {
+                "status": "ahead" if changed or head_index > base_index else "identical",
+                "total_commits": head_index - base_index,
+                "files": changed
+            }
+        return 404, {"message": "Not Found"}
+    
+    def admit(self, method, path):
+        # Raw downloads don't count against the API limit
+        if path.startswith("/raw/"):
+            return True, {}
+        with self._lock:
+            now = time.time()
+            if now >= self.rate_reset:
+                self.rate_used = 0
+                self.rate_reset = int(now) + self.rate_window
+            allowed = self.rate_used < self.rate_limit
+            if allowed:
+                self.rate_used += 1
+            else:
+                self.rate_limited += 1
+            remaining = self.rate_limit - self.rate_used
+        return allowed, {
+            "X-RateLimit-Limit": str(self.rate_limit),
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": str(self.rate_reset)
+        }
+    
+    def handle(self, method, path, body):
+        path, _, query = path.partition("?")
+        params = dict(parse_qsl(query))
+        
+        match = re.match(r"^/raw/[^/]+/[^/]+/([0-9a-f]+)/", path)
+        if match:
+            blob = self.blobs.get(match.group(1))
+            if blob is None:
+                return 404, "Not Found"
+            return 200, self._blob_content(blob)
+        
+        match = re.match(r"^/repos/([^/]+)/([^/]+)/issues/(\d+)/comments$", path)
+        if match and method == "POST":
+            comment_id = len(self.comments) + 1
+            self.comments.append(json.loads(body or b"{}").get("body", ""))
+            return 201, {"id": comment_id, "body": self.comments[-1],
+                         "url": f"{self.url}{path}/{comment_id}"}
+        
+        match = re.match(r"^/repos/([^/]+)/([^/]+)/issues/comments/(\d+)$", path)
+        if match and method == "PATCH":
+            comment_id = int(match.group(3))
+            if not 1 <= comment_id <= len(self.comments) or self.comments[comment_id - 1] is None:
+                return 404, {"message": "Not Found"}
+            self.comments[comment_id - 1] = json.loads(body or b"{}").get("body", "")
+            self.comment_edits += 1
+            return 200, {"id": comment_id, "body": self.comments[comment_id - 1]}
+        
+        match = re.match(r"^/repos/([^/]+)/([^/]+)/compare/([0-9a-f]+)\.\.\.([0-9a-f]+)$", path)
+        if match:
+            return self._compare(*match.groups())
+        
+        match = re.match(r"^/repos/([^/]+)/([^/]+)/pulls/(\d+)/files$", path)
+        if match:
+            pull = self.pulls.get((match.group(1), match.group(2), int(match.group(3))))
+            if not pull:
+                return 404, {"message": "Not Found"}
+            per_page = int(params.get("per_page", 30))
+            start = (int(params.get("page", 1)) - 1) * per_page
+            return 200, pull["files"][start:start + per_page]
+        
+        match = re.match(r"^/repos/([^/]+)/([^/]+)/pulls/(\d+)$", path)
+        if match:
+            owner, repo, number = match.group(1), match.group(2), int(match.group(3))
+            pull = self.pulls.get((owner, repo, number))
+            if not pull:
+                return 404, {"message": "Not Found"}
+            return 200, {
+                "number": number,
+                "url": f"{self.url}/repos/{owner}/{repo}/pulls/{number}",
+                "issue_url": f"{self.url}/repos/{owner}/{repo}/issues/{number}",
+                "state": "open",
+                "head": {"sha": pull["head_sha"]}
+            }
+        
+        match = re.match(r"^/repos/([^/]+)/([^/]+)$", path)
+        if match:
+            owner, repo = match.group(1), match.group(2)
+            return 200, {
+                "name": repo,
+                "full_name": f"{owner}/{repo}",
+                "owner": {"login": owner},
+                "url": f"{self.url}/repos/{owner}/{repo}"
+            }
+        
+        return 404, {"message": "Not Found"}
+
+
+class FakeOllama(FakeService):
+    """Answers /api/chat with a canned review after the configured latency"""
+    
+    def __init__(self, latency=0.0, parallel=None):
+        """
+        Args:
+            parallel: Generations run at once, the rest queue like on a real
+                host (None = unlimited)
+        """
+        super().__init__()
+        self.generation_latency = latency
+        self._slots = threading.Semaphore(parallel) if parallel else None
+    
+    def handle(self, method, path, body):
+        if path.startswith("/api/chat"):
+            if self._slots:
+                with self._slots:
+                    time.sleep(self.generation_latency)
+            else:
+                time.sleep(self.generation_latency)
+            request = json.loads(body or b"{}")
+            return 200, {
+                "model": request.get("model", "codellama"),
+                "message": {
+                    "role": "assistant",
+                    "content": "Overall looks reasonable. Remove debug logging and move secrets to configuration."
+                },
+                "done": True
+            }
+        if path.startswith("/api/tags"):
+            return 200, {"models": [{"name": "codellama"}]}
+        return 404, {"error": "not found"}
+
+
+class FakeSlack(FakeService):
+    """Accepts incoming-webhook posts"""
+    
+    def handle(self, method, path, body):
+        return 200, "ok"
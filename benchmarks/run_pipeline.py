@@ -0,0 +1,279 @@
+"""
+Pipeline Benchmark - Drives the real worker through local stand-ins
+
+Redis is replaced by an in-memory fakeredis server, Postgres by SQLite, and
+GitHub, Ollama and Slack by local HTTP servers with configurable latency.
+Everything else is the production worker and notifier code.
+
+Usage (from the repository root):
+    pip install -r worker/requirements.txt -r benchmarks/requirements.txt
+    python benchmarks/run_pipeline.py --jobs 50 --shape medium --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from functools import wraps
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "worker"))
+
+from fake_services import FakeGitHub, FakeOllama, FakeSlack, PRShape
+
+SHAPES = {
+    "small": PRShape(files=3, lines_per_file=200, issue_density=0.02),
+    "medium": PRShape(files=10, lines_per_file=800, issue_density=0.02),
+    "large": PRShape(files=40, lines_per_file=3000, issue_density=0.01),
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class StageTimer:
+    """Collects wall-clock samples per pipeline stage"""
+    
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+    
+    def wrap(self, stage, func):
+        """Return func instrumented to record its duration under stage"""
+        @wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return timed
+    
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+    
+    def summary(self):
+        with self._lock:
+            return {
+                stage: {
+                    "count": len(values),
+                    "mean": sum(values) / len(values),
+                    "p50": percentile(values, 50),
+                    "p95": percentile(values, 95),
+                    "p99": percentile(values, 99),
+                    "max": max(values)
+                }
+                for stage, values in sorted(self.samples.items())
+            }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--jobs", type=int, default=20, help="PRs to review")
+    parser.add_argument("--shape", choices=sorted(SHAPES), default="medium")
+    parser.add_argument("--files", type=int, help="Override files per PR")
+    parser.add_argument("--lines", type=int, help="Override lines per file")
+    parser.add_argument("--issue-density", type=float, help="Override issue density")
+    parser.add_argument("--concurrency", type=int, default=4, help="WORKER_CONCURRENCY")
+    parser.add_argument("--analysis-mode", choices=["full", "diff"], default="full")
+    parser.add_argument("--github-latency", type=float, default=0.05, help="Seconds per GitHub request")
+    parser.add_argument("--github-rate-limit", type=int, default=5000, help="GitHub API calls per window")
+    parser.add_argument("--github-rate-window", type=int, default=3600, help="Seconds per rate limit window")
+    parser.add_argument("--ollama-latency", type=float, default=1.0, help="Seconds per generation")
+    parser.add_argument("--llm-mode", choices=["summary", "chunked"], default="summary", help="LLM_REVIEW_MODE")
+    parser.add_argument("--ollama-hosts", type=int, default=1, help="Ollama hosts in the pool")
+    parser.add_argument("--ollama-parallel", type=int, help="Generations each host runs at once (default unlimited)")
+    parser.add_argument("--slack-latency", type=float, default=0.1, help="Seconds per Slack post")
+    parser.add_argument("--pushes", type=int, default=0, help="Follow-up pushes per PR after its first review")
+    parser.add_argument("--push-files", type=int, default=1, help="Files each follow-up push changes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    base = SHAPES[args.shape]
+    shape = PRShape(
+        files=args.files or base.files,
+        lines_per_file=args.lines or base.lines_per_file,
+        issue_density=base.issue_density if args.issue_density is None else args.issue_density
+    )
+    
+    github = FakeGitHub(
+        latency=args.github_latency, seed=args.seed,
+        rate_limit=args.github_rate_limit, rate_window=args.github_rate_window
+    ).start()
+    ollamas = [
+        FakeOllama(latency=args.ollama_latency, parallel=args.ollama_parallel).start()
+        for _ in range(args.ollama_hosts)
+    ]
+    slack = FakeSlack(latency=args.slack_latency).start()
+    
+    # Settings are read at import time, so configure before importing shared
+    work_dir = tempfile.mkdtemp(prefix="pipeline-bench-")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(work_dir, 'bench.db')}",
+        "GITHUB_TOKEN": "benchmark-token",
+        "GITHUB_API_URL": github.url,
+        "OLLAMA_HOSTS": ",".join(ollama.url for ollama in ollamas),
+        "SLACK_WEBHOOK_URL": f"{slack.url}/hook",
+        # One Slack post per review, so request counts match the job count
+        "NOTIFY_DIGEST_THRESHOLD": "0",
+        "WORKER_CONCURRENCY": str(args.concurrency),
+        "ANALYSIS_MODE": args.analysis_mode,
+        "LLM_REVIEW_MODE": args.llm_mode,
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    })
+    
+    import fakeredis
+    from shared import redis_client, init_db
+    redis_server = fakeredis.FakeServer()
+    redis_client.client = fakeredis.FakeRedis(server=redis_server, decode_responses=True)
+    init_db()
+    
+    from app.worker import Worker
+    from app.notifier import Notifier
+    worker = Worker()
+    
+    # Time each stage by wrapping the worker's collaborators
+    timer = StageTimer()
+    github_client = worker.github_client
+    github_client.get_pr_files = timer.wrap("github_list", github_client.get_pr_files)
+    # One sample per PR, including the file downloads streamed into the
+    # analyzer - files may be analyzed in other processes
+    worker.analysis_pool.analyze = timer.wrap("static_analysis", worker.analysis_pool.analyze)
+    worker.llm_analyzer.analyze_pr = timer.wrap("llm", worker.llm_analyzer.analyze_pr)
+    
+    finished = threading.Semaphore(0)
+    process_job = timer.wrap("total", worker.process_job)
+    
+    def process_and_count(job_data):
+        try:
+            return process_job(job_data)
+        finally:
+            finished.release()
+    
+    worker.process_job = process_and_count
+    
+    # Every PR gets a unique head SHA and title so nothing is served from cache
+    for number in range(1, args.jobs + 1):
+        head_sha = f"{number:040x}"
+        github.add_pull("bench", "repo", number, shape, head_sha)
+        redis_client.push_job({
+            "job_id": f"bench-{number}",
+            "pr_number": number,
+            "pr_title": f"Benchmark PR {number}",
+            "action": "opened",
+            "repo_owner": "bench",
+            "repo_name": "repo",
+            "head_sha": head_sha,
+            "queued_at": datetime.utcnow().isoformat()
+        })
+    
+    # The notifier runs its own event loop, like the separate service it is
+    notifier = Notifier(fakeredis.aioredis.FakeRedis(server=redis_server, decode_responses=True))
+    
+    def run_notifier():
+        asyncio.run(notifier.run())
+    
+    start = time.perf_counter()
+    threading.Thread(target=worker.run, daemon=True).start()
+    threading.Thread(target=run_notifier, daemon=True).start()
+    for _ in range(args.jobs):
+        finished.acquire()
+    first_round = time.perf_counter() - start
+    
+    # Follow-up pushes are reviewed from the previous head, one round at a time
+    for push in range(1, args.pushes + 1):
+        for number in range(1, args.jobs + 1):
+            head_sha = f"{number:020x}{push:020x}"
+            github.push("bench", "repo", number, head_sha, args.push_files)
+            redis_client.push_job({
+                "job_id": f"bench-{number}-push{push}",
+                "pr_number": number,
+                "pr_title": f"Benchmark PR {number}",
+                "action": "synchronize",
+                "repo_owner": "bench",
+                "repo_name": "repo",
+                "head_sha": head_sha,
+                "queued_at": datetime.utcnow().isoformat()
+            })
+        for _ in range(args.jobs):
+            finished.acquire()
+    elapsed = time.perf_counter() - start
+    worker.running = False
+    
+    # Comments and Slack posts still in flight once the last review is done
+    reviews = args.jobs * (1 + args.pushes)
+    deadline = time.monotonic() + 60
+    while (len(github.comments) + github.comment_edits < reviews or slack.requests < reviews) \
+            and time.monotonic() < deadline:
+        time.sleep(0.01)
+    notify_drain = time.perf_counter() - start - elapsed
+    notifier.stop()
+    
+    report = {
+        "config": {
+            "jobs": args.jobs,
+            "pushes": args.pushes,
+            "shape": args.shape,
+            "files_per_pr": shape.files,
+            "lines_per_file": shape.lines_per_file,
+            "issue_density": shape.issue_density,
+            "concurrency": args.concurrency,
+            "analysis_mode": args.analysis_mode,
+            "llm_mode": args.llm_mode,
+            "ollama_hosts": args.ollama_hosts,
+            "latency": {
+                "github": args.github_latency,
+                "ollama": args.ollama_latency,
+                "slack": args.slack_latency
+            }
+        },
+        "elapsed_seconds": elapsed,
+        "jobs_per_second": args.jobs * (1 + args.pushes) / elapsed,
+        # Mean seconds per round of follow-up pushes, next to the first round
+        "first_round_seconds": first_round,
+        "push_round_seconds": (elapsed - first_round) / args.pushes if args.pushes else None,
+        # Extra time until every comment and Slack post was delivered
+        "notify_drain_seconds": notify_drain,
+        "stages": timer.summary(),
+        "requests": {
+            "github": github.requests,
+            "github_not_modified": github.not_modified,
+            "github_rate_limited": github.rate_limited,
+            "github_comments": len(github.comments),
+            "github_comment_edits": github.comment_edits,
+            # Per host, to show how evenly generations were spread
+            "ollama": [ollama.requests for ollama in ollamas],
+            "slack": slack.requests
+        },
+        # Includes the in-process fake services, which hold no file contents
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+    
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,8 +9,11 @@ function App() {
 
   const API_URL = 'http://localhost:8000';
 
-  // Fetch data every 2 seconds
+  // Status is pushed by the gateway over Server-Sent Events; polling is
+  // only a fallback for browsers without EventSource or a closed stream
   useEffect(() => {
+    let interval = null;
+
     const fetchData = async () => {
       try {
         // Fetch health
@@ -29,10 +32,33 @@ function App() {
       }
     };
 
-    fetchData();
-    const interval = setInterval(fetchData, 2000); // Update every 2 seconds
+    const startPolling = () => {
+      if (interval) return;
+      fetchData();
+      interval = setInterval(fetchData, 5000); // Update every 5 seconds
+    };
 
-    return () => clearInterval(interval);
+    let events = null;
+    if (window.EventSource) {
+      events = new EventSource(`${API_URL}/events`);
+      events.addEventListener('status', (event) => {
+        const data = JSON.parse(event.data);
+        setHealth(data.health);
+        setQueueStatus(data.queue);
+        setLoading(false);
+      });
+      events.onerror = () => {
+        // EventSource reconnects by itself unless the stream was closed for good
+        if (events.readyState === EventSource.CLOSED) startPolling();
+      };
+    } else {
+      startPolling();
+    }
+
+    return () => {
+      if (events) events.close();
+      if (interval) clearInterval(interval);
+    };
   }, []);
 
   if (loading) {
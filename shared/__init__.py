@@ -4,6 +4,10 @@ Shared utilities package
 from shared.config import settings
 from shared.redis_client import redis_client
 from shared.database import init_db, SessionLocal, PRAnalysis, health_check as db_health_check
+from shared.database import async_health_check as async_db_health_check, dispose_async_engine
+from shared.semaphore import RedisSemaphore
+from shared.rate_budget import RateBudget, RateLimited
+from shared.metrics import metrics, start_metrics_server
 
 __all__ = [
     'settings',
@@ -11,5 +15,12 @@ __all__ = [
     'init_db',
     'SessionLocal',
     'PRAnalysis',
-    'db_health_check'
+    'db_health_check',
+    'async_db_health_check',
+    'dispose_async_engine',
+    'RedisSemaphore',
+    'RateBudget',
+    'RateLimited',
+    'metrics',
+    'start_metrics_server'
 ]
\ No newline at end of file
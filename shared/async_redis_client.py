@@ -0,0 +1,188 @@
+"""
+Async Redis client - non-blocking queue operations for the API gateway
+"""
+import json
+import logging
+import time
+import redis
+import redis.asyncio as aioredis
+from shared.config import settings
+from shared.redis_client import (
+    COALESCED_COUNTER_KEY, COMPLETIONS_KEY_PREFIX, COMPLETIONS_WINDOW_MINUTES,
+    PENDING_JOB_TTL, pending_key
+)
+from shared.scheduler import FairScheduler, LANES
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRedisClient:
+    """asyncio counterpart of RedisClient, writing the same keys"""
+    
+    def __init__(self):
+        """Create the connection pool (connections are opened on first use)"""
+        # A blocking pool makes callers wait for a free connection instead
+        # of failing when a burst of webhooks exceeds the pool size
+        self.pool = aioredis.BlockingConnectionPool.from_url(
+            settings.redis_url,
+            decode_responses=True,
+            socket_timeout=5,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT
+        )
+        self.client = aioredis.Redis(connection_pool=self.pool)
+        self.queue_name = settings.REDIS_QUEUE_NAME
+        self.backend = settings.REDIS_QUEUE_BACKEND
+        self.stream_name = f"{self.queue_name}:stream"
+        self.group_name = settings.REDIS_STREAM_GROUP
+        self._group_ready = False
+        self.scheduler = FairScheduler(self.queue_name)
+    
+    async def close(self):
+        """Close all pooled connections"""
+        await self.client.aclose()
+    
+    async def push_job(self, job_data, coalesce_key=None):
+        """
+        Push a job to the queue
+        
+        Args:
+            job_data: Dictionary with job info
+            coalesce_key: Jobs sharing this key are merged while they wait
+        
+        Returns:
+            "queued" or "coalesced" if successful, False otherwise
+        """
+        try:
+            job_json = json.dumps(job_data)
+            if coalesce_key:
+                return await self._push_coalesced(job_json, coalesce_key, job_data)
+            pipe = self.client.pipeline()
+            self._enqueue(pipe, job_json, job_data)
+            await pipe.execute()
+            return "queued"
+        except Exception as e:
+            logger.error(f"❌ Failed to queue job: {e}")
+            return False
+    
+    async def get_queue_length(self):
+        """Get how many jobs are waiting"""
+        try:
+            if self.backend == "stream":
+                await self._ensure_group()
+                pending = await self.client.xpending(self.stream_name, self.group_name)
+                length = await self.client.xlen(self.stream_name)
+                return max(0, length - pending["pending"])
+            if self.backend == "fair":
+                depths = await self.client.hvals(self.scheduler.depth_key)
+                return max(0, sum(int(depth) for depth in depths))
+            return await self.client.llen(self.queue_name)
+        except:
+            return 0
+    
+    async def get_lane_depths(self):
+        """Queued jobs and active repos per priority lane (fair backend only)"""
+        if self.backend != "fair":
+            return None
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hgetall(self.scheduler.depth_key)
+            for lane in LANES:
+                pipe.zcard(f"{self.scheduler.prefix}:{lane}:repos")
+            depths, *active_repos = await pipe.execute()
+            return self.scheduler.parse_depths(depths, active_repos)
+        except Exception as e:
+            logger.error(f"Failed to read lane depths: {e}")
+            return None
+    
+    async def get_completion_rate(self):
+        """
+        Jobs finished per second across all workers
+        
+        Averaged over the last few complete minutes, so it is 0.0 both when
+        workers are idle and when they are stuck.
+        """
+        try:
+            minute = int(time.time() // 60)
+            keys = [
+                f"{COMPLETIONS_KEY_PREFIX}:{minute - offset}"
+                for offset in range(1, COMPLETIONS_WINDOW_MINUTES + 1)
+            ]
+            counts = await self.client.mget(keys)
+            return sum(int(count or 0) for count in counts) / (COMPLETIONS_WINDOW_MINUTES * 60)
+        except Exception as e:
+            logger.error(f"Failed to read completion rate: {e}")
+            return 0.0
+    
+    async def get_coalesced_count(self):
+        """How many events were merged into an already pending job"""
+        try:
+            return int(await self.client.get(COALESCED_COUNTER_KEY) or 0)
+        except:
+            return 0
+    
+    async def semaphore_stats(self, semaphore):
+        """Current holders and waiters of a RedisSemaphore"""
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.zcount(semaphore.keys[0], time.time(), "+inf")
+            pipe.zcard(semaphore.keys[1])
+            in_flight, waiting = await pipe.execute()
+            return {"limit": semaphore.limit, "in_flight": in_flight, "waiting": waiting}
+        except Exception as e:
+            logger.error(f"Failed to read {semaphore.name} stats: {e}")
+            return {"limit": semaphore.limit, "in_flight": 0, "waiting": 0}
+    
+    async def health_check(self):
+        """Check if Redis is working"""
+        try:
+            return await self.client.ping()
+        except:
+            return False
+    
+    def _enqueue(self, pipe, entry_json, job_data):
+        """Add an entry to the queue on a pipeline"""
+        if self.backend == "stream":
+            pipe.xadd(self.stream_name, {"job": entry_json})
+        elif self.backend == "fair":
+            self.scheduler.enqueue(pipe, entry_json, job_data)
+        else:
+            pipe.rpush(self.queue_name, entry_json)
+    
+    async def _push_coalesced(self, job_json, coalesce_key, job_data):
+        """Replace a pending job's payload, or queue a reference to a new one"""
+        payload_key = pending_key(coalesce_key)
+        outcome = {}
+        
+        async def replace_or_enqueue(pipe):
+            # Runs under WATCH, retried if a worker takes the job meanwhile
+            already_pending = await pipe.exists(payload_key)
+            pipe.multi()
+            if already_pending:
+                # Keeps the TTL, so a stranded payload still runs out
+                pipe.set(payload_key, job_json, keepttl=True)
+                pipe.incr(COALESCED_COUNTER_KEY)
+            else:
+                pipe.set(payload_key, job_json, ex=PENDING_JOB_TTL)
+                self._enqueue(pipe, json.dumps({"_ref": coalesce_key}), job_data)
+            outcome["status"] = "coalesced" if already_pending else "queued"
+        
+        await self.client.transaction(replace_or_enqueue, payload_key)
+        return outcome["status"]
+    
+    async def _ensure_group(self):
+        """Create the stream consumer group on first use"""
+        if self._group_ready:
+            return
+        try:
+            await self.client.xgroup_create(
+                self.stream_name, self.group_name, id="0", mkstream=True
+            )
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+
+
+# Global async Redis client (gateway and notifier)
+async_redis_client = AsyncRedisClient()
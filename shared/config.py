@@ -11,6 +11,24 @@ class Settings:
     REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
     REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
     REDIS_QUEUE_NAME = "code_review_queue"
+    # Queue backend: "list" (RPUSH/BLPOP), "stream" (consumer group with acks)
+    # or "fair" (per-repo sub-queues in priority lanes, see shared/scheduler.py)
+    REDIS_QUEUE_BACKEND = os.getenv("REDIS_QUEUE_BACKEND", "list")
+    REDIS_STREAM_GROUP = os.getenv("REDIS_STREAM_GROUP", "code_review_workers")
+    REDIS_STREAM_BATCH_SIZE = int(os.getenv("REDIS_STREAM_BATCH_SIZE", "4"))
+    # Jobs unacknowledged for this long are reclaimed from dead consumers
+    REDIS_STREAM_CLAIM_IDLE_MS = int(os.getenv("REDIS_STREAM_CLAIM_IDLE_MS", "600000"))
+    # A job delivered this many times without an ack goes to the dead-letter
+    # stream instead of running again (0 = retry forever)
+    REDIS_STREAM_MAX_DELIVERIES = int(os.getenv("REDIS_STREAM_MAX_DELIVERIES", "5"))
+    # Fair backend: share of workers per lane, per-repo weights ("owner/repo=2,...")
+    # and the changed-line count up to which a PR counts as small (high lane)
+    SCHEDULER_LANE_WEIGHTS = os.getenv("SCHEDULER_LANE_WEIGHTS", "high=4,normal=2,bulk=1")
+    SCHEDULER_REPO_WEIGHTS = os.getenv("SCHEDULER_REPO_WEIGHTS", "")
+    SCHEDULER_SMALL_PR_LINES = int(os.getenv("SCHEDULER_SMALL_PR_LINES", "200"))
+    # Connections in the gateway's asyncio Redis pool - callers wait when all are busy
+    REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+    REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
     
     # PostgreSQL Configuration
     POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
@@ -18,28 +36,155 @@ class Settings:
     POSTGRES_DB = os.getenv("POSTGRES_DB", "code_review")
     POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
     POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "dev_password")
+    # Full SQLAlchemy URL, overrides the settings above (e.g. sqlite for benchmarks)
+    DATABASE_URL = os.getenv("DATABASE_URL", "")
+    # SQLAlchemy pool per engine (ignored for sqlite)
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    # Workers batch result writes: flush after this many jobs or seconds
+    DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "50"))
+    DB_FLUSH_INTERVAL = float(os.getenv("DB_FLUSH_INTERVAL", "1.0"))
+    # Flushes a result row may fail (e.g. a value the column rejects) before it is dropped
+    DB_MAX_ROW_ATTEMPTS = int(os.getenv("DB_MAX_ROW_ATTEMPTS", "3"))
     
     # Ollama Configuration
     OLLAMA_HOST = os.getenv("OLLAMA_HOST", "localhost")
     OLLAMA_PORT = int(os.getenv("OLLAMA_PORT", "11434"))
+    # Comma separated Ollama hosts (host:port or URL) generations are spread
+    # over, least loaded first; defaults to OLLAMA_HOST:OLLAMA_PORT
+    OLLAMA_HOSTS = os.getenv("OLLAMA_HOSTS", "")
+    OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "codellama")
+    # Seconds between health checks (0 disables them), how long a check may
+    # take, and how long a failing host is left out of rotation
+    OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+    OLLAMA_HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "3"))
+    OLLAMA_EJECT_SECONDS = int(os.getenv("OLLAMA_EJECT_SECONDS", "30"))
+    # Responses are cached by a hash of model, prompts and options (0 disables)
+    LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))
+    LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "256"))
+    # Max generations in flight per Ollama host across all workers (0 = unlimited)
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+    LLM_SLOT_WAIT_TIMEOUT = float(os.getenv("LLM_SLOT_WAIT_TIMEOUT", "120"))
+    LLM_SLOT_LEASE_SECONDS = int(os.getenv("LLM_SLOT_LEASE_SECONDS", "300"))
+    # "summary" sends the title and static analysis findings; "chunked" has
+    # the model review the diff itself, in chunks of LLM_CHUNK_TOKENS, up to
+    # LLM_TOKEN_BUDGET per PR, then merges the findings in one short prompt
+    LLM_REVIEW_MODE = os.getenv("LLM_REVIEW_MODE", "summary")
+    LLM_TOKEN_BUDGET = int(os.getenv("LLM_TOKEN_BUDGET", "16000"))
+    LLM_CHUNK_TOKENS = int(os.getenv("LLM_CHUNK_TOKENS", "2000"))
+    # Chunks of one worker process reviewed at once (slots still apply)
+    LLM_MAP_PARALLELISM = int(os.getenv("LLM_MAP_PARALLELISM", "4"))
+
+    # Worker Configuration
+    # Number of jobs a single worker process keeps in flight at once
+    WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+    # Port for the worker's Prometheus /metrics listener (0 disables it)
+    WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100"))
+
+    # Analysis Configuration
+    # "full" analyzes whole files, "diff" only the lines added by the PR
+    ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "full")
+    # Optional JSON file with extra analysis rules
+    ANALYSIS_RULES_FILE = os.getenv("ANALYSIS_RULES_FILE", "")
+    # Files are analyzed in parallel across this many processes (0 = one per CPU)
+    ANALYSIS_PROCESSES = int(os.getenv("ANALYSIS_PROCESSES", "0"))
+    # Per-PR limits: bytes of code analyzed and seconds spent (0 = unlimited).
+    # Files past the byte budget are skipped, not truncated
+    ANALYSIS_MAX_PR_BYTES = int(os.getenv("ANALYSIS_MAX_PR_BYTES", str(20 * 1024 * 1024)))
+    ANALYSIS_TIMEOUT = float(os.getenv("ANALYSIS_TIMEOUT", "60"))
+    # Largest single file analyzed, also the share of the PR budget held for
+    # a file whose size isn't known before it is downloaded
+    ANALYSIS_MAX_FILE_BYTES = int(os.getenv("ANALYSIS_MAX_FILE_BYTES", str(2 * 1024 * 1024)))
+    # Per-file results are keyed by blob SHA, so they can live a long time
+    FILE_CACHE_TTL = int(os.getenv("FILE_CACHE_TTL", str(7 * 86400)))
+    # How long a PR's last reviewed head, comment and issues are kept, so a
+    # later push only reviews the new commits and edits the same comment
+    # (0 disables incremental reviews)
+    REVIEW_STATE_TTL = int(os.getenv("REVIEW_STATE_TTL", str(30 * 86400)))
 
     # GitHub Configuration
     GITHUB_TOKEN = os.getenv("GITHUB_TOKEN", "")
+    GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+    # Parallel raw file downloads per worker process, sharing one HTTP pool
+    GITHUB_FETCH_CONCURRENCY = int(os.getenv("GITHUB_FETCH_CONCURRENCY", "8"))
+    GITHUB_FETCH_TIMEOUT = float(os.getenv("GITHUB_FETCH_TIMEOUT", "10"))
+    # API responses are revalidated with their ETag, so they can be kept long
+    GITHUB_CACHE_TTL = int(os.getenv("GITHUB_CACHE_TTL", "86400"))
+    # Seconds resolved PR metadata is reused without asking GitHub
+    GITHUB_METADATA_TTL = float(os.getenv("GITHUB_METADATA_TTL", "60"))
+    # API calls every replica shares, paced off GitHub's X-RateLimit headers:
+    # reads leave GITHUB_RATE_RESERVE calls for posting comments, may burst
+    # this many calls, and wait up to GITHUB_RATE_WAIT_TIMEOUT for budget
+    GITHUB_RATE_RESERVE = int(os.getenv("GITHUB_RATE_RESERVE", "200"))
+    GITHUB_RATE_BURST = int(os.getenv("GITHUB_RATE_BURST", "20"))
+    GITHUB_RATE_WAIT_TIMEOUT = float(os.getenv("GITHUB_RATE_WAIT_TIMEOUT", "300"))
     
     # Slack Configuration - ADD THIS!
     SLACK_WEBHOOK_URL = os.getenv("SLACK_WEBHOOK_URL", "")
 
+    # Notifier service - sends GitHub comments and Slack messages off the review path
+    NOTIFY_QUEUE_NAME = os.getenv("NOTIFY_QUEUE_NAME", "notification_queue")
+    # Requests in flight at once, over one pooled HTTP client
+    NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "8"))
+    NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5"))
+    NOTIFY_TIMEOUT = float(os.getenv("NOTIFY_TIMEOUT", "10"))
+    # Above this many Slack messages a minute they are rolled into one digest
+    # sent every NOTIFY_DIGEST_INTERVAL seconds (0 = always send individually)
+    NOTIFY_DIGEST_THRESHOLD = int(os.getenv("NOTIFY_DIGEST_THRESHOLD", "20"))
+    NOTIFY_DIGEST_INTERVAL = float(os.getenv("NOTIFY_DIGEST_INTERVAL", "60"))
+    NOTIFY_METRICS_PORT = int(os.getenv("NOTIFY_METRICS_PORT", "9101"))
+
+    # Gateway status snapshot - seconds between Redis/DB probes
+    HEALTH_SNAPSHOT_INTERVAL = float(os.getenv("HEALTH_SNAPSHOT_INTERVAL", "2"))
+
+    # Admission control at the webhook (0 disables a limit). Over the degrade
+    # limits jobs skip the LLM, over the max limits webhooks get a 429
+    ADMISSION_DEGRADE_QUEUE_DEPTH = int(os.getenv("ADMISSION_DEGRADE_QUEUE_DEPTH", "200"))
+    ADMISSION_MAX_QUEUE_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "1000"))
+    ADMISSION_DEGRADE_DRAIN_SECONDS = int(os.getenv("ADMISSION_DEGRADE_DRAIN_SECONDS", "900"))
+    ADMISSION_MAX_DRAIN_SECONDS = int(os.getenv("ADMISSION_MAX_DRAIN_SECONDS", "3600"))
+    # Workers drop jobs that waited longer than this (0 = never)
+    JOB_MAX_AGE_SECONDS = int(os.getenv("JOB_MAX_AGE_SECONDS", "3600"))
+
     # Logging
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
     
     @property
     def database_url(self):
         """Build PostgreSQL connection URL"""
+        if self.DATABASE_URL:
+            return self.DATABASE_URL
         return (
             f"postgresql://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}"
             f"@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
         )
     
+    @property
+    def async_database_url(self):
+        """Same database through an asyncio driver"""
+        url = self.database_url
+        if url.startswith("postgresql://"):
+            return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+        if url.startswith("sqlite://"):
+            return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+        return url
+    
+    @property
+    def ollama_hosts(self):
+        """Ollama hosts to spread generations over"""
+        hosts = [host.strip() for host in self.OLLAMA_HOSTS.split(",") if host.strip()]
+        return hosts or [f"{self.OLLAMA_HOST}:{self.OLLAMA_PORT}"]
+    
+    @property
+    def llm_max_concurrency(self):
+        """
+        Generations allowed in flight fleet wide - every host adds its share
+        
+        The Ollama pool still holds each host to LLM_MAX_CONCURRENCY, so
+        while a host is ejected the others don't take on its share.
+        """
+        return self.LLM_MAX_CONCURRENCY * len(self.ollama_hosts)
+    
     @property
     def redis_url(self):
         """Build Redis connection URL"""
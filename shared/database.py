@@ -1,7 +1,8 @@
 """
 Database models and connection
 """
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text
+from sqlalchemy import create_engine, inspect, Column, Integer, String, DateTime, Text, Index, JSON
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import func
@@ -11,7 +12,19 @@ from shared.config import settings
 logger = logging.getLogger(__name__)
 
 # Create database engine
-engine = create_engine(settings.database_url, pool_pre_ping=True)
+connect_args = {}
+pool_args = {"pool_size": settings.DB_POOL_SIZE, "max_overflow": settings.DB_MAX_OVERFLOW}
+if settings.database_url.startswith("sqlite"):
+    # Sessions are used from worker threads
+    connect_args = {"check_same_thread": False, "timeout": 30}
+    pool_args = {}
+engine = create_engine(
+    settings.database_url, pool_pre_ping=True, connect_args=connect_args, **pool_args
+)
+
+# asyncio engine for the gateway, created on first use so processes that
+# never need it don't have to install an async driver
+_async_engine = None
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -19,33 +32,129 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Base class for models
 Base = declarative_base()
 
+# JSONB on PostgreSQL, plain JSON elsewhere (sqlite benchmarks)
+# (None is stored as SQL NULL, not a JSON null)
+JSONType = JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql")
+
+SEVERITIES = ("high", "medium", "low", "info")
+
 
 class PRAnalysis(Base):
     """Table for storing PR analysis results"""
     __tablename__ = "pr_analyses"
     
     id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String(64))
+    repo_owner = Column(String(255))
+    repo_name = Column(String(255))
     pr_number = Column(Integer, nullable=False, index=True)
     pr_title = Column(String(500))
+    head_sha = Column(String(64))
     status = Column(String(50), default="pending")
     message = Column(Text)
+    # Seconds per pipeline stage, e.g. {"github_fetch": 0.4, "llm": 12.1}
+    stage_durations = Column(JSONType)
+    issue_count = Column(Integer, default=0)
+    issues_high = Column(Integer, default=0)
+    issues_medium = Column(Integer, default=0)
+    issues_low = Column(Integer, default=0)
+    issues_info = Column(Integer, default=0)
+    issues = Column(JSONType)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
+    __table_args__ = (
+        # One row per job - the worker's batched upserts key on it
+        Index("uq_pr_analyses_job_id", "job_id", unique=True),
+        # Recent reviews across all repos, newest first (keyset pagination on created_at, id)
+        Index("ix_pr_analyses_created", "created_at", "id"),
+        # Recent reviews for an owner's repos
+        Index("ix_pr_analyses_owner_created", "repo_owner", "created_at", "id"),
+        # Recent reviews for a repo, newest first (keyset pagination on created_at, id)
+        Index("ix_pr_analyses_repo_created", "repo_owner", "repo_name", "created_at", "id"),
+        # History of one PR
+        Index("ix_pr_analyses_repo_pr", "repo_owner", "repo_name", "pr_number", "created_at"),
+        # Recent reviews by status across all repos
+        Index("ix_pr_analyses_status_created", "status", "created_at", "id"),
+    )
+    
+    def set_issues(self, issues):
+        """Store issues along with their per-severity counts"""
+        for column, value in issue_fields(issues).items():
+            setattr(self, column, value)
+    
+    def to_dict(self, include_issues=False):
+        """JSON-friendly representation for the API"""
+        data = {
+            "id": self.id,
+            "job_id": self.job_id,
+            "repo_owner": self.repo_owner,
+            "repo_name": self.repo_name,
+            "pr_number": self.pr_number,
+            "pr_title": self.pr_title,
+            "head_sha": self.head_sha,
+            "status": self.status,
+            "message": self.message,
+            "stage_durations": self.stage_durations,
+            "issue_counts": {
+                "total": self.issue_count or 0,
+                **{severity: getattr(self, f"issues_{severity}") or 0 for severity in SEVERITIES}
+            },
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+        if include_issues:
+            data["issues"] = self.issues or []
+        return data
+    
     def __repr__(self):
         return f"<PRAnalysis(pr_number={self.pr_number}, status={self.status})>"
 
 
+def issue_fields(issues):
+    """Column values for a list of issues: the issues and per-severity counts"""
+    fields = {"issues": issues, "issue_count": len(issues)}
+    for severity in SEVERITIES:
+        fields[f"issues_{severity}"] = sum(1 for i in issues if i.get("severity") == severity)
+    return fields
+
+
 def init_db():
     """Create all database tables"""
     try:
         Base.metadata.create_all(bind=engine)
+        _upgrade_schema()
         logger.info("✅ Database tables created")
     except Exception as e:
         logger.error(f"❌ Database initialization failed: {e}")
         raise
 
 
+def _upgrade_schema():
+    """
+    Bring tables created by older versions up to date
+    
+    create_all() only creates missing tables, so columns and indexes added
+    to existing models since are added here.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        with engine.begin() as conn:
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.exec_driver_sql(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                )
+                logger.info(f"Added column {table.name}.{column.name}")
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
 def health_check():
     """Check if database is accessible"""
     db = None
@@ -60,4 +169,35 @@ def health_check():
         return False
     finally:
         if db:
-            db.close()
\ No newline at end of file
+            db.close()
+
+
+def get_async_engine():
+    """Lazily create the asyncio engine (asyncpg for PostgreSQL)"""
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        _async_engine = create_async_engine(
+            settings.async_database_url, pool_pre_ping=True, **pool_args
+        )
+    return _async_engine
+
+
+async def dispose_async_engine():
+    """Close the asyncio engine's pooled connections"""
+    global _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+
+
+async def async_health_check():
+    """Check if database is accessible without blocking the event loop"""
+    try:
+        from sqlalchemy import text
+        async with get_async_engine().connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        return True
+    except Exception as e:
+        logger.error(f"Database health check failed: {e}")
+        return False
\ No newline at end of file
@@ -0,0 +1,256 @@
+"""
+Rate budget - paces calls to a rate-limited API across all services
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from shared.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Longest single sleep while waiting, so a waiter notices budget freed early
+MAX_SLEEP_SECONDS = 5
+
+# How long to back off after a secondary rate limit that gives no Retry-After
+DEFAULT_BLOCK_SECONDS = 60
+
+# KEYS: budget state hash
+# ARGV: cost, floor (budget the call must leave untouched), burst, pace (1/0)
+#
+# The state mirrors the API's own counter: remaining calls until the window
+# resets. Paced calls earn tokens at the rate that spreads what is left above
+# the floor evenly over the rest of the window, so the fleet slows down
+# gradually instead of running dry early. Returns "0" if the call may go
+# ahead, otherwise the seconds to wait (as a string, Lua numbers lose the
+# fraction in a reply).
+ACQUIRE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'remaining', 'reset', 'tokens', 'last', 'blocked_until')
+
+local blocked_until = tonumber(state[5] or '0')
+if now < blocked_until then
+    return tostring(blocked_until - now)
+end
+
+local remaining = tonumber(state[1])
+local reset = tonumber(state[2])
+if remaining == nil or reset == nil or now >= reset then
+    -- No current window known, the response headers will tell us
+    return '0'
+end
+
+local cost = tonumber(ARGV[1])
+local floor = tonumber(ARGV[2])
+if remaining - cost < floor then
+    return tostring(reset - now)
+end
+
+if ARGV[4] == '1' then
+    local burst = tonumber(ARGV[3])
+    local rate = (remaining - floor) / math.max(reset - now, 1)
+    local tokens = tonumber(state[3] or ARGV[3])
+    local last = tonumber(state[4] or tostring(now))
+    tokens = math.min(burst, tokens + math.max(now - last, 0) * rate)
+    if tokens < cost then
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'last', tostring(now))
+        return tostring((cost - tokens) / rate)
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - cost), 'last', tostring(now))
+end
+redis.call('HSET', KEYS[1], 'remaining', tostring(remaining - cost))
+return '0'
+"""
+
+# KEYS: budget state hash
+# ARGV: remaining and reset (epoch seconds) from the response, or empty;
+#       seconds to block everyone for (0 = no block); calls to give back
+#       (1 for a response the API doesn't count, such as a 304), burst
+#
+# A call given back is returned to the window it was taken from, pacing
+# tokens included. Within a window the lower count then wins: calls counted
+# locally may not have reached the API yet when an older response reports a
+# higher number.
+UPDATE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1])
+local block = tonumber(ARGV[3])
+local refund = tonumber(ARGV[4])
+if refund > 0 then
+    local state = redis.call('HMGET', KEYS[1], 'remaining', 'reset', 'tokens')
+    local known = tonumber(state[1])
+    local reset = tonumber(state[2])
+    if known ~= nil and reset ~= nil and now < reset then
+        redis.call('HSET', KEYS[1], 'remaining', tostring(known + refund))
+        if state[3] then
+            local tokens = math.min(tonumber(ARGV[5]), tonumber(state[3]) + refund)
+            redis.call('HSET', KEYS[1], 'tokens', tostring(tokens))
+        end
+    end
+end
+if block > 0 then
+    local until_ = now + block
+    local current = tonumber(redis.call('HGET', KEYS[1], 'blocked_until') or '0')
+    if until_ > current then
+        redis.call('HSET', KEYS[1], 'blocked_until', tostring(until_))
+    end
+end
+
+if ARGV[1] ~= '' and ARGV[2] ~= '' then
+    local remaining = tonumber(ARGV[1])
+    local reset = tonumber(ARGV[2])
+    local state = redis.call('HMGET', KEYS[1], 'remaining', 'reset')
+    local known = tonumber(state[1])
+    if known == nil or tonumber(state[2]) ~= reset or remaining < known then
+        redis.call('HSET', KEYS[1], 'remaining', tostring(remaining), 'reset', tostring(reset))
+    end
+end
+redis.call('EXPIRE', KEYS[1], 7200)
+return 1
+"""
+
+
+class RateLimited(Exception):
+    """No budget within the time the caller was willing to wait"""
+    
+    def __init__(self, retry_after):
+        super().__init__(f"rate limit budget exhausted, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def rate_limit_block(response):
+    """
+    Seconds to stop calling after a rate-limited response (0 if it wasn't)
+    
+    Works with requests and httpx responses alike.
+    """
+    if response.status_code not in (403, 429):
+        return 0
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(1, int(float(retry_after)))
+        except ValueError:
+            return DEFAULT_BLOCK_SECONDS
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        # Primary limit - the remaining count already holds callers until reset
+        return 0
+    if "rate limit" in response.text.lower():
+        # Secondary limit without a Retry-After
+        return DEFAULT_BLOCK_SECONDS
+    return 0
+
+
+class RateBudget:
+    """Shared budget for one API credential, fed by its X-RateLimit-* headers"""
+    
+    def __init__(self, name, credential, reserve=0, burst=20, redis=None):
+        """
+        Args:
+            name: Redis key prefix for this budget
+            credential: Token the budget belongs to (only a hash is stored)
+            reserve: Calls kept back for writes - reads never dip below it
+            burst: Reads allowed back to back before pacing kicks in
+            redis: Client to use - an asyncio client for the *_async methods
+                (defaults to the shared sync client)
+        """
+        self.name = name
+        self.reserve = reserve
+        self.burst = max(1, burst)
+        self.redis = redis
+        digest = hashlib.sha1(credential.encode()).hexdigest()[:12]
+        self.keys = [f"rate_budget:{name}:{digest}"]
+        client = redis or redis_client.client
+        self._acquire = client.register_script(ACQUIRE_SCRIPT)
+        self._update = client.register_script(UPDATE_SCRIPT)
+    
+    def acquire(self, write=False, timeout=None):
+        """
+        Wait until one more call fits the budget
+        
+        Args:
+            write: Writes may use the reserve and aren't paced
+            timeout: Max seconds to wait (None = as long as it takes)
+        
+        Returns:
+            Seconds spent waiting
+        
+        Raises:
+            RateLimited: If the budget won't allow a call within timeout
+        """
+        start = time.monotonic()
+        while True:
+            try:
+                wait = float(self._acquire(
+                    keys=self.keys, args=self._args(write), client=self._client()
+                ))
+            except Exception as e:
+                # Redis trouble shouldn't stop GitHub calls - the API still enforces its limit
+                logger.error(f"Failed to check {self.name} rate budget: {e}")
+                return time.monotonic() - start
+            if wait <= 0:
+                return time.monotonic() - start
+            
+            waited = time.monotonic() - start
+            if timeout is not None and waited + wait > timeout:
+                raise RateLimited(wait)
+            time.sleep(min(wait, MAX_SLEEP_SECONDS))
+    
+    async def acquire_async(self, write=False, timeout=None):
+        """acquire() for asyncio callers"""
+        start = time.monotonic()
+        while True:
+            try:
+                wait = float(await self._acquire(keys=self.keys, args=self._args(write)))
+            except Exception as e:
+                logger.error(f"Failed to check {self.name} rate budget: {e}")
+                return time.monotonic() - start
+            if wait <= 0:
+                return time.monotonic() - start
+            
+            waited = time.monotonic() - start
+            if timeout is not None and waited + wait > timeout:
+                raise RateLimited(wait)
+            await asyncio.sleep(min(wait, MAX_SLEEP_SECONDS))
+    
+    def update(self, response):
+        """
+        Record what a response said about the budget
+        
+        Returns:
+            True if the response was rate limited
+        """
+        args, block = self._update_args(response)
+        try:
+            self._update(keys=self.keys, args=args, client=self._client())
+        except Exception as e:
+            logger.error(f"Failed to update {self.name} rate budget: {e}")
+        return block > 0 or response.status_code in (403, 429) and args[0] == "0"
+    
+    async def update_async(self, response):
+        """update() for asyncio callers"""
+        args, block = self._update_args(response)
+        try:
+            await self._update(keys=self.keys, args=args)
+        except Exception as e:
+            logger.error(f"Failed to update {self.name} rate budget: {e}")
+        return block > 0 or response.status_code in (403, 429) and args[0] == "0"
+    
+    def _client(self):
+        return self.redis or redis_client.client
+    
+    def _args(self, write):
+        if write:
+            return [1, 0, self.burst, 0]
+        return [1, self.reserve, self.burst, 1]
+    
+    def _update_args(self, response):
+        block = rate_limit_block(response)
+        if block:
+            logger.warning(f"⚠️  {self.name} rate limited, pausing all callers for {block}s")
+        remaining = response.headers.get("X-RateLimit-Remaining") or ""
+        reset = response.headers.get("X-RateLimit-Reset") or ""
+        # GitHub doesn't count conditional requests answered with a 304
+        refund = 1 if response.status_code == 304 else 0
+        return [remaining, reset, block, refund, self.burst], block
\ No newline at end of file
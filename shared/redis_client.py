@@ -2,13 +2,126 @@
 Redis client for message queue operations
 """
 import json
+import os
+import socket
+import threading
+import time
+from collections import deque
 import redis
 import logging
 from shared.config import settings
+from shared.scheduler import FairScheduler, POP_SCRIPT, PROMOTE_SCRIPT
 
 logger = logging.getLogger(__name__)
 
 
+# How often a consumer looks for jobs abandoned by dead consumers
+CLAIM_INTERVAL_SECONDS = 30
+
+# Dead-lettered jobs kept for inspection
+DEAD_LETTER_MAXLEN = 10000
+
+# Safety net so a lost queue entry can't swallow a PR's events forever.
+# Set when the payload is first queued; coalescing doesn't extend it.
+PENDING_JOB_TTL = 86400
+PENDING_KEY_PREFIX = "job_pending"
+COALESCED_COUNTER_KEY = "stats:coalesced_events"
+
+# Jobs finished per minute, used to estimate how long the backlog takes to drain
+COMPLETIONS_KEY_PREFIX = "stats:completed"
+COMPLETIONS_WINDOW_MINUTES = 5
+
+# Swap a stream entry's reference for its latest payload. The payload moves
+# to an in-flight hash so a reclaimed entry still finds it after a crash.
+# KEYS: pending payload, in-flight hash   ARGV: stream entry id
+RESOLVE_REF_SCRIPT = """
+local payload = redis.call('GET', KEYS[1])
+if payload then
+    redis.call('DEL', KEYS[1])
+    redis.call('HSET', KEYS[2], ARGV[1], payload)
+    return payload
+end
+return redis.call('HGET', KEYS[2], ARGV[1])
+"""
+
+# Reset the idle time of entries a consumer still owns, so XAUTOCLAIM doesn't
+# hand a job that is still running to another worker. JUSTID leaves the
+# delivery count alone; entries another consumer took over are skipped.
+# KEYS: stream   ARGV: group, consumer, entry ids
+TOUCH_SCRIPT = """
+local owned = {}
+for i = 3, #ARGV do
+    if #redis.call('XPENDING', KEYS[1], ARGV[1], ARGV[i], ARGV[i], 1, ARGV[2]) > 0 then
+        table.insert(owned, ARGV[i])
+    end
+end
+if #owned > 0 then
+    table.insert(owned, 'JUSTID')
+    redis.call('XCLAIM', KEYS[1], ARGV[1], ARGV[2], 0, unpack(owned))
+    return #owned - 1
+end
+return 0
+"""
+
+# The job a list or fair queue entry stands for. A coalesced job's entry only
+# holds a reference; its payload is taken in the same step as the entry, so a
+# worker dying in between can't strand it (events coalesced into a stranded
+# payload would never be queued).
+RESOLVE_ENTRY_LUA = """
+local function resolve(entry)
+    if not entry or string.sub(entry, 1, 9) ~= '{"_ref": ' then
+        return entry
+    end
+    local key = '%s:' .. cjson.decode(entry)['_ref']
+    local payload = redis.call('GET', key)
+    redis.call('DEL', key)
+    return payload
+end
+""" % PENDING_KEY_PREFIX
+
+# KEYS: queue list
+LIST_POP_SCRIPT = RESOLVE_ENTRY_LUA + """
+return resolve(redis.call('LPOP', KEYS[1]))
+"""
+
+# The scheduler's pop, with the entry resolved like LIST_POP_SCRIPT's
+FAIR_POP_SCRIPT = RESOLVE_ENTRY_LUA + """
+local function pop()
+%s
+end
+local result = pop()
+if not result then
+    return false
+end
+result[1] = resolve(result[1])
+return result
+""" % POP_SCRIPT
+
+
+# Record a review in a PR's review state, unless a review of a later event
+# is recorded already - a slow review of an older head must not move it back.
+# KEYS: review state hash   ARGV: the review's queue time, TTL, field/value pairs
+SET_REVIEW_STATE_SCRIPT = """
+local recorded = tonumber(redis.call('HGET', KEYS[1], 'queued_at') or '0')
+if recorded > tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'queued_at', ARGV[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def pending_key(coalesce_key):
+    """Key holding the latest payload of a coalesced job"""
+    return f"{PENDING_KEY_PREFIX}:{coalesce_key}"
+
+
+def review_state_key(repo_owner, repo_name, pr_number):
+    """Hash with a PR's last reviewed head SHA, its issues and the review comment id"""
+    return f"pr_review:{repo_owner}/{repo_name}#{pr_number}"
+
+
 class RedisClient:
     """Simple Redis queue client"""
     
@@ -20,23 +133,61 @@ class RedisClient:
             socket_timeout=5
         )
         self.queue_name = settings.REDIS_QUEUE_NAME
-        logger.info(f"Redis connected: {settings.REDIS_HOST}")
+        self.backend = settings.REDIS_QUEUE_BACKEND
+        
+        # Stream backend state
+        self.stream_name = f"{self.queue_name}:stream"
+        self.inflight_name = f"{self.stream_name}:inflight"
+        self.dead_letter_name = f"{self.stream_name}:dead"
+        self.group_name = settings.REDIS_STREAM_GROUP
+        self.consumer_name = f"{socket.gethostname()}-{os.getpid()}"
+        self._buffer = deque()
+        self._buffer_lock = threading.Lock()
+        self._group_ready = False
+        self._last_claim = 0.0
+        # Entries delivered to this consumer and not acknowledged yet
+        self._held = set()
+        self._resolve_ref = self.client.register_script(RESOLVE_REF_SCRIPT)
+        self._touch = self.client.register_script(TOUCH_SCRIPT)
+        self._list_pop = self.client.register_script(LIST_POP_SCRIPT)
+        
+        # Fair backend state
+        self.scheduler = FairScheduler(self.queue_name)
+        self._fair_pop = self.client.register_script(FAIR_POP_SCRIPT)
+        self._fair_promote = self.client.register_script(PROMOTE_SCRIPT)
+        
+        self._set_review_state = self.client.register_script(SET_REVIEW_STATE_SCRIPT)
+        
+        logger.info(f"Redis connected: {settings.REDIS_HOST} (queue backend: {self.backend})")
     
-    def push_job(self, job_data):
+    def push_job(self, job_data, coalesce_key=None):
         """
         Push a job to the queue
         
         Args:
             job_data: Dictionary with job info
+            coalesce_key: Jobs sharing this key (e.g. the same PR) are merged
+                while they wait - a newer job replaces the pending payload
+                instead of adding another queue entry
         
         Returns:
-            True if successful
+            "queued" or "coalesced" if successful, False otherwise
         """
         try:
             job_json = json.dumps(job_data)
-            self.client.rpush(self.queue_name, job_json)
-            logger.info(f"✅ Job queued: PR #{job_data.get('pr_number')}")
-            return True
+            if coalesce_key:
+                status = self._push_coalesced(job_json, coalesce_key, job_data)
+            else:
+                pipe = self.client.pipeline()
+                self._enqueue(pipe, job_json, job_data)
+                pipe.execute()
+                status = "queued"
+            
+            if status == "coalesced":
+                logger.info(f"🔁 Job coalesced into pending review: PR #{job_data.get('pr_number')}")
+            else:
+                logger.info(f"✅ Job queued: PR #{job_data.get('pr_number')}")
+            return status
         except Exception as e:
             logger.error(f"❌ Failed to queue job: {e}")
             return False
@@ -45,6 +196,9 @@ class RedisClient:
         """
         Get a job from the queue (waits up to timeout seconds)
         
+        With the stream backend the job stays pending until ack_job()
+        is called, so it is reclaimed if this worker dies mid-job.
+        
         Args:
             timeout: How long to wait for a job
         
@@ -52,24 +206,334 @@ class RedisClient:
             Job data dictionary or None
         """
         try:
-            result = self.client.blpop(self.queue_name, timeout=timeout)
-            if result:
-                _, job_json = result
-                job_data = json.loads(job_json)
+            if self.backend == "stream":
+                job_data = self._pop_stream_job(timeout)
+            else:
+                if self.backend == "fair":
+                    job_json = self._pop_fair_entry(timeout)
+                else:
+                    job_json = self._pop_list_entry(timeout)
+                job_data = json.loads(job_json) if job_json else None
+            
+            if job_data:
                 logger.info(f"📥 Job received: PR #{job_data.get('pr_number')}")
-                return job_data
-            return None
+            return job_data
         except Exception as e:
             logger.error(f"❌ Failed to get job: {e}")
             return None
     
+    def ack_job(self, job_data):
+        """
+        Mark a job as finished so it is not redelivered
+        
+        Args:
+            job_data: Job dictionary returned by pop_job
+        
+        Returns:
+            True if successful
+        """
+        stream_id = job_data.get("_stream_id")
+        if self.backend != "stream" or not stream_id:
+            return True
+        
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.xack(self.stream_name, self.group_name, stream_id)
+            pipe.xdel(self.stream_name, stream_id)
+            pipe.hdel(self.inflight_name, stream_id)
+            pipe.execute()
+            with self._buffer_lock:
+                self._held.discard(stream_id)
+            return True
+        except Exception as e:
+            logger.error(f"❌ Failed to ack job {stream_id}: {e}")
+            return False
+    
     def get_queue_length(self):
         """Get how many jobs are waiting"""
         try:
+            if self.backend == "stream":
+                # Acked entries are deleted, so waiting = total - delivered
+                self._ensure_group()
+                pending = self.client.xpending(self.stream_name, self.group_name)
+                return max(0, self.client.xlen(self.stream_name) - pending["pending"])
+            if self.backend == "fair":
+                depths = self.client.hvals(self.scheduler.depth_key)
+                return max(0, sum(int(depth) for depth in depths))
             return self.client.llen(self.queue_name)
         except:
             return 0
     
+    def record_completion(self):
+        """Count a finished job towards the current minute's throughput"""
+        key = f"{COMPLETIONS_KEY_PREFIX}:{int(time.time() // 60)}"
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.incr(key)
+            pipe.expire(key, (COMPLETIONS_WINDOW_MINUTES + 1) * 60)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to record completion: {e}")
+    
+    def push_notifications(self, messages):
+        """
+        Hand messages to the notifier service
+        
+        Args:
+            messages: List of notification dicts (see worker/app/notifier.py)
+        
+        Returns:
+            True if successful
+        """
+        if not messages:
+            return True
+        try:
+            queued_at = time.time()
+            self.client.rpush(
+                settings.NOTIFY_QUEUE_NAME,
+                *[json.dumps({**message, "queued_at": queued_at}) for message in messages]
+            )
+            return True
+        except Exception as e:
+            logger.error(f"❌ Failed to queue notifications: {e}")
+            return False
+    
+    def get_review_state(self, key):
+        """Last review of a PR (see review_state_key), {} if there is none"""
+        try:
+            return self.client.hgetall(key)
+        except Exception as e:
+            logger.error(f"Failed to read review state {key}: {e}")
+            return {}
+    
+    def set_review_state(self, key, queued_at, **fields):
+        """
+        Record a review in a PR's review state and renew its TTL
+        
+        Args:
+            key: See review_state_key
+            queued_at: When the reviewed event was queued (epoch seconds)
+            fields: Fields to set
+        
+        Returns:
+            True if recorded, False if a review of a later event is recorded
+            already, None if Redis failed
+        """
+        args = [queued_at, settings.REVIEW_STATE_TTL]
+        for field, value in fields.items():
+            args += [field, value]
+        try:
+            return bool(self._set_review_state(keys=[key], args=args, client=self.client))
+        except Exception as e:
+            logger.error(f"Failed to save review state {key}: {e}")
+            return None
+    
+    def get_coalesced_count(self):
+        """How many events were merged into an already pending job"""
+        try:
+            return int(self.client.get(COALESCED_COUNTER_KEY) or 0)
+        except:
+            return 0
+    
+    def _enqueue(self, pipe, entry_json, job_data):
+        """Add an entry to the queue on a pipeline"""
+        if self.backend == "stream":
+            pipe.xadd(self.stream_name, {"job": entry_json})
+        elif self.backend == "fair":
+            self.scheduler.enqueue(pipe, entry_json, job_data)
+        else:
+            pipe.rpush(self.queue_name, entry_json)
+    
+    def _pop_list_entry(self, timeout):
+        """Wait for an entry, then take it and resolve its reference in one step"""
+        # Moving the head back onto the head blocks like BLPOP but leaves the
+        # entry in place for the script
+        if self.client.blmove(self.queue_name, self.queue_name, timeout, "LEFT", "LEFT") is None:
+            return None
+        return self._list_pop(keys=[self.queue_name], client=self.client)
+    
+    def _pop_fair_entry(self, timeout):
+        """Wait for a wake-up, then take the next entry the scheduler picks"""
+        # Also try after a timeout, in case a wake-up was lost with a worker
+        self.client.blpop(self.scheduler.signal_key, timeout=timeout)
+        result = self._fair_pop(
+            keys=self.scheduler.pop_keys(),
+            args=self.scheduler.pop_args(),
+            client=self.client
+        )
+        if not result:
+            return None
+        entry_json, lane, repo = result
+        logger.debug(f"Scheduled {repo} from {lane} lane")
+        return entry_json
+    
+    def _push_coalesced(self, job_json, coalesce_key, job_data):
+        """Replace a pending job's payload, or queue a reference to a new one"""
+        payload_key = pending_key(coalesce_key)
+        entry_json = json.dumps({"_ref": coalesce_key})
+        outcome = {}
+        
+        def replace_or_enqueue(pipe):
+            # Runs under WATCH, retried if a worker takes the job meanwhile
+            already_pending = pipe.exists(payload_key)
+            pipe.multi()
+            if already_pending:
+                # Keeps the TTL, so a stranded payload still runs out
+                pipe.set(payload_key, job_json, keepttl=True)
+                pipe.incr(COALESCED_COUNTER_KEY)
+                if self.backend == "fair":
+                    # The entry waits in the most urgent lane of its events
+                    self._fair_promote(
+                        keys=self.scheduler.promote_keys(),
+                        args=self.scheduler.promote_args(entry_json, job_data),
+                        client=pipe
+                    )
+            else:
+                pipe.set(payload_key, job_json, ex=PENDING_JOB_TTL)
+                self._enqueue(pipe, entry_json, job_data)
+            outcome["status"] = "coalesced" if already_pending else "queued"
+        
+        self.client.transaction(replace_or_enqueue, payload_key)
+        return outcome["status"]
+    
+    def _ensure_group(self):
+        """Create the stream consumer group on first use"""
+        if self._group_ready:
+            return
+        try:
+            self.client.xgroup_create(
+                self.stream_name, self.group_name, id="0", mkstream=True
+            )
+            logger.info(f"Created consumer group: {self.group_name}")
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+        threading.Thread(target=self._keep_jobs_claimed, name="stream-touch", daemon=True).start()
+    
+    def _keep_jobs_claimed(self):
+        """Keep the idle time of held jobs well below the reclaim threshold"""
+        interval = max(1, min(CLAIM_INTERVAL_SECONDS, settings.REDIS_STREAM_CLAIM_IDLE_MS / 3000))
+        while True:
+            time.sleep(interval)
+            with self._buffer_lock:
+                held = list(self._held)
+            if not held:
+                continue
+            try:
+                self._touch(
+                    keys=[self.stream_name],
+                    args=[self.group_name, self.consumer_name, *held],
+                    client=self.client
+                )
+            except Exception as e:
+                logger.error(f"Failed to refresh {len(held)} running jobs: {e}")
+    
+    def _pop_stream_job(self, timeout):
+        """Return the next buffered job, reading a new batch when empty"""
+        job_data = self._next_buffered_job()
+        if job_data:
+            return job_data
+        
+        self._ensure_group()
+        
+        entries = self._claim_stale_jobs()
+        if not entries:
+            result = self.client.xreadgroup(
+                self.group_name,
+                self.consumer_name,
+                {self.stream_name: ">"},
+                count=settings.REDIS_STREAM_BATCH_SIZE,
+                block=int(timeout * 1000)
+            )
+            if result:
+                _, entries = result[0]
+        
+        with self._buffer_lock:
+            self._buffer.extend(entries or [])
+            self._held.update(entry_id for entry_id, _ in entries or [])
+        return self._next_buffered_job()
+    
+    def _next_buffered_job(self):
+        """Decode buffered entries until one turns into a job"""
+        while True:
+            with self._buffer_lock:
+                if not self._buffer:
+                    return None
+                entry_id, fields = self._buffer.popleft()
+            
+            job_data = self._decode_stream_entry(entry_id, fields)
+            if job_data:
+                return job_data
+    
+    def _claim_stale_jobs(self):
+        """Take over jobs left unacknowledged by consumers that went away"""
+        now = time.time()
+        if now - self._last_claim < CLAIM_INTERVAL_SECONDS:
+            return []
+        self._last_claim = now
+        
+        result = self.client.xautoclaim(
+            self.stream_name,
+            self.group_name,
+            self.consumer_name,
+            min_idle_time=settings.REDIS_STREAM_CLAIM_IDLE_MS,
+            count=settings.REDIS_STREAM_BATCH_SIZE
+        )
+        entries = [(entry_id, fields) for entry_id, fields in result[1] if fields]
+        if entries and settings.REDIS_STREAM_MAX_DELIVERIES:
+            entries = self._dead_letter_exhausted(entries)
+        if entries:
+            logger.warning(f"♻️  Reclaimed {len(entries)} stale jobs")
+        return entries
+    
+    def _dead_letter_exhausted(self, entries):
+        """Move reclaimed jobs that were delivered too often to the dead-letter stream"""
+        pipe = self.client.pipeline(transaction=False)
+        for entry_id, _ in entries:
+            pipe.xpending_range(self.stream_name, self.group_name, min=entry_id, max=entry_id, count=1)
+        pending = pipe.execute()
+        
+        retried = []
+        for (entry_id, fields), info in zip(entries, pending):
+            deliveries = info[0]["times_delivered"] if info else 0
+            if deliveries <= settings.REDIS_STREAM_MAX_DELIVERIES:
+                retried.append((entry_id, fields))
+                continue
+            # A coalesced job's payload is in the in-flight hash by now
+            payload = self.client.hget(self.inflight_name, entry_id) or fields["job"]
+            pipe = self.client.pipeline(transaction=True)
+            pipe.xadd(
+                self.dead_letter_name,
+                {"job": payload, "entry_id": entry_id, "deliveries": deliveries},
+                maxlen=DEAD_LETTER_MAXLEN, approximate=True
+            )
+            pipe.xack(self.stream_name, self.group_name, entry_id)
+            pipe.xdel(self.stream_name, entry_id)
+            pipe.hdel(self.inflight_name, entry_id)
+            pipe.execute()
+            logger.error(f"☠️  Job {entry_id} failed {deliveries - 1} times, moved to {self.dead_letter_name}")
+        return retried
+    
+    def _decode_stream_entry(self, entry_id, fields):
+        """Turn a stream entry into job data, remembering its id for ack"""
+        job_data = json.loads(fields["job"])
+        
+        if "_ref" in job_data:
+            payload = self._resolve_ref(
+                keys=[pending_key(job_data["_ref"]), self.inflight_name],
+                args=[entry_id],
+                client=self.client
+            )
+            if payload is None:
+                logger.warning(f"Dropping queue entry {entry_id}: job payload is gone")
+                self.ack_job({"_stream_id": entry_id})
+                return None
+            job_data = json.loads(payload)
+        
+        job_data["_stream_id"] = entry_id
+        return job_data
+    
     def health_check(self):
         """Check if Redis is working"""
         try:
@@ -94,6 +558,31 @@ class RedisClient:
         except Exception as e:
             logger.error(f"Cache set failed for {key}: {e}")
             return False
+    
+    def cache_get_many(self, keys):
+        """Get several cached values in one round trip (None for misses)"""
+        if not keys:
+            return []
+        try:
+            return self.client.mget([f"cache:{key}" for key in keys])
+        except Exception as e:
+            logger.error(f"Cache get failed for {len(keys)} keys: {e}")
+            return [None] * len(keys)
+    
+    def cache_set_many(self, items, ttl=3600):
+        """Set several cached values with the same TTL in one round trip"""
+        if not items:
+            return True
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key, value in items.items():
+                pipe.setex(f"cache:{key}", ttl, value)
+            pipe.execute()
+            logger.info(f"Cached {len(items)} keys (TTL: {ttl}s)")
+            return True
+        except Exception as e:
+            logger.error(f"Cache set failed for {len(items)} keys: {e}")
+            return False
 
 
 # Global Redis client
@@ -0,0 +1,190 @@
+"""
+Fair scheduler - per-repo sub-queues served round-robin across priority lanes
+"""
+import logging
+from shared.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Served most often first. Weights come from SCHEDULER_LANE_WEIGHTS.
+LANES = ("high", "normal", "bulk")
+
+# Events a reviewer is waiting on right now
+HIGH_PRIORITY_ACTIONS = ("opened", "reopened", "ready_for_review")
+
+# Pick a lane, then the repo in that lane with the lowest virtual time.
+# Each pop advances the lane by 1/lane weight and the repo by 1/repo weight,
+# so a repo with a thousand queued PRs gets the same turns as one with a
+# single PR, and lanes share workers in proportion to their weights.
+#
+# KEYS: lane virtual times (hash), lane depths (hash), repo weights (hash),
+#       wake-up signal list
+# ARGV: key prefix, then lane name / weight pairs
+POP_SCRIPT = """
+local prefix = ARGV[1]
+local best, best_v, best_w
+local idle = {}
+for i = 2, #ARGV, 2 do
+    local lane = ARGV[i]
+    local v = tonumber(redis.call('HGET', KEYS[1], lane) or '0')
+    if redis.call('ZCARD', prefix .. ':' .. lane .. ':repos') > 0 then
+        if best == nil or v < best_v then
+            best, best_v, best_w = lane, v, tonumber(ARGV[i + 1])
+        end
+    else
+        table.insert(idle, {lane, v})
+    end
+end
+if best == nil then
+    -- Nothing queued, so any leftover wake-ups are stale
+    redis.call('DEL', KEYS[4])
+    return false
+end
+
+-- Empty lanes don't bank turns while they have nothing to do
+for _, item in ipairs(idle) do
+    if item[2] < best_v then
+        redis.call('HSET', KEYS[1], item[1], tostring(best_v))
+    end
+end
+redis.call('HSET', KEYS[1], best, tostring(best_v + 1 / best_w))
+
+-- Repos that just became active are added with score 0 and start at the
+-- lane's clock, so they neither jump ahead of nor wait behind busy repos
+local repos = prefix .. ':' .. best .. ':repos'
+local clock_key = prefix .. ':' .. best .. ':clock'
+local clock = tonumber(redis.call('GET', clock_key) or '0')
+local head = redis.call('ZRANGE', repos, 0, 0, 'WITHSCORES')
+local repo = head[1]
+local start = math.max(tonumber(head[2]), clock)
+local list = prefix .. ':' .. best .. ':' .. repo
+local entry = redis.call('LPOP', list)
+redis.call('SET', clock_key, tostring(start))
+
+if redis.call('LLEN', list) == 0 then
+    redis.call('ZREM', repos, repo)
+else
+    local weight = tonumber(redis.call('HGET', KEYS[3], repo) or '1')
+    redis.call('ZADD', repos, tostring(start + 1 / weight), repo)
+end
+if not entry then
+    return false
+end
+redis.call('HINCRBY', KEYS[2], best, -1)
+return {entry, best, repo}
+"""
+
+
+# Move a coalesced job's queued entry up to the lane of a later, more urgent
+# event for the same PR, at the back of its repo's sub-queue there. Returns
+# the lane it was moved from, nil if it wasn't waiting in a lower one.
+#
+# KEYS: lane depths (hash)
+# ARGV: key prefix, repo, entry, new lane, then the lanes below it
+PROMOTE_SCRIPT = """
+local prefix, repo, entry, target = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+for i = 5, #ARGV do
+    local lane = ARGV[i]
+    local list = prefix .. ':' .. lane .. ':' .. repo
+    if redis.call('LREM', list, 1, entry) > 0 then
+        redis.call('HINCRBY', KEYS[1], lane, -1)
+        if redis.call('LLEN', list) == 0 then
+            redis.call('ZREM', prefix .. ':' .. lane .. ':repos', repo)
+        end
+        redis.call('RPUSH', prefix .. ':' .. target .. ':' .. repo, entry)
+        redis.call('ZADD', prefix .. ':' .. target .. ':repos', 'NX', 0, repo)
+        redis.call('HINCRBY', KEYS[1], target, 1)
+        return lane
+    end
+end
+return false
+"""
+
+
+def parse_weights(spec):
+    """Parse "name=weight,name=weight" into a dict"""
+    weights = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, weight = item.rsplit("=", 1)
+        try:
+            weights[name.strip()] = max(float(weight), 0.01)
+        except ValueError:
+            logger.warning(f"Ignoring invalid weight: {item}")
+    return weights
+
+
+class FairScheduler:
+    """Key layout and lane policy of the fair queue backend"""
+    
+    def __init__(self, queue_name):
+        self.prefix = f"{queue_name}:fair"
+        self.signal_key = f"{self.prefix}:signal"
+        self.lane_times_key = f"{self.prefix}:lane_vtime"
+        self.depth_key = f"{self.prefix}:depth"
+        self.weights_key = f"{self.prefix}:weights"
+        
+        lane_weights = parse_weights(settings.SCHEDULER_LANE_WEIGHTS)
+        self.lane_weights = {lane: lane_weights.get(lane, 1) for lane in LANES}
+        self.repo_weights = parse_weights(settings.SCHEDULER_REPO_WEIGHTS)
+    
+    def lane_for(self, job_data):
+        """
+        Priority lane of a job
+        
+        New PRs and small changes go to "high", pushes to big PRs (e.g. a
+        rebase storm) to "bulk", everything else to "normal".
+        """
+        pr_size = job_data.get("pr_size")
+        small = pr_size is not None and pr_size <= settings.SCHEDULER_SMALL_PR_LINES
+        action = job_data.get("action")
+        if action in HIGH_PRIORITY_ACTIONS or small:
+            return "high"
+        if action == "synchronize":
+            return "bulk"
+        return "normal"
+    
+    def repo_for(self, job_data):
+        """Sub-queue a job belongs to"""
+        owner, name = job_data.get("repo_owner"), job_data.get("repo_name")
+        return f"{owner}/{name}" if owner and name else "_unknown"
+    
+    def enqueue(self, pipe, entry_json, job_data):
+        """
+        Queue an entry on a pipeline
+        
+        Only plain writes, so it also works inside a MULTI transaction.
+        """
+        lane = self.lane_for(job_data)
+        repo = self.repo_for(job_data)
+        pipe.rpush(f"{self.prefix}:{lane}:{repo}", entry_json)
+        pipe.zadd(f"{self.prefix}:{lane}:repos", {repo: 0}, nx=True)
+        pipe.hset(self.weights_key, repo, self.repo_weights.get(repo, 1))
+        pipe.hincrby(self.depth_key, lane, 1)
+        # Wakes one blocked worker
+        pipe.rpush(self.signal_key, 1)
+    
+    def promote_keys(self):
+        return [self.depth_key]
+    
+    def promote_args(self, entry_json, job_data):
+        """Move entry_json to job_data's lane if it waits in a lower one"""
+        lane = self.lane_for(job_data)
+        return [self.prefix, self.repo_for(job_data), entry_json, lane, *LANES[LANES.index(lane) + 1:]]
+    
+    def pop_keys(self):
+        return [self.lane_times_key, self.depth_key, self.weights_key, self.signal_key]
+    
+    def pop_args(self):
+        args = [self.prefix]
+        for lane in LANES:
+            args += [lane, self.lane_weights[lane]]
+        return args
+    
+    def parse_depths(self, depths, active_repos):
+        """Per-lane status from the depth hash and each lane's active repo count"""
+        return {
+            lane: {"depth": max(0, int(depths.get(lane) or 0)), "repos": repos}
+            for lane, repos in zip(LANES, active_repos)
+        }
@@ -0,0 +1,159 @@
+"""
+Distributed semaphore - caps concurrent work across all services
+"""
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from shared.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# KEYS: holders, waiters, heartbeats, ticket counter
+# ARGV: token, limit, lease seconds, seconds before a silent waiter is dropped
+#
+# Waiters are ordered by ticket, so slots are handed out first come first
+# served. Holders expire after their lease in case a process dies holding one.
+ACQUIRE_SCRIPT = """
+local now = tonumber(redis.call('TIME')[1])
+local token = ARGV[1]
+local limit = tonumber(ARGV[2])
+local lease = tonumber(ARGV[3])
+local stale = tonumber(ARGV[4])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+
+local gone = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now - stale)
+for _, waiter in ipairs(gone) do
+    redis.call('ZREM', KEYS[2], waiter)
+    redis.call('ZREM', KEYS[3], waiter)
+end
+
+if not redis.call('ZSCORE', KEYS[2], token) then
+    redis.call('ZADD', KEYS[2], redis.call('INCR', KEYS[4]), token)
+end
+redis.call('ZADD', KEYS[3], now, token)
+
+local free = limit - redis.call('ZCARD', KEYS[1])
+local rank = redis.call('ZRANK', KEYS[2], token)
+if free > 0 and rank < free then
+    redis.call('ZADD', KEYS[1], now + lease, token)
+    redis.call('ZREM', KEYS[2], token)
+    redis.call('ZREM', KEYS[3], token)
+    return 1
+end
+return 0
+"""
+
+
+class RedisSemaphore:
+    """Fair counting semaphore shared through Redis"""
+    
+    def __init__(self, name, limit, lease_seconds=300, poll_interval=0.25):
+        """
+        Args:
+            name: Redis key prefix for this semaphore
+            limit: Max holders at once (0 or less disables the semaphore)
+            lease_seconds: A holder that never releases is dropped after this
+            poll_interval: How often waiters retry
+        """
+        self.name = name
+        self.limit = limit
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.keys = [
+            f"semaphore:{name}:holders",
+            f"semaphore:{name}:waiters",
+            f"semaphore:{name}:heartbeats",
+            f"semaphore:{name}:ticket"
+        ]
+        self._acquire = redis_client.client.register_script(ACQUIRE_SCRIPT)
+    
+    @property
+    def enabled(self):
+        """A limit of 0 means no coordination at all"""
+        return self.limit > 0
+    
+    def acquire(self, timeout):
+        """
+        Wait for a slot, in arrival order
+        
+        Args:
+            timeout: Max seconds to wait
+        
+        Returns:
+            Token to pass to release(), or None if the wait timed out
+        """
+        token = str(uuid.uuid4())
+        deadline = time.time() + timeout
+        # Waiters that stop polling for this long lose their place in line
+        stale_after = max(5, int(self.poll_interval * 20))
+        
+        while True:
+            got_slot = self._acquire(
+                keys=self.keys,
+                args=[token, self.limit, self.lease_seconds, stale_after],
+                client=redis_client.client
+            )
+            if got_slot:
+                return token
+            
+            if time.time() >= deadline:
+                self._leave_queue(token)
+                return None
+            time.sleep(self.poll_interval)
+    
+    def release(self, token):
+        """Give a slot back"""
+        try:
+            redis_client.client.zrem(self.keys[0], token)
+        except Exception as e:
+            logger.error(f"Failed to release {self.name} slot: {e}")
+    
+    @contextmanager
+    def slot(self, timeout):
+        """
+        Hold a slot for the duration of a with block
+        
+        Yields:
+            Seconds spent waiting for the slot
+        
+        Raises:
+            TimeoutError: If no slot became free within timeout
+        """
+        if not self.enabled:
+            yield 0.0
+            return
+        
+        start = time.time()
+        token = self.acquire(timeout)
+        waited = time.time() - start
+        if token is None:
+            raise TimeoutError(f"No {self.name} slot free after {waited:.1f}s")
+        
+        try:
+            yield waited
+        finally:
+            self.release(token)
+    
+    def stats(self):
+        """Current holders and waiters"""
+        try:
+            pipe = redis_client.client.pipeline(transaction=False)
+            pipe.zcount(self.keys[0], time.time(), "+inf")
+            pipe.zcard(self.keys[1])
+            in_flight, waiting = pipe.execute()
+            return {"limit": self.limit, "in_flight": in_flight, "waiting": waiting}
+        except Exception as e:
+            logger.error(f"Failed to read {self.name} stats: {e}")
+            return {"limit": self.limit, "in_flight": 0, "waiting": 0}
+    
+    def _leave_queue(self, token):
+        """Remove a waiter that gave up"""
+        try:
+            pipe = redis_client.client.pipeline(transaction=False)
+            pipe.zrem(self.keys[1], token)
+            pipe.zrem(self.keys[2], token)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to leave {self.name} queue: {e}")
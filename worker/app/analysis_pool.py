@@ -0,0 +1,211 @@
+"""
+Analysis Pool - Runs static analysis of a PR's files across processes
+"""
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import requests
+
+sys.path.append('/app')
+from shared.config import settings
+from app.code_analyzer import CodeAnalyzer
+from app.github_client import BYTES_FETCHED, stream_lines
+
+logger = logging.getLogger(__name__)
+
+# Below this many bytes per PR, shipping text to other processes costs more
+# than scanning it in the job's own thread
+INLINE_BYTES = 256 * 1024
+
+# Analyzer and HTTP session of a pool process, built once by the initializer
+_analyzer = None
+_session = None
+
+
+def _init_process(rules):
+    global _analyzer, _session
+    _analyzer = CodeAnalyzer(rules)
+    _session = requests.Session()
+
+
+def _analyze(analyzer, session, task):
+    """
+    Run one task
+    
+    Tasks are ("code", text), ("lines", numbered_lines) or
+    ("url", raw_url, max_bytes), max_bytes being the budget reserved for
+    the file. A URL is streamed straight into the analyzer, so its body is
+    never held in memory as a whole.
+    
+    Returns:
+        (issues, bytes analyzed)
+    """
+    kind, payload = task[0], task[1]
+    if kind == "lines":
+        return analyzer.analyze_lines(payload), task_bytes(task)
+    if kind == "code":
+        return analyzer.analyze_code(payload), task_bytes(task)
+    
+    size = 0
+    
+    def counted(lines):
+        nonlocal size
+        for line in lines:
+            size += len(line.encode()) + 1
+            yield line
+    
+    issues = analyzer.analyze_stream(counted(stream_lines(session, payload, task[2])))
+    return issues, size
+
+
+def _analyze_in_process(task):
+    return _analyze(_analyzer, _session, task)
+
+
+def task_bytes(task):
+    """Bytes of a task's text, None if it is only known once downloaded"""
+    kind, payload = task[0], task[1]
+    if kind == "lines":
+        return sum(len(line.encode()) + 1 for _, line in payload)
+    if kind == "code":
+        return len(payload.encode())
+    return None
+
+
+class AnalysisPool:
+    """
+    Analyzes files independently and in parallel
+    
+    Every file is its own task with its own line numbers, so a PR takes
+    roughly as long as its largest file when there are enough processes.
+    """
+    
+    def __init__(self, analyzer, session, threads, processes=None):
+        """
+        Args:
+            analyzer: CodeAnalyzer whose rules the pool processes use
+            session: requests.Session for downloads analyzed in this process
+            threads: ThreadPoolExecutor that overlaps those downloads
+            processes: Pool size (defaults to ANALYSIS_PROCESSES, 0 = one per CPU)
+        """
+        self.analyzer = analyzer
+        self.session = session
+        self.threads = threads
+        if processes is None:
+            processes = settings.ANALYSIS_PROCESSES
+        self.processes = processes or os.cpu_count() or 1
+        self._executor = None
+        self._lock = threading.Lock()
+    
+    def analyze(self, tasks, timeout=None):
+        """
+        Analyze a batch of files
+        
+        Args:
+            tasks: List of tasks (see _analyze)
+            timeout: Seconds the whole batch may take (None = no limit)
+        
+        Returns:
+            One outcome per task, in order: (issues, bytes analyzed), or the
+            exception that stopped it - TimeoutError if it didn't finish in time
+        """
+        if not tasks:
+            return []
+        sizes = [task_bytes(task) for task in tasks]
+        if None not in sizes and sum(sizes) < INLINE_BYTES:
+            outcomes = self._analyze_inline(tasks, timeout)
+        elif self.processes <= 1:
+            # Downloads still overlap, the scanning itself shares the GIL
+            futures = [
+                self.threads.submit(_analyze, self.analyzer, self.session, task)
+                for task in tasks
+            ]
+            outcomes = self._collect(futures, timeout)
+        else:
+            outcomes = self._analyze_in_pool(tasks, timeout)
+        
+        for task, outcome in zip(tasks, outcomes):
+            if task[0] == "url" and not isinstance(outcome, Exception):
+                BYTES_FETCHED.inc(outcome[1])
+        return outcomes
+    
+    def close(self):
+        """Shut the pool processes down"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _analyze_in_pool(self, tasks, timeout):
+        executor = self._get_executor()
+        try:
+            futures = [executor.submit(_analyze_in_process, task) for task in tasks]
+        except BrokenProcessPool:
+            self._reset(executor)
+            return self._analyze_inline(tasks, timeout)
+        
+        outcomes = self._collect(futures, timeout)
+        if any(isinstance(outcome, BrokenProcessPool) for outcome in outcomes):
+            self._reset(executor)
+        return outcomes
+    
+    def _collect(self, futures, timeout):
+        """Wait for a batch, turning failures and stragglers into outcomes"""
+        done, not_done = wait(futures, timeout=timeout)
+        for future in not_done:
+            # Files already running finish in the background and are discarded
+            future.cancel()
+        if not_done:
+            logger.warning(f"⏱️  {len(not_done)}/{len(futures)} files not analyzed within {timeout}s")
+        
+        outcomes = []
+        for future in futures:
+            if future not in done:
+                outcomes.append(TimeoutError(f"not analyzed within {timeout}s"))
+                continue
+            error = future.exception()
+            outcomes.append(error if error is not None else future.result())
+        return outcomes
+    
+    def _analyze_inline(self, tasks, timeout):
+        """Analyze in the calling thread, checking the deadline between files"""
+        deadline = time.monotonic() + timeout if timeout else None
+        outcomes = []
+        for task in tasks:
+            if deadline and time.monotonic() > deadline:
+                outcomes.append(TimeoutError(f"not analyzed within {timeout}s"))
+                continue
+            try:
+                outcomes.append(_analyze(self.analyzer, self.session, task))
+            except Exception as e:
+                outcomes.append(e)
+        return outcomes
+    
+    def _get_executor(self):
+        """Start the pool on first use"""
+        with self._lock:
+            if self._executor is None:
+                # spawn, because forking a process with running job threads
+                # can copy locks that are held and never released
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_process,
+                    initargs=(self.analyzer.rules,)
+                )
+                logger.info(f"🧮 Analysis pool started ({self.processes} processes)")
+            return self._executor
+    
+    def _reset(self, executor):
+        """Drop a broken pool so the next batch starts a fresh one"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.error("❌ Analysis pool broke, restarting it on next use")
\ No newline at end of file
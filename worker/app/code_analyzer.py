@@ -1,80 +1,351 @@
 """
 Code Analyzer - Finds issues in code
 """
+import hashlib
+import heapq
+import json
 import logging
 import re
+import sys
+import time
+
+sys.path.append('/app')
+from shared.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Bump when the engine changes in a way the rule definitions don't capture
+# so cached per-file results are invalidated
+ANALYZER_VERSION = "2"
+
+# Streamed input is scanned in buffers of about this size, so memory stays
+# bounded however large a file is
+STREAM_CHUNK_BYTES = 1024 * 1024
+
+
+class Rule:
+    """A single static analysis check, matched against one line at a time"""
+    
+    def __init__(self, name, issue_type, severity, message, pattern,
+                 ignore_case=False, literals=(), snippet_length=None):
+        """
+        Args:
+            name: Unique rule name
+            issue_type: Issue "type" reported for matches
+            severity: high, medium, low or info
+            message: Issue message, may use {length} for the line length
+            pattern: Regex matched against a single line
+            ignore_case: Match the pattern case-insensitively
+            literals: Strings (case-insensitive) at least one of which must
+                appear in every matching line. They drive the combined matcher
+                and let a rule be skipped for a whole buffer. Leave empty for
+                rules that can match without any fixed text
+            snippet_length: Truncate the reported code to this many characters
+        """
+        self.name = name
+        self.issue_type = issue_type
+        self.severity = severity
+        self.message = message
+        self.ignore_case = ignore_case
+        self.flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+        self.pattern = re.compile(pattern, self.flags)
+        self.literals = tuple(literal.lower() for literal in literals)
+        self.snippet_length = snippet_length
+    
+    def may_match(self, lowered_text):
+        """Cheap prefilter: can this rule match anywhere in the text?"""
+        if not self.literals:
+            return True
+        return any(literal in lowered_text for literal in self.literals)
+    
+    def check(self, line_num, line):
+        """Return an issue if the rule matches this line, else None"""
+        if not self.pattern.search(line):
+            return None
+        
+        if self.snippet_length:
+            code = line[:self.snippet_length].strip() + "..."
+        else:
+            code = line.strip()
+        
+        return {
+            "type": self.issue_type,
+            "severity": self.severity,
+            "message": self.message.format(length=len(line)),
+            "line": line_num,
+            "code": code
+        }
+    
+    def describe(self):
+        """Stable description used for the ruleset version"""
+        return (
+            f"{self.name}:{self.issue_type}:{self.severity}:{self.message}:"
+            f"{self.pattern.pattern}:{self.flags}:{self.snippet_length}"
+        )
+
+
+DEFAULT_RULES = [
+    Rule(
+        "console_log", "console_log", "low", "Console log statement found",
+        r'console\.(log|debug|warn|error)',
+        literals=("console.",)
+    ),
+    Rule(
+        "todo", "todo", "info", "TODO/FIXME comment found",
+        r'(TODO|FIXME|HACK|XXX)', ignore_case=True,
+        literals=("todo", "fixme", "hack", "xxx")
+    ),
+    Rule(
+        "hardcoded_password", "security", "high", "Possible hardcoded password detected",
+        r'(password|passwd|pwd)\s*=\s*["\'][^"\']+["\']', ignore_case=True,
+        literals=("password", "passwd", "pwd")
+    ),
+    Rule(
+        "line_length", "style", "low", "Line too long ({length} characters)",
+        r'^[^\n]{121,}',
+        snippet_length=50
+    ),
+]
+
+
+def load_rules(path):
+    """
+    Load extra rules from a JSON file
+    
+    The file holds a list of objects with the Rule constructor arguments,
+    e.g. {"name": "eval", "issue_type": "security", "severity": "high",
+    "message": "eval() call found", "pattern": "\\\\beval\\\\(", "literals": ["eval("]}
+    
+    Args:
+        path: Path to the JSON rules file
+    
+    Returns:
+        List of Rule objects
+    """
+    with open(path) as f:
+        definitions = json.load(f)
+    return [Rule(**definition) for definition in definitions]
+
 
 class CodeAnalyzer:
     """Performs basic static code analysis"""
     
-    def __init__(self):
-        self.patterns = {
-            "console_log": re.compile(r'console\.(log|debug|warn|error)'),
-            "todo": re.compile(r'(TODO|FIXME|HACK|XXX)', re.IGNORECASE),
-            "hardcoded_password": re.compile(r'(password|passwd|pwd)\s*=\s*["\'][^"\']+["\']', re.IGNORECASE),
-        }
-        logger.info("Code Analyzer initialized")
+    def __init__(self, rules=None):
+        """
+        Args:
+            rules: Rules to run (defaults to DEFAULT_RULES plus any rules
+                from settings.ANALYSIS_RULES_FILE)
+        """
+        if rules is None:
+            rules = list(DEFAULT_RULES)
+            if settings.ANALYSIS_RULES_FILE:
+                rules.extend(load_rules(settings.ANALYSIS_RULES_FILE))
+        
+        self.rules = []
+        self._matchers = {}
+        for rule in rules:
+            self.register_rule(rule)
+        logger.info(f"Code Analyzer initialized ({len(self.rules)} rules, version {self.ruleset_version})")
+    
+    def register_rule(self, rule):
+        """Add a rule to the engine"""
+        if any(existing.name == rule.name for existing in self.rules):
+            raise ValueError(f"Duplicate rule name: {rule.name}")
+        self.rules.append(rule)
+        self._matchers.clear()
+        self.ruleset_version = self._compute_ruleset_version()
     
-    def analyze_code(self, code_text):
+    def analyze_code(self, code_text, filename=None):
         """
         Analyze code and find issues
         
         Args:
             code_text: String of code to analyze
+            filename: File the code came from (added to each issue)
+        
+        Returns:
+            List of issues found
+        """
+        if not code_text:
+            return []
+        
+        issues = self._scan(code_text)
+        
+        if filename:
+            for issue in issues:
+                issue["file"] = filename
+        return issues
+    
+    def analyze_lines(self, numbered_lines, filename=None):
+        """
+        Analyze individual lines, e.g. only the lines changed by a diff
+        
+        Args:
+            numbered_lines: Iterable of (line_number, line) tuples
+            filename: File the lines came from (added to each issue)
+        
+        Returns:
+            List of issues found
+        """
+        line_numbers = []
+        lines = []
+        for line_num, line in numbered_lines:
+            line_numbers.append(line_num)
+            lines.append(line)
+        
+        if not lines:
+            return []
+        
+        # Scan the lines as one buffer, then map back to real line numbers
+        issues = self._scan('\n'.join(lines))
+        for issue in issues:
+            issue["line"] = line_numbers[issue["line"] - 1]
+            if filename:
+                issue["file"] = filename
+        return issues
+    
+    def analyze_stream(self, lines, filename=None):
+        """
+        Analyze code that arrives line by line, e.g. straight off an HTTP body
+        
+        Args:
+            lines: Iterable of lines without their line endings
+            filename: File the lines came from (added to each issue)
         
         Returns:
             List of issues found
         """
         issues = []
+        chunk = []
+        chunk_bytes = 0
+        first_line = 1
+        for line in lines:
+            chunk.append(line)
+            chunk_bytes += len(line) + 1
+            if chunk_bytes >= STREAM_CHUNK_BYTES:
+                issues.extend(self._scan_chunk(chunk, first_line))
+                first_line += len(chunk)
+                chunk = []
+                chunk_bytes = 0
+        if chunk:
+            issues.extend(self._scan_chunk(chunk, first_line))
         
-        if not code_text:
-            return issues
-        
-        lines = code_text.split('\n')
-        
-        for line_num, line in enumerate(lines, 1):
-            # Check for console.log
-            if self.patterns["console_log"].search(line):
-                issues.append({
-                    "type": "console_log",
-                    "severity": "low",
-                    "message": "Console log statement found",
-                    "line": line_num,
-                    "code": line.strip()
-                })
+        if filename:
+            for issue in issues:
+                issue["file"] = filename
+        return issues
+    
+    def _scan_chunk(self, lines, first_line):
+        """Scan consecutive lines starting at first_line"""
+        issues = self._scan('\n'.join(lines))
+        for issue in issues:
+            issue["line"] += first_line - 1
+        return issues
+    
+    def _scan(self, text):
+        """
+        Scan a whole buffer with one combined matcher
+        
+        The combined matcher is an alternation of every active rule's
+        literals, so it only locates candidate lines. Each active rule is
+        then checked on those lines, so all rules matching a line are
+        reported even when their matches overlap. Rules without literals
+        (e.g. line length) contribute candidates from their own pass.
+        """
+        start_time = time.perf_counter()
+        issues = []
+        
+        lowered = text.lower()
+        active = [rule for rule in self.rules if rule.may_match(lowered)]
+        
+        offsets = []
+        literal_rules = [rule for rule in active if rule.literals]
+        if literal_rules:
+            # lower() can change the length of some non-ASCII text, in which
+            # case offsets no longer line up and we search case-insensitively
+            if len(lowered) == len(text):
+                offsets = self._candidate_offsets(self._matcher(literal_rules), lowered)
+            else:
+                offsets = self._candidate_offsets(self._matcher(literal_rules, re.IGNORECASE), text)
+        
+        for rule in active:
+            if not rule.literals:
+                offsets = list(heapq.merge(
+                    offsets, (match.start() for match in rule.pattern.finditer(text))
+                ))
+        
+        line_num = 1
+        counted_to = 0
+        next_line = 0
+        for offset in offsets:
+            if offset < next_line:
+                # Already checked this line
+                continue
+            
+            line_start = text.rfind('\n', 0, offset) + 1
+            line_end = text.find('\n', offset)
+            if line_end == -1:
+                line_end = len(text)
             
-            # Check for TODOs
-            if self.patterns["todo"].search(line):
-                issues.append({
-                    "type": "todo",
-                    "severity": "info",
-                    "message": "TODO/FIXME comment found",
-                    "line": line_num,
-                    "code": line.strip()
-                })
+            # Line numbers come from match offsets, counted incrementally
+            line_num += text.count('\n', counted_to, line_start)
+            counted_to = line_start
             
-            # Check for hardcoded passwords
-            if self.patterns["hardcoded_password"].search(line):
-                issues.append({
-                    "type": "security",
-                    "severity": "high",
-                    "message": "Possible hardcoded password detected",
-                    "line": line_num,
-                    "code": line.strip()
-                })
+            line = text[line_start:line_end]
+            for rule in active:
+                issue = rule.check(line_num, line)
+                if issue:
+                    issues.append(issue)
             
-            # Check line length
-            if len(line) > 120:
-                issues.append({
-                    "type": "style",
-                    "severity": "low",
-                    "message": f"Line too long ({len(line)} characters)",
-                    "line": line_num,
-                    "code": line[:50].strip() + "..."
-                })
-        
-        logger.info(f"Found {len(issues)} issues in code")
-        return issues
\ No newline at end of file
+            next_line = line_end + 1
+        
+        elapsed = time.perf_counter() - start_time
+        megabytes = len(text) / 1_000_000
+        throughput = megabytes / elapsed if elapsed > 0 else 0.0
+        logger.info(
+            f"Found {len(issues)} issues in code "
+            f"({megabytes:.2f} MB at {throughput:.1f} MB/s, {len(active)}/{len(self.rules)} rules active)"
+        )
+        return issues
+    
+    def _candidate_offsets(self, matcher, text):
+        """Offsets of the first literal hit on each line that has one"""
+        offsets = []
+        search = matcher.search
+        position = 0
+        while True:
+            match = search(text, position)
+            if not match:
+                return offsets
+            offsets.append(match.start())
+            # Skip the rest of the line, one candidate per line is enough
+            line_end = text.find('\n', match.end())
+            if line_end == -1:
+                return offsets
+            position = line_end + 1
+    
+    def _matcher(self, rules, flags=0):
+        """Compile (and memoize) one alternation of the rules' literals"""
+        key = (tuple(rule.name for rule in rules), flags)
+        matcher = self._matchers.get(key)
+        if matcher is None:
+            literals = sorted(
+                {literal for rule in rules for literal in rule.literals},
+                key=len, reverse=True
+            )
+            matcher = re.compile("|".join(re.escape(literal) for literal in literals), flags)
+            self._matchers[key] = matcher
+        return matcher
+    
+    def _compute_ruleset_version(self):
+        """Short hash identifying the analyzer version and its rules"""
+        rules = "|".join(rule.describe() for rule in sorted(self.rules, key=lambda r: r.name))
+        digest = hashlib.sha1(f"{ANALYZER_VERSION}|{rules}".encode()).hexdigest()
+        return digest[:12]
+
+
+def format_location(issue):
+    """Human readable location of an issue, e.g. 'src/app.py:12' or 'line 12'"""
+    if issue.get("file"):
+        return f"{issue['file']}:{issue['line']}"
+    return f"line {issue['line']}"
@@ -0,0 +1,193 @@
+"""
+DB Sink - Batches review status updates into bulk upserts
+"""
+import logging
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+sys.path.append('/app')
+from shared.config import settings
+from shared.database import engine, PRAnalysis
+from shared.metrics import metrics
+from sqlalchemy import func
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = metrics.histogram("db_flush_seconds", "Time to write one batch of results")
+ROWS_FLUSHED = metrics.counter("db_rows_flushed_total", "Review rows upserted by the sink")
+ROWS_DROPPED = metrics.counter(
+    "db_rows_dropped_total", "Review rows dropped after failing DB_MAX_ROW_ATTEMPTS writes"
+)
+
+# Never overwritten by a later update of the same job
+INSERT_ONLY_COLUMNS = ("job_id", "created_at")
+
+
+def _insert_for_dialect():
+    """The dialect's INSERT construct that supports ON CONFLICT"""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise RuntimeError(f"Batched upserts not supported for {engine.dialect.name}")
+    return insert
+
+
+def _database_unavailable(error):
+    """Whether a failed write says nothing about the rows (connection lost, database down)"""
+    return isinstance(error, (OperationalError, InterfaceError))
+
+
+class ResultSink:
+    """
+    Buffers per-job row updates and writes them in one statement per batch
+    
+    Updates for the same job are merged in memory, so a job that starts and
+    finishes between two flushes costs a single row write. If a batch fails
+    for something other than the database being unreachable, its rows are
+    written one by one and a row that keeps failing is dropped.
+    """
+    
+    def __init__(self, batch_size=None, flush_interval=None):
+        self.batch_size = settings.DB_BATCH_SIZE if batch_size is None else batch_size
+        self.flush_interval = settings.DB_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._insert = _insert_for_dialect()
+        self._pending = {}
+        # Failed writes per job, only touched by whoever is flushing
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="db-sink", daemon=True)
+        self._thread.start()
+    
+    def record(self, job_id, **fields):
+        """
+        Queue column values for a job's row
+        
+        Args:
+            job_id: Job the row belongs to
+            **fields: PRAnalysis columns to set
+        """
+        with self._lock:
+            row = self._pending.get(job_id)
+            if row is None:
+                row = self._pending[job_id] = {
+                    "job_id": job_id,
+                    "created_at": datetime.now(timezone.utc)
+                }
+            row.update(fields)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+    
+    def flush(self):
+        """
+        Write everything buffered so far
+        
+        Returns:
+            True if successful (failed rows stay buffered for the next flush)
+        """
+        with self._lock:
+            rows, self._pending = list(self._pending.values()), {}
+        if not rows:
+            return True
+        
+        start = time.perf_counter()
+        try:
+            self._write(rows)
+            written, failed = len(rows), []
+        except Exception as e:
+            if _database_unavailable(e):
+                logger.error(f"❌ Failed to write {len(rows)} results: {e}")
+                self._requeue(rows)
+                return False
+            logger.warning(f"⚠️  Batch of {len(rows)} results failed ({e}), writing rows one by one")
+            written, failed = self._write_each(rows)
+            self._requeue(failed)
+        
+        FLUSH_SECONDS.observe(time.perf_counter() - start)
+        ROWS_FLUSHED.inc(written)
+        logger.debug(f"Wrote {written} results in {time.perf_counter() - start:.3f}s")
+        return not failed
+    
+    def close(self):
+        """Stop the flush thread and write whatever is left"""
+        self._running = False
+        self._wakeup.set()
+        self._thread.join()
+        if not self.flush():
+            logger.error(f"❌ {len(self._pending)} results lost on shutdown")
+    
+    def _write(self, rows):
+        """Upsert rows in one transaction"""
+        # Every row of a multi-row VALUES clause needs the same columns, and
+        # a column a row doesn't set must be left out rather than sent as
+        # NULL so its default applies - so one statement per column set
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        with engine.begin() as conn:
+            for columns, group in groups.items():
+                conn.execute(self._upsert(columns, group))
+    
+    def _write_each(self, rows):
+        """
+        Write rows one at a time, so a bad row can't hold back the others
+        
+        Returns:
+            (rows written, rows to try again on the next flush)
+        """
+        written = 0
+        retry = []
+        for index, row in enumerate(rows):
+            job_id = row["job_id"]
+            try:
+                self._write([row])
+            except Exception as e:
+                if _database_unavailable(e):
+                    return written, retry + rows[index:]
+                attempts = self._attempts.get(job_id, 0) + 1
+                if attempts < settings.DB_MAX_ROW_ATTEMPTS:
+                    self._attempts[job_id] = attempts
+                    retry.append(row)
+                    continue
+                self._attempts.pop(job_id, None)
+                ROWS_DROPPED.inc()
+                logger.error(f"❌ Dropping result of job {job_id} after {attempts} failed writes: {e}")
+                continue
+            self._attempts.pop(job_id, None)
+            written += 1
+        return written, retry
+    
+    def _requeue(self, rows):
+        """Put rows that failed back in the buffer"""
+        with self._lock:
+            # Newer updates that arrived meanwhile win over the failed ones
+            for row in rows:
+                newer = self._pending.get(row["job_id"], {})
+                self._pending[row["job_id"]] = {**row, **newer, "created_at": row["created_at"]}
+    
+    def _upsert(self, columns, rows):
+        """One multi-row INSERT ... ON CONFLICT (job_id) DO UPDATE, every row setting columns"""
+        table = PRAnalysis.__table__
+        stmt = self._insert(table).values(rows)
+        # A None a row sets keeps the stored value
+        updates = {
+            column: func.coalesce(stmt.excluded[column], table.c[column])
+            for column in columns
+            if column not in INSERT_ONLY_COLUMNS
+        }
+        updates["updated_at"] = func.now()
+        return stmt.on_conflict_do_update(index_elements=["job_id"], set_=updates)
+    
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._running:
+                self.flush()
@@ -0,0 +1,198 @@
+"""
+Diff Chunker - Cuts a PR's diff into token-budgeted pieces for the LLM
+"""
+import re
+from app.diff_parser import HUNK_HEADER
+
+# Letter runs, digit runs, and single symbols - roughly how BPE tokenizers
+# split source code
+TOKEN_PIECES = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+
+def estimate_tokens(text):
+    """
+    Rough token count, without loading a tokenizer
+    
+    Words cost a token per 4 letters, numbers one per 3 digits, and every
+    symbol and line break one each. Errs high on code, so chunks sized with
+    it fit the model's context window.
+    """
+    tokens = text.count("\n")
+    for piece in TOKEN_PIECES.findall(text):
+        if piece[0].isalpha():
+            tokens += (len(piece) + 3) // 4
+        elif piece[0].isdigit():
+            tokens += (len(piece) + 2) // 3
+        else:
+            tokens += 1
+    return tokens
+
+
+def chunk_diff(diffs, chunk_tokens, token_budget):
+    """
+    Pack per-file patches into chunks of at most chunk_tokens each
+    
+    Small files share a chunk; a large file is split at hunk boundaries (or
+    between lines, for a huge hunk - each piece then gets its own @@ header
+    with its line numbers). Pieces are taken in PR order until
+    token_budget is spent.
+    
+    Args:
+        diffs: (filename, patch) pairs, in PR order
+        chunk_tokens: Max estimated tokens per chunk
+        token_budget: Max estimated tokens over all chunks
+    
+    Returns:
+        (chunks, omitted) - chunk texts, and the files left out in whole
+        or in part because the budget ran out
+    """
+    chunks = []
+    omitted = []
+    current = []
+    current_tokens = 0
+    spent = 0
+    
+    for filename, patch in diffs:
+        for text, tokens in _split_patch(filename, patch, chunk_tokens):
+            if spent + tokens > token_budget:
+                if filename not in omitted:
+                    omitted.append(filename)
+                continue
+            if current and current_tokens + tokens > chunk_tokens:
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+            spent += tokens
+    
+    if current:
+        chunks.append("\n".join(current))
+    return chunks, omitted
+
+
+def _split_patch(filename, patch, limit):
+    """
+    Cut one file's patch into pieces that fit limit
+    
+    Returns:
+        List of (text, estimated tokens), each headed by the filename
+    """
+    header = f"### {filename}\n"
+    whole = header + patch
+    whole_tokens = estimate_tokens(whole)
+    if whole_tokens <= limit:
+        return [(whole, whole_tokens)]
+    
+    # Room left after a continuation header
+    room = max(1, limit - estimate_tokens(f"### {filename} (continued)\n"))
+    bodies = []
+    lines = []
+    size = 0
+    
+    def flush():
+        nonlocal lines, size
+        if lines:
+            bodies.append("".join(lines))
+        lines, size = [], 0
+    
+    for hunk in _hunks(patch):
+        hunk_tokens = estimate_tokens(hunk)
+        if hunk_tokens <= room:
+            if size + hunk_tokens > room:
+                flush()
+            lines.append(hunk)
+            size += hunk_tokens
+            continue
+        
+        flush()
+        pieces = _split_hunk(hunk, room)
+        bodies.extend(pieces[:-1])
+        # Later hunks may still fit next to the last piece
+        lines = [pieces[-1]]
+        size = estimate_tokens(pieces[-1])
+    flush()
+    
+    pieces = []
+    for index, body in enumerate(bodies):
+        text = (header if index == 0 else f"### {filename} (continued)\n") + body
+        pieces.append((text, estimate_tokens(text)))
+    return pieces
+
+
+def _split_hunk(hunk, room):
+    """
+    Cut a hunk into pieces that fit room, each headed by an @@ header
+    
+    The headers are recomputed from the lines in each piece, so the model
+    (and parse_added_lines) can still tell their line numbers.
+    
+    Returns:
+        List of piece texts
+    """
+    lines = hunk.splitlines(keepends=True)
+    match = HUNK_HEADER.match(lines[0])
+    # Next old and new line numbers; an empty range's start is the line before it
+    old_line = new_line = 0
+    context = ""
+    if match:
+        # Section text after the header, e.g. the enclosing function
+        context, lines = lines[0][match.end():].rstrip("\n"), lines[1:]
+        old_line = int(match.group(1)) + (match.group(2) == "0")
+        new_line = int(match.group(3)) + (match.group(4) == "0")
+        # Room for the largest header a piece of this hunk can get
+        last = max(old_line, new_line) + len(lines)
+        room = max(1, room - estimate_tokens(f"@@ -{last},{len(lines)} +{last},{len(lines)} @@{context}\n"))
+    # Otherwise not a hunk (e.g. a patch preamble) - it is just cut between lines
+    
+    pieces = []
+    body = []
+    size = 0
+    counts = {"old": 0, "new": 0}
+    
+    def flush():
+        nonlocal body, size, old_line, new_line
+        if not body:
+            return
+        if match:
+            old_start = old_line if counts["old"] else old_line - 1
+            new_start = new_line if counts["new"] else new_line - 1
+            header = f"@@ -{old_start},{counts['old']} +{new_start},{counts['new']} @@"
+            pieces.append(header + (context if not pieces else "") + "\n" + "".join(body))
+        else:
+            pieces.append("".join(body))
+        old_line += counts["old"]
+        new_line += counts["new"]
+        counts["old"] = counts["new"] = 0
+        body, size = [], 0
+    
+    for line in lines:
+        line_tokens = estimate_tokens(line)
+        if line_tokens > room:
+            # A minified or generated line - keep its start only (a
+            # character never costs more than one token)
+            line = line[:max(1, room - 1)] + "\n"
+            line_tokens = estimate_tokens(line)
+        if size + line_tokens > room:
+            flush()
+        body.append(line)
+        size += line_tokens
+        if line[:1] in (" ", "-"):
+            counts["old"] += 1
+        if line[:1] in (" ", "+"):
+            counts["new"] += 1
+    flush()
+    return pieces or [hunk]
+
+
+def _hunks(patch):
+    """Split a patch before each @@ header, keeping line endings"""
+    hunks = []
+    current = []
+    for line in patch.splitlines(keepends=True):
+        if current and HUNK_HEADER.match(line):
+            hunks.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        hunks.append("".join(current))
+    return hunks
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""
+Diff Parser - Extracts changed lines from unified diff patches
+"""
+import re
+from bisect import bisect_right
+
+# @@ -old_start,old_count +new_start,new_count @@ optional section header
+HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def parse_added_lines(patch):
+    """
+    Find the lines added or modified by a patch
+    
+    Args:
+        patch: Unified diff text as returned by the GitHub PR files API
+    
+    Returns:
+        List of (line_number, line) tuples, numbered in the new file
+    """
+    added = []
+    
+    if not patch:
+        return added
+    
+    new_line = None
+    for raw_line in patch.split('\n'):
+        header = HUNK_HEADER.match(raw_line)
+        if header:
+            new_line = int(header.group(3))
+            continue
+        
+        # Skip anything before the first hunk (file headers, if present)
+        if new_line is None or raw_line.startswith('\\'):
+            continue
+        
+        if raw_line.startswith('+'):
+            added.append((new_line, raw_line[1:]))
+            new_line += 1
+        elif raw_line.startswith('-'):
+            # Removed lines don't exist in the new file
+            continue
+        else:
+            # Context line
+            new_line += 1
+    
+    return added
+
+
+def map_unchanged_lines(patch):
+    """
+    Follow the lines a patch leaves alone to where they end up
+    
+    Args:
+        patch: Unified diff text as returned by the GitHub compare API
+    
+    Returns:
+        Function taking a line number in the old file and returning its
+        number in the new file, or None if the patch removed or rewrote it
+    """
+    # Context lines inside hunks, old -> new, and the old lines removed
+    context = {}
+    removed = set()
+    # (first old line after a hunk, shift of the lines from there on)
+    shifts = []
+    
+    old_line = new_line = None
+    for raw_line in (patch or '').split('\n'):
+        header = HUNK_HEADER.match(raw_line)
+        if header:
+            if old_line is not None:
+                shifts.append((old_line, new_line - old_line))
+            old_line, new_line = int(header.group(1)), int(header.group(3))
+            # An empty range is numbered by the line before it
+            if header.group(2) == '0':
+                old_line += 1
+            if header.group(4) == '0':
+                new_line += 1
+            continue
+        
+        if old_line is None or raw_line.startswith('\\'):
+            continue
+        
+        if raw_line.startswith('+'):
+            new_line += 1
+        elif raw_line.startswith('-'):
+            removed.add(old_line)
+            old_line += 1
+        else:
+            context[old_line] = new_line
+            old_line += 1
+            new_line += 1
+    if old_line is not None:
+        shifts.append((old_line, new_line - old_line))
+    
+    starts = [start for start, _ in shifts]
+    
+    def new_number(line):
+        if line in removed:
+            return None
+        if line in context:
+            return context[line]
+        index = bisect_right(starts, line) - 1
+        return line + shifts[index][1] if index >= 0 else line
+    
+    return new_number
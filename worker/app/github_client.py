@@ -1,29 +1,159 @@
 """
 GitHub Client - Fetches PR code and posts comments
 """
+import codecs
+import hashlib
+import json
 import logging
 import sys
-from github import Github
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 import requests
+from requests.adapters import HTTPAdapter
 
 sys.path.append('/app')
+from shared import redis_client, RateBudget
 from shared.config import settings
+from shared.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+BYTES_FETCHED = metrics.counter(
+    "github_bytes_fetched_total", "Bytes of file content downloaded from GitHub"
+)
+API_REQUESTS = metrics.counter(
+    "github_api_requests_total", "GitHub REST API reads by result", ["result"]
+)
+RATE_WAIT = metrics.histogram(
+    "github_rate_wait_seconds", "Time API calls waited for the shared rate budget"
+)
+RATE_REMAINING = metrics.gauge(
+    "github_rate_remaining", "API calls left in the current rate limit window"
+)
+
+# Attempts at one call when GitHub answers with a rate limit anyway
+RATE_LIMIT_ATTEMPTS = 3
+
+# Redis keys of cached REST responses (validators plus body)
+API_CACHE_PREFIX = "github_api"
+
+# The PR files API returns at most 100 files a page and 3000 files in total
+FILES_PER_PAGE = 100
+MAX_FILE_PAGES = 30
+
+# The compare API lists at most 300 files - a longer list may be cut off
+MAX_COMPARE_FILES = 300
+
+# Bytes read from the socket at a time when streaming a file
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class FileTooLarge(Exception):
+    """A file is larger than the caller is willing to read"""
+
+
+def stream_lines(session, url, max_bytes=None):
+    """
+    Yield the lines of a raw file as its body arrives
+    
+    Only the current network chunk and one partial line are held at a
+    time. Lines keep any trailing \r, like splitting the whole text on \n.
+    
+    Args:
+        session: requests.Session to download with
+        url: Raw file URL
+        max_bytes: Stop with FileTooLarge past this many bytes of the body
+            (None = no limit)
+    
+    Raises:
+        FileTooLarge: The file is over max_bytes
+        requests.RequestException: The download failed
+    """
+    with session.get(url, timeout=settings.GITHUB_FETCH_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        
+        length = response.headers.get("Content-Length")
+        if max_bytes is not None and length and int(length) > max_bytes:
+            raise FileTooLarge(f"{int(length)} bytes is over the {max_bytes} byte limit")
+        
+        # Decoded here rather than by requests, so the limit counts bytes
+        decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+        read = 0
+        partial = ""
+        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+            read += len(chunk)
+            if max_bytes is not None and read > max_bytes:
+                raise FileTooLarge(f"over the {max_bytes} byte limit")
+            lines = (partial + decoder.decode(chunk)).split("\n")
+            partial = lines.pop()
+            yield from lines
+        partial += decoder.decode(b"", final=True)
+        if partial:
+            yield partial
+
+
+def file_size(session, url):
+    """
+    Size of a raw file in bytes, without downloading it
+    
+    Returns:
+        The Content-Length of a HEAD request, or None if it couldn't be told
+    """
+    try:
+        response = session.head(
+            url,
+            allow_redirects=True,
+            # Asked for uncompressed, so the length is that of the text itself
+            headers={"Accept-Encoding": "identity"},
+            timeout=settings.GITHUB_FETCH_TIMEOUT
+        )
+        response.raise_for_status()
+        return int(response.headers["Content-Length"])
+    except (requests.RequestException, KeyError, ValueError) as e:
+        logger.warning(f"Could not size {url}: {e}")
+        return None
+
 
 class GitHubClient:
     """Client for interacting with GitHub API"""
     
     def __init__(self):
-        if not settings.GITHUB_TOKEN:
+        self.enabled = bool(settings.GITHUB_TOKEN)
+        if not self.enabled:
             logger.warning("⚠️  No GitHub token provided - GitHub features disabled")
-            self.client = None
         else:
-            self.client = Github(settings.GITHUB_TOKEN)
             logger.info("✅ GitHub client initialized")
+        self.api_headers = {
+            "Authorization": f"Bearer {settings.GITHUB_TOKEN}",
+            "Accept": "application/vnd.github+json"
+        }
+        # Every replica using this token draws from one budget
+        self.budget = RateBudget(
+            "github", settings.GITHUB_TOKEN,
+            reserve=settings.GITHUB_RATE_RESERVE,
+            burst=settings.GITHUB_RATE_BURST
+        )
+        # PR metadata resolved recently, reused without asking GitHub again
+        self._pulls = {}
+        self._pulls_lock = threading.Lock()
+        
+        # Shared keep-alive pool so file downloads reuse TCP+TLS connections
+        self.fetch_concurrency = max(1, settings.GITHUB_FETCH_CONCURRENCY)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=self.fetch_concurrency
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.fetch_pool = ThreadPoolExecutor(
+            max_workers=self.fetch_concurrency,
+            thread_name_prefix="github-fetch"
+        )
     
-    def get_pr_files(self, repo_owner, repo_name, pr_number):
+    def get_pr_files(self, repo_owner, repo_name, pr_number, fetch_content=True):
         """
         Fetch files changed in a PR
         
@@ -31,41 +161,194 @@ class GitHubClient:
             repo_owner: Repository owner (e.g., 'facebook')
             repo_name: Repository name (e.g., 'react')
             pr_number: PR number
+            fetch_content: Download each file's raw content (otherwise
+                only metadata and the diff patch are returned)
         
         Returns:
-            List of files with their content
+            List of files with their content ([] if no code files changed),
+            or None if the files couldn't be listed
         """
-        if not self.client:
+        if not self.enabled:
             logger.error("GitHub client not initialized")
-            return []
+            return None
         
         try:
-            repo = self.client.get_repo(f"{repo_owner}/{repo_name}")
-            pr = repo.get_pull(pr_number)
+            # Listed straight off the PR - no repo or PR lookups needed first
+            pr_files = []
+            for page in range(1, MAX_FILE_PAGES + 1):
+                batch = self.get_json(
+                    f"/repos/{repo_owner}/{repo_name}/pulls/{pr_number}/files",
+                    {"per_page": FILES_PER_PAGE, "page": page}
+                )
+                pr_files.extend(batch)
+                if len(batch) < FILES_PER_PAGE:
+                    break
+            
+            files = self._code_files(pr_files)
             
-            files = []
-            for file in pr.get_files():
-                # Only analyze code files (skip images, binaries, etc.)
-                if self._is_code_file(file.filename):
-                    # Get file content
-                    try:
-                        content = self._fetch_file_content(file.raw_url)
-                        files.append({
-                            "filename": file.filename,
-                            "content": content,
-                            "additions": file.additions,
-                            "deletions": file.deletions,
-                            "changes": file.changes
-                        })
-                        logger.info(f"   📄 Fetched: {file.filename}")
-                    except Exception as e:
-                        logger.warning(f"Could not fetch {file.filename}: {e}")
+            if not fetch_content:
+                return files
             
-            return files
+            # Download all contents in parallel, results come back in PR order
+            contents = self.fetch_file_contents([file["raw_url"] for file in files])
+            
+            fetched = []
+            for file, content in zip(files, contents):
+                if content is None:
+                    continue
+                file["content"] = content
+                fetched.append(file)
+                logger.info(f"   📄 Fetched: {file['filename']}")
+            
+            return fetched
         
         except Exception as e:
             logger.error(f"Failed to fetch PR files: {e}")
-            return []
+            return None
+    
+    def get_compare(self, repo_owner, repo_name, base_sha, head_sha):
+        """
+        Files changed between two commits, e.g. since a PR was last reviewed
+        
+        Returns:
+            {"status": "ahead" / "diverged" / ..., "commits": count,
+            "files": code files like get_pr_files(fetch_content=False),
+            "removed": names of the code files deleted},
+            or None if the comparison couldn't be fetched or lists too many
+            files to be complete
+        """
+        if not self.enabled:
+            return None
+        try:
+            compare = self.get_json(
+                f"/repos/{repo_owner}/{repo_name}/compare/{base_sha}...{head_sha}"
+            )
+        except Exception as e:
+            # The base commit may be gone after a force push
+            logger.warning(f"Could not compare {base_sha[:7]}...{head_sha[:7]}: {e}")
+            return None
+        
+        changed = compare.get("files", [])
+        if len(changed) >= MAX_COMPARE_FILES:
+            return None
+        return {
+            "status": compare.get("status"),
+            "commits": compare.get("total_commits", 0),
+            "files": self._code_files(changed),
+            "removed": [
+                file["filename"] for file in changed
+                if file.get("status") == "removed" and self._is_code_file(file["filename"])
+            ]
+        }
+    
+    def get_pull(self, repo_owner, repo_name, pr_number):
+        """
+        PR metadata (head SHA, state, ...), reused for GITHUB_METADATA_TTL seconds
+        
+        Returns:
+            The pull request JSON, or None if it couldn't be fetched
+        """
+        key = (repo_owner, repo_name, pr_number)
+        now = time.monotonic()
+        with self._pulls_lock:
+            entry = self._pulls.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+        
+        try:
+            pull = self.get_json(f"/repos/{repo_owner}/{repo_name}/pulls/{pr_number}")
+        except Exception as e:
+            logger.error(f"Failed to fetch PR #{pr_number}: {e}")
+            return None
+        
+        with self._pulls_lock:
+            # Drop expired entries so the memo stays small
+            self._pulls = {k: v for k, v in self._pulls.items() if v[0] > now}
+            self._pulls[key] = (now + settings.GITHUB_METADATA_TTL, pull)
+        return pull
+    
+    def get_json(self, path, params=None):
+        """
+        GET a REST API resource, revalidating a cached copy
+        
+        The ETag / Last-Modified of every response is kept in Redis with its
+        body, and sent back as If-None-Match / If-Modified-Since. GitHub
+        answers an unchanged resource with 304, which doesn't count against
+        the rate limit.
+        
+        Args:
+            path: API path, e.g. /repos/owner/name/pulls/1
+            params: Query parameters
+        
+        Returns:
+            Parsed JSON body
+        
+        Raises:
+            requests.RequestException: The request failed
+            RateLimited: No rate budget within GITHUB_RATE_WAIT_TIMEOUT
+        """
+        url = f"{settings.GITHUB_API_URL}{path}"
+        if params:
+            url = f"{url}?{urlencode(sorted(params.items()))}"
+        cache_key = f"{API_CACHE_PREFIX}:{hashlib.sha1(url.encode()).hexdigest()}"
+        
+        headers = dict(self.api_headers)
+        cached = redis_client.cache_get(cache_key)
+        entry = json.loads(cached) if cached else None
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        
+        response = self._request("GET", url, headers=headers)
+        if response.status_code == 304 and entry:
+            API_REQUESTS.inc(result="not_modified")
+            # Still current, so keep it around for another TTL
+            redis_client.cache_set(cache_key, cached, ttl=settings.GITHUB_CACHE_TTL)
+            return entry["body"]
+        
+        response.raise_for_status()
+        API_REQUESTS.inc(result="fetched")
+        body = response.json()
+        
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified:
+            redis_client.cache_set(cache_key, json.dumps({
+                "etag": etag,
+                "last_modified": last_modified,
+                "body": body
+            }), ttl=settings.GITHUB_CACHE_TTL)
+        return body
+    
+    def fetch_file_contents(self, urls, max_bytes=None):
+        """
+        Download several raw files concurrently
+        
+        Args:
+            urls: List of raw file URLs
+            max_bytes: Skip files larger than this (None = no limit)
+        
+        Returns:
+            List of contents in the same order, None where a download failed
+            or the file was too large
+        """
+        return list(self.fetch_pool.map(
+            lambda url: self._fetch_file_content_safe(url, max_bytes), urls
+        ))
+    
+    def get_file_sizes(self, urls):
+        """
+        Size up several raw files concurrently, before downloading any
+        
+        The PR files API doesn't report file sizes, so the raw host is
+        asked with HEAD requests (which don't count against the API limit).
+        
+        Returns:
+            List of sizes in bytes in the same order, None where unknown
+        """
+        return list(self.fetch_pool.map(lambda url: file_size(self.session, url), urls))
     
     def post_review_comment(self, repo_owner, repo_name, pr_number, comment_body):
         """
@@ -80,16 +363,20 @@ class GitHubClient:
         Returns:
             True if successful
         """
-        if not self.client:
+        if not self.enabled:
             logger.error("GitHub client not initialized")
             return False
         
         try:
-            repo = self.client.get_repo(f"{repo_owner}/{repo_name}")
-            pr = repo.get_pull(pr_number)
-            
-            # Post comment
-            pr.create_issue_comment(comment_body)
+            # PR comments are issue comments, addressed by number alone
+            response = self._request(
+                "POST",
+                f"{settings.GITHUB_API_URL}/repos/{repo_owner}/{repo_name}/issues/{pr_number}/comments",
+                write=True,
+                json={"body": comment_body},
+                headers=self.api_headers
+            )
+            response.raise_for_status()
             
             logger.info(f"✅ Posted review comment to PR #{pr_number}")
             return True
@@ -98,6 +385,59 @@ class GitHubClient:
             logger.error(f"Failed to post comment: {e}")
             return False
     
+    def _request(self, method, url, write=False, **kwargs):
+        """
+        Make an API call within the shared rate budget
+        
+        Reads are paced so the fleet spreads what is left of the limit over
+        the rest of the window; writes may use the reserve. A call that is
+        rate limited anyway waits for the budget and is tried again.
+        
+        Args:
+            write: Draw on the budget reserved for writes
+        
+        Returns:
+            The last response
+        
+        Raises:
+            RateLimited: No budget within GITHUB_RATE_WAIT_TIMEOUT
+        """
+        for attempt in range(1, RATE_LIMIT_ATTEMPTS + 1):
+            waited = self.budget.acquire(write=write, timeout=settings.GITHUB_RATE_WAIT_TIMEOUT)
+            RATE_WAIT.observe(waited)
+            if waited >= 1:
+                logger.info(f"   ⏳ Waited {waited:.1f}s for GitHub rate budget")
+            
+            response = self.session.request(
+                method, url, timeout=settings.GITHUB_FETCH_TIMEOUT, **kwargs
+            )
+            remaining = response.headers.get("X-RateLimit-Remaining")
+            if remaining is not None:
+                RATE_REMAINING.set(int(remaining))
+            if not self.budget.update(response) or attempt == RATE_LIMIT_ATTEMPTS:
+                return response
+            logger.warning(f"⚠️  GitHub rate limited {method} {url} (attempt {attempt})")
+        return response
+    
+    def _code_files(self, api_files):
+        """Code files of an API file list (skip images, binaries, deleted files, etc.)"""
+        return [
+            {
+                "filename": file["filename"],
+                # Set for a renamed file
+                "previous_filename": file.get("previous_filename"),
+                "sha": file.get("sha"),
+                "content": None,
+                "patch": file.get("patch"),
+                "raw_url": file.get("raw_url"),
+                "additions": file.get("additions", 0),
+                "deletions": file.get("deletions", 0),
+                "changes": file.get("changes", 0)
+            }
+            for file in api_files
+            if self._is_code_file(file["filename"]) and file.get("status") != "removed"
+        ]
+    
     def _is_code_file(self, filename):
         """Check if file is a code file we should analyze"""
         code_extensions = [
@@ -107,11 +447,21 @@ class GitHubClient:
         ]
         return any(filename.endswith(ext) for ext in code_extensions)
     
-    def _fetch_file_content(self, url):
+    def _fetch_file_content_safe(self, url, max_bytes=None):
+        """Fetch file content, returning None instead of raising"""
+        try:
+            return self._fetch_file_content(url, max_bytes)
+        except Exception as e:
+            logger.warning(f"Could not fetch {url}: {e}")
+            return None
+    
+    def _fetch_file_content(self, url, max_bytes=None):
         """Fetch file content from raw URL"""
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        # Limit content size (max 100KB per file)
-        content = response.text[:100000]
+        try:
+            content = "\n".join(stream_lines(self.session, url, max_bytes))
+        except FileTooLarge as e:
+            # Skipped rather than cut off, so it isn't reported as reviewed when it wasn't
+            logger.warning(f"Skipping {url}: {e}")
+            return None
+        BYTES_FETCHED.inc(len(content))
         return content
\ No newline at end of file
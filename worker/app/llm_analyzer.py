@@ -3,26 +3,59 @@ LLM Analyzer - Uses Ollama to analyze code
 """
 import logging
 import sys
-import ollama
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append('/app')
 from shared.config import settings
+from shared.semaphore import RedisSemaphore
+from app.code_analyzer import format_location
+from app.diff_chunker import chunk_diff, estimate_tokens
+from app.llm_cache import LLMResponseCache
+from app.ollama_pool import OllamaPool
 
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = "You are an expert code reviewer. Provide brief, constructive feedback."
+
+# Response lengths of a chunk review and of the review that merges them
+MAP_PREDICT_TOKENS = 200
+REDUCE_PREDICT_TOKENS = 300
+
+# Ollama's default context is 2048 tokens and it silently drops the start
+# of longer prompts, so chunked prompts ask for a window that fits them
+MIN_CONTEXT_TOKENS = 2048
+CONTEXT_MARGIN_TOKENS = 256
+
 
 class LLMAnalyzer:
     """Analyzes code using local LLM (Ollama)"""
     
     def __init__(self):
-        self.model = "codellama"
-        self.ollama_host = f"http://{settings.OLLAMA_HOST}:{settings.OLLAMA_PORT}"
-        # Create Ollama client with custom host
-        self.client = ollama.Client(host=self.ollama_host)
+        self.model = settings.OLLAMA_MODEL
+        # Every configured Ollama host, picked least loaded first
+        self.pool = OllamaPool(model=self.model)
+        self.pool.start()
+        self.options = {
+            "temperature": 0.3,
+            "num_predict": 200
+        }
+        self.cache = LLMResponseCache()
+        # Fleet-wide cap on generations running against Ollama
+        self.slots = RedisSemaphore(
+            "llm",
+            settings.llm_max_concurrency,
+            lease_seconds=settings.LLM_SLOT_LEASE_SECONDS
+        )
+        # Chunks of large PRs are reviewed concurrently
+        self.map_pool = ThreadPoolExecutor(
+            max_workers=max(1, settings.LLM_MAP_PARALLELISM),
+            thread_name_prefix="llm-map"
+        )
         logger.info(f"LLM Analyzer initialized with model: {self.model}")
-        logger.info(f"Connecting to Ollama at: {self.ollama_host}")
+        logger.info(f"Ollama hosts: {', '.join(self.pool.hosts)}")
     
-    def analyze_pr(self, pr_number, pr_title, code_issues):
+    def analyze_pr(self, pr_number, pr_title, code_issues, diffs=None):
         """
         Analyze PR using LLM
         
@@ -30,43 +63,39 @@ class LLMAnalyzer:
             pr_number: PR number
             pr_title: PR title
             code_issues: List of issues found by code analyzer
+            diffs: (filename, patch) pairs of the PR, reviewed in chunks when
+                LLM_REVIEW_MODE is "chunked"
         
         Returns:
             Analysis result from LLM
         """
         try:
-            # Build prompt for LLM
-            prompt = self._build_prompt(pr_title, code_issues)
-            
             logger.info(f"🤖 Asking AI to review PR #{pr_number}...")
             
-            # Call Ollama using the client
-            response = self.client.chat(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert code reviewer. Provide brief, constructive feedback."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                options={
-                    "temperature": 0.3,
-                    "num_predict": 200
-                }
-            )
+            chunks, omitted = [], []
+            if diffs and settings.LLM_REVIEW_MODE == "chunked":
+                chunks, omitted = chunk_diff(
+                    diffs, settings.LLM_CHUNK_TOKENS, settings.LLM_TOKEN_BUDGET
+                )
             
-            analysis = response['message']['content']
+            if chunks:
+                analysis, cached, slot_wait = self._review_chunks(
+                    pr_number, pr_title, code_issues, chunks, omitted
+                )
+            else:
+                prompt = self._build_prompt(pr_title, code_issues)
+                analysis, cached, slot_wait = self._chat(prompt)
             
-            logger.info(f"✅ AI analysis completed for PR #{pr_number}")
+            logger.info(f"✅ AI analysis completed for PR #{pr_number}{' (cached)' if cached else ''}")
             
             return {
                 "summary": analysis,
                 "model": self.model,
-                "success": True
+                "success": True,
+                "cached": cached,
+                "slot_wait": slot_wait,
+                "chunks": len(chunks),
+                "files_omitted": omitted
             }
         
         except Exception as e:
@@ -78,6 +107,186 @@ class LLMAnalyzer:
                 "error": str(e)
             }
     
+    def close(self):
+        """Stop health checks and chunk reviews"""
+        self.pool.stop()
+        self.map_pool.shutdown(wait=False, cancel_futures=True)
+    
+    def _review_chunks(self, pr_number, pr_title, code_issues, chunks, omitted):
+        """
+        Map-reduce review of the diff itself
+        
+        Each chunk is reviewed on its own, LLM_MAP_PARALLELISM at a time, and
+        one short prompt merges what they found. A single chunk is reviewed
+        in one go.
+        
+        Returns:
+            Same as _chat - cached only if every prompt was, and the longest
+            slot wait
+        """
+        issues_by_file = defaultdict(list)
+        for issue in code_issues:
+            issues_by_file[issue.get("file")].append(issue)
+        
+        if len(chunks) == 1:
+            prompt = self._build_chunk_prompt(pr_title, chunks[0], issues_by_file, final=True)
+            return self._chat(prompt, self._options(prompt, REDUCE_PREDICT_TOKENS))
+        
+        logger.info(f"🧩 Reviewing PR #{pr_number} in {len(chunks)} chunks")
+        prompts = [
+            self._build_chunk_prompt(pr_title, chunk, issues_by_file, final=False)
+            for chunk in chunks
+        ]
+        futures = [
+            self.map_pool.submit(self._chat, prompt, self._options(prompt, MAP_PREDICT_TOKENS))
+            for prompt in prompts
+        ]
+        
+        findings = []
+        failed = 0
+        all_cached = True
+        slot_wait = 0.0
+        for index, future in enumerate(futures, 1):
+            try:
+                text, cached, waited = future.result()
+            except Exception as e:
+                logger.warning(f"⚠️  Chunk {index}/{len(chunks)} of PR #{pr_number} not reviewed: {e}")
+                findings.append(f"Part {index}: not reviewed ({e})")
+                failed += 1
+                continue
+            findings.append(f"Part {index}:\n{text.strip()}")
+            all_cached = all_cached and cached
+            slot_wait = max(slot_wait, waited)
+        
+        if failed == len(chunks):
+            raise RuntimeError("no chunk of the diff could be reviewed")
+        
+        prompt = self._build_reduce_prompt(pr_title, findings, omitted)
+        summary, cached, waited = self._chat(prompt, self._options(prompt, REDUCE_PREDICT_TOKENS))
+        return summary, all_cached and cached and not failed, max(slot_wait, waited)
+    
+    def _options(self, prompt, num_predict):
+        """Generation options with a context window that holds the whole prompt"""
+        needed = (
+            estimate_tokens(SYSTEM_PROMPT + prompt) + num_predict + CONTEXT_MARGIN_TOKENS
+        )
+        # Whole KiB of tokens, so similar prompts share a window size
+        num_ctx = max(MIN_CONTEXT_TOKENS, -(-needed // 1024) * 1024)
+        return {**self.options, "num_predict": num_predict, "num_ctx": num_ctx}
+    
+    def _chat(self, prompt, options=None):
+        """
+        Send a prompt to the model, reusing a cached response when possible
+        
+        Args:
+            options: Generation options (defaults to self.options)
+        
+        Returns:
+            Tuple of (response text, True if it came from the cache,
+            seconds spent waiting for an LLM slot)
+        """
+        messages = [
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+        
+        options = options or self.options
+        cache_key = self.cache.make_key(self.model, messages, options)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"⚡ LLM cache hit ({self.cache.stats()})")
+            return cached, True, 0.0
+        
+        with self.slots.slot(settings.LLM_SLOT_WAIT_TIMEOUT) as slot_wait:
+            if slot_wait >= 1:
+                logger.info(f"⏳ Waited {slot_wait:.1f}s for an LLM slot")
+            
+            # Runs on the least loaded healthy host
+            response = self.pool.chat(
+                model=self.model,
+                messages=messages,
+                options=options
+            )
+        
+        analysis = response['message']['content']
+        self.cache.set(cache_key, analysis)
+        return analysis, False, slot_wait
+    
+    def _build_chunk_prompt(self, pr_title, chunk, issues_by_file, final):
+        """
+        Prompt reviewing one chunk of the diff
+        
+        Args:
+            issues_by_file: Static analysis issues keyed by file, the ones for
+                files in this chunk are included
+            final: The chunk is the whole diff, so ask for the full review
+        """
+        files = sorted({
+            line[4:].replace(" (continued)", "")
+            for line in chunk.splitlines()
+            if line.startswith("### ")
+        })
+        issues = [issue for name in files for issue in issues_by_file.get(name, [])][:10]
+        issues_text = ""
+        if issues:
+            issues_text = "\nAutomated checks flagged:\n" + "\n".join(
+                f"- {issue['severity'].upper()}: {issue['message']} ({format_location(issue)})"
+                for issue in issues
+            ) + "\n"
+        
+        if final:
+            task = """Please provide:
+1. Overall assessment (1 sentence)
+2. Most critical issue to fix
+3. One suggestion for improvement
+
+Keep response under 150 words."""
+        else:
+            task = """List at most 3 real problems in these changes (bugs, security, error handling),
+one per line as "- file:line - problem". Reply "No issues" if there are none."""
+        
+        return f"""
+Review this part of a Pull Request diff:
+
+Title: {pr_title}
+
+{chunk}
+{issues_text}
+{task}
+"""
+    
+    def _build_reduce_prompt(self, pr_title, findings, omitted):
+        """Prompt merging the chunk reviews into one review"""
+        omitted_text = ""
+        if omitted:
+            listed = ", ".join(omitted[:10])
+            more = f" and {len(omitted) - 10} more" if len(omitted) > 10 else ""
+            omitted_text = f"\nNot reviewed (over the size budget): {listed}{more}\n"
+        findings_text = "\n\n".join(findings)
+        
+        return f"""
+Review this Pull Request:
+
+Title: {pr_title}
+
+Reviewers of {len(findings)} parts of the diff found:
+
+{findings_text}
+{omitted_text}
+Please provide:
+1. Overall assessment (1 sentence)
+2. Most critical issues to fix, without repeating the same problem
+3. One suggestion for improvement
+
+Keep response under 150 words.
+"""
+    
     def _build_prompt(self, pr_title, code_issues):
         """Build prompt for LLM analysis"""
         
@@ -93,7 +302,7 @@ Please provide a brief summary (2-3 sentences) of what to verify manually.
 """
         
         issues_text = "\n".join([
-            f"- {issue['severity'].upper()}: {issue['message']} (line {issue['line']})"
+            f"- {issue['severity'].upper()}: {issue['message']} ({format_location(issue)})"
             for issue in code_issues[:5]
         ])
         
@@ -0,0 +1,115 @@
+"""
+LLM Cache - Reuses LLM responses for identical prompts
+"""
+import hashlib
+import json
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+sys.path.append('/app')
+from shared.config import settings
+from shared.redis_client import redis_client
+from shared.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CACHE_LOOKUPS = metrics.counter(
+    "review_cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"]
+)
+
+
+class LLMResponseCache:
+    """Small in-process LRU in front of a shared Redis cache"""
+    
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = settings.LLM_CACHE_SIZE if max_entries is None else max_entries
+        self.ttl = settings.LLM_CACHE_TTL if ttl is None else ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+    
+    @property
+    def enabled(self):
+        """Caching is switched off with a TTL of 0"""
+        return self.ttl > 0
+    
+    def make_key(self, model, messages, options):
+        """
+        Hash everything that influences the response
+        
+        Args:
+            model: Model name
+            messages: Chat messages (system and user prompts)
+            options: Generation options
+        
+        Returns:
+            Hex digest identifying the request
+        """
+        request = json.dumps(
+            {"model": model, "messages": messages, "options": options},
+            sort_keys=True
+        )
+        return hashlib.sha256(request.encode()).hexdigest()
+    
+    def get(self, key):
+        """Return the cached response text, or None"""
+        if not self.enabled:
+            return None
+        
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.local_hits += 1
+                CACHE_LOOKUPS.inc(cache="llm", result="hit")
+                return entry[0]
+            if entry:
+                del self._entries[key]
+        
+        value = redis_client.cache_get(f"llm:{key}")
+        if value is not None:
+            self._remember(key, value)
+            with self._lock:
+                self.redis_hits += 1
+            CACHE_LOOKUPS.inc(cache="llm", result="hit")
+            return value
+        
+        with self._lock:
+            self.misses += 1
+        CACHE_LOOKUPS.inc(cache="llm", result="miss")
+        return None
+    
+    def set(self, key, value):
+        """Store a response locally and in Redis"""
+        if not self.enabled:
+            return
+        self._remember(key, value)
+        redis_client.cache_set(f"llm:{key}", value, ttl=self.ttl)
+    
+    def stats(self):
+        """Hit/miss counters"""
+        with self._lock:
+            hits = self.local_hits + self.redis_hits
+            total = hits + self.misses
+            return {
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0
+            }
+    
+    def _remember(self, key, value):
+        """Put an entry in the local LRU, evicting the oldest if full"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,507 @@
+"""
+Notifier - Sends the GitHub comments and Slack messages queued by workers
+"""
+import asyncio
+import json
+import logging
+import random
+import signal
+import socket
+import sys
+import time
+import uuid
+from collections import deque
+import httpx
+
+sys.path.append('/app')
+
+from shared.config import settings
+from shared.metrics import metrics, start_metrics_server
+from shared.async_redis_client import async_redis_client
+from shared.rate_budget import RateBudget, RateLimited, rate_limit_block
+from app.slack_notifier import build_review_payload, build_digest_payload
+
+# Setup logging
+logging.basicConfig(
+    level=getattr(logging, settings.LOG_LEVEL),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+NOTIFICATIONS_TOTAL = metrics.counter(
+    "notifications_total", "Notifications handled by kind and outcome", ["kind", "result"]
+)
+NOTIFY_DELAY = metrics.histogram(
+    "notification_delay_seconds", "Time from queueing to delivery, retries included", ["kind"]
+)
+
+# Kept below the Redis client's 5s socket timeout
+BLOCK_SECONDS = 2
+
+# Exponential backoff between attempts, unless the server says when to retry
+RETRY_BASE_SECONDS = 2
+RETRY_MAX_SECONDS = 300
+RETRY_POLL_SECONDS = 1
+
+# Window for the Slack message rate that switches digest mode on
+RATE_WINDOW_SECONDS = 60
+
+# A notifier renews its heartbeat this often; once it has been silent for
+# HEARTBEAT_TTL_SECONDS, the others requeue what its processing list holds
+HEARTBEAT_SECONDS = 10
+HEARTBEAT_TTL_SECONDS = 60
+ORPHAN_SWEEP_SECONDS = 60
+
+# How long a review send may hold its PR's comment lock (an edit and a post),
+# and how soon a review of the same PR waiting on it is tried again
+COMMENT_LOCK_SECONDS = int(2 * settings.NOTIFY_TIMEOUT) + 5
+COMMENT_LOCK_RETRY_SECONDS = 1
+
+# Release a lock only if the caller still holds it
+# KEYS: lock   ARGV: holder token
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Move retries that are due back onto the queue. Atomic, so with several
+# notifiers each retry is requeued exactly once.
+# KEYS: retry zset, queue   ARGV: now
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 100)
+for _, raw in ipairs(due) do
+    redis.call('ZREM', KEYS[1], raw)
+    redis.call('RPUSH', KEYS[2], raw)
+end
+return #due
+"""
+
+
+class DeliveryError(Exception):
+    """A notification the receiving service did not accept"""
+    
+    def __init__(self, message, retryable, retry_after=None, deferred=False, status=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+        # HTTP status of the rejection, None if there was no response
+        self.status = status
+        # Not sent at all (e.g. no rate budget), so it doesn't use up an attempt
+        self.deferred = deferred
+
+
+def backoff_seconds(attempt):
+    """Delay before the next attempt: exponential with jitter"""
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def retry_after_seconds(response):
+    """When the server asks us to come back, if it says so"""
+    retry_after = response.headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            return None
+    # GitHub's rate limit reset, as epoch seconds
+    reset = response.headers.get("x-ratelimit-reset")
+    if reset and response.headers.get("x-ratelimit-remaining") == "0":
+        try:
+            return max(0.0, float(reset) - time.time())
+        except ValueError:
+            return None
+    return None
+
+
+class Notifier:
+    """
+    Delivers queued notifications over one pooled HTTP client
+    
+    Messages are moved to a per-host processing list while they are sent, so
+    a crash never loses one: the host requeues them when it restarts, and
+    other notifiers do once its heartbeat has run out (a recreated container
+    comes back under a new hostname). Failed sends wait in a retry set until they are
+    due again. When Slack traffic exceeds NOTIFY_DIGEST_THRESHOLD messages a
+    minute, review messages are rolled into a periodic digest instead.
+    """
+    
+    def __init__(self, redis=None):
+        """
+        Args:
+            redis: asyncio Redis client (defaults to the shared pool)
+        """
+        self.redis = redis or async_redis_client.client
+        self.queue_name = settings.NOTIFY_QUEUE_NAME
+        # Container hostnames are unique, so a restarted notifier finds its own leftovers
+        self.processing_name = f"{self.queue_name}:processing:{socket.gethostname()}"
+        self.heartbeat_name = f"{self.processing_name}:alive"
+        # Every processing list in use, so orphaned ones can be found
+        self.processors_name = f"{self.queue_name}:processors"
+        self.retry_name = f"{self.queue_name}:retry"
+        self.concurrency = max(1, settings.NOTIFY_CONCURRENCY)
+        self.max_attempts = max(1, settings.NOTIFY_MAX_ATTEMPTS)
+        self.github_headers = {
+            "Authorization": f"Bearer {settings.GITHUB_TOKEN}",
+            "Accept": "application/vnd.github+json"
+        }
+        # Comments draw on the budget the workers' reads leave in reserve
+        self.github_budget = RateBudget("github", settings.GITHUB_TOKEN, redis=self.redis)
+        self._promote = self.redis.register_script(PROMOTE_SCRIPT)
+        self._release_lock = self.redis.register_script(RELEASE_LOCK_SCRIPT)
+        self._slack_times = deque()
+        # (raw entry, message) pairs waiting for the next digest
+        self._digest = []
+        self.http = None
+        self.running = True
+    
+    async def run(self):
+        """Send notifications until stop() is called"""
+        self.http = httpx.AsyncClient(
+            timeout=settings.NOTIFY_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency
+            )
+        )
+        slots = asyncio.Semaphore(self.concurrency)
+        in_flight = set()
+        await self._beat()
+        background = [
+            asyncio.create_task(self._promote_retries()),
+            asyncio.create_task(self._send_digests()),
+            asyncio.create_task(self._keep_alive()),
+            asyncio.create_task(self._sweep_orphans())
+        ]
+        await self._recover()
+        logger.info(f"📨 Notifier started (concurrency {self.concurrency})")
+        
+        try:
+            while self.running:
+                # Only take a message off the queue once it can be sent
+                await slots.acquire()
+                try:
+                    raw = await self.redis.blmove(
+                        self.queue_name, self.processing_name, BLOCK_SECONDS, "LEFT", "RIGHT"
+                    )
+                except Exception as e:
+                    slots.release()
+                    logger.error(f"❌ Failed to read notification queue: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                if raw is None:
+                    slots.release()
+                    continue
+                
+                task = asyncio.create_task(self._handle(raw))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+                task.add_done_callback(lambda _: slots.release())
+        finally:
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+            await self._flush_digest()
+            await self.http.aclose()
+            logger.info("👋 Notifier stopped")
+    
+    def stop(self):
+        """Finish in-flight sends and stop"""
+        self.running = False
+    
+    async def _handle(self, raw):
+        """Send one queued message, or schedule its retry"""
+        try:
+            message = json.loads(raw)
+        except json.JSONDecodeError:
+            logger.error(f"❌ Dropping malformed notification: {raw[:200]}")
+            await self.redis.lrem(self.processing_name, 1, raw)
+            return
+        
+        kind = message.get("kind", "unknown")
+        try:
+            if kind == "slack_review" and self._digesting():
+                self._digest.append((raw, message))
+                NOTIFICATIONS_TOTAL.inc(kind=kind, result="digested")
+                return
+            result = await self._deliver(message)
+        except DeliveryError as e:
+            await self._retry_or_drop(raw, message, e)
+            return
+        except Exception as e:
+            logger.error(f"❌ Failed to send {kind} notification: {e}")
+            await self._retry_or_drop(raw, message, DeliveryError(str(e), retryable=True))
+            return
+        
+        await self.redis.lrem(self.processing_name, 1, raw)
+        NOTIFICATIONS_TOTAL.inc(kind=kind, result=result)
+        NOTIFY_DELAY.observe(time.time() - message.get("queued_at", time.time()), kind=kind)
+    
+    async def _deliver(self, message):
+        """
+        Send a message to the service its kind belongs to
+        
+        Returns:
+            "sent", or "superseded" if a newer review is on the PR already
+        """
+        kind = message.get("kind")
+        if kind == "github_comment":
+            if not settings.GITHUB_TOKEN:
+                raise DeliveryError("no GitHub token configured", retryable=False)
+            return await self._send_review_comment(message)
+        elif kind == "slack_review":
+            if not settings.SLACK_WEBHOOK_URL:
+                raise DeliveryError("no Slack webhook configured", retryable=False)
+            await self._send(settings.SLACK_WEBHOOK_URL, build_review_payload(**message["review"]))
+            logger.info(f"✅ Slack notification sent for PR #{message['review']['pr_number']}")
+        else:
+            raise DeliveryError(f"unknown notification kind {kind!r}", retryable=False)
+        return "sent"
+    
+    async def _send_review_comment(self, message):
+        """
+        Post a PR's review, or edit the comment an earlier review posted
+        
+        Sends for the same PR hold a short Redis lock, across all notifiers,
+        so two reviews of a PR never both post a new comment: the later one
+        waits in the retry set and then edits the comment the first posted.
+        The comment remembers which review it shows, so a review older than
+        that one - deferred, or retried after a failure - is dropped instead
+        of replacing it.
+        """
+        review_key = message.get("review_key")
+        if not review_key:
+            await self._post_or_edit_comment(message, None)
+            return "sent"
+        
+        lock_key = f"{review_key}:sending"
+        token = str(uuid.uuid4())
+        if not await self.redis.set(lock_key, token, nx=True, ex=COMMENT_LOCK_SECONDS):
+            raise DeliveryError(
+                "another review of this PR is being sent", retryable=True,
+                retry_after=COMMENT_LOCK_RETRY_SECONDS, deferred=True
+            )
+        try:
+            shown = await self.redis.hget(review_key, "comment_review_order")
+            order = message.get("review_order")
+            if shown is not None and order is not None and float(order) < float(shown):
+                logger.info(f"⏭️  A newer review is on GitHub PR #{message['pr_number']}, dropping this one")
+                return "superseded"
+            await self._post_or_edit_comment(message, review_key)
+            return "sent"
+        finally:
+            try:
+                await self._release_lock(keys=[lock_key], args=[token])
+            except Exception as e:
+                # Runs out after COMMENT_LOCK_SECONDS anyway
+                logger.error(f"Failed to release comment lock {lock_key}: {e}")
+    
+    async def _post_or_edit_comment(self, message, review_key):
+        """
+        Edit the PR's review comment if there is one, else post it
+        
+        The comment id is looked up when sending rather than when queueing,
+        so a review queued before the previous one was posted still finds it.
+        """
+        repo_url = f"{settings.GITHUB_API_URL}/repos/{message['repo_owner']}/{message['repo_name']}"
+        payload = {"body": message["body"]}
+        comment_id = await self.redis.hget(review_key, "comment_id") if review_key else None
+        fields = {}
+        if message.get("review_order") is not None:
+            fields["comment_review_order"] = message["review_order"]
+        
+        if comment_id:
+            try:
+                await self._send_github("PATCH", f"{repo_url}/issues/comments/{comment_id}", payload)
+                logger.info(f"✏️  Updated review on GitHub PR #{message['pr_number']}")
+                if fields:
+                    await self.redis.hset(review_key, mapping=fields)
+                return
+            except DeliveryError as e:
+                if e.status != 404:
+                    raise
+                logger.info(f"   Review comment {comment_id} was deleted, posting a new one")
+        
+        response = await self._send_github(
+            "POST", f"{repo_url}/issues/{message['pr_number']}/comments", payload
+        )
+        logger.info(f"💬 Posted review to GitHub PR #{message['pr_number']}")
+        if review_key:
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.hset(review_key, mapping={**fields, "comment_id": response.json()["id"]})
+            pipe.expire(review_key, settings.REVIEW_STATE_TTL)
+            await pipe.execute()
+    
+    async def _send_github(self, method, url, payload):
+        """Write to the GitHub API within the rate budget kept for writes"""
+        try:
+            await self.github_budget.acquire_async(write=True, timeout=0)
+        except RateLimited as e:
+            raise DeliveryError(str(e), retryable=True, retry_after=e.retry_after, deferred=True)
+        return await self._send(url, payload, self.github_headers, self.github_budget, method)
+    
+    async def _send(self, url, payload, headers=None, budget=None, method="POST"):
+        """
+        Send a JSON payload
+        
+        Args:
+            budget: RateBudget to report the response's rate limit headers to
+        
+        Returns:
+            The response
+        
+        Raises:
+            DeliveryError: Rate limits, 5xx and connection errors are retryable,
+                any other rejection is not
+        """
+        try:
+            response = await self.http.request(method, url, json=payload, headers=headers)
+        except httpx.HTTPError as e:
+            raise DeliveryError(f"{type(e).__name__}: {e}", retryable=True)
+        if budget:
+            await budget.update_async(response)
+        
+        status = response.status_code
+        if status < 300:
+            return response
+        # GitHub reports exhausted and secondary rate limits as 403
+        rate_limited = status == 429 or (status == 403 and (
+            response.headers.get("x-ratelimit-remaining") == "0" or rate_limit_block(response) > 0
+        ))
+        raise DeliveryError(
+            f"HTTP {status}: {response.text[:200]}",
+            retryable=rate_limited or status >= 500,
+            retry_after=retry_after_seconds(response),
+            status=status
+        )
+    
+    async def _retry_or_drop(self, raw, message, error):
+        """Move a failed message to the retry set, or give up on it"""
+        kind = message.get("kind", "unknown")
+        attempt = message.get("attempt", 1)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lrem(self.processing_name, 1, raw)
+        if error.retryable and (error.deferred or attempt < self.max_attempts):
+            delay = error.retry_after if error.retry_after is not None else backoff_seconds(attempt)
+            retry = json.dumps({**message, "attempt": attempt if error.deferred else attempt + 1})
+            pipe.zadd(self.retry_name, {retry: time.time() + delay})
+            logger.warning(f"⚠️  {kind} attempt {attempt} failed ({error}), retrying in {delay:.0f}s")
+            NOTIFICATIONS_TOTAL.inc(kind=kind, result="retried")
+        else:
+            logger.error(f"❌ Giving up on {kind} after {attempt} attempt(s): {error}")
+            NOTIFICATIONS_TOTAL.inc(kind=kind, result="dropped")
+        await pipe.execute()
+    
+    def _digesting(self):
+        """Count a Slack message and tell whether the rate calls for a digest"""
+        now = time.monotonic()
+        self._slack_times.append(now)
+        while self._slack_times[0] < now - RATE_WINDOW_SECONDS:
+            self._slack_times.popleft()
+        threshold = settings.NOTIFY_DIGEST_THRESHOLD
+        return threshold > 0 and len(self._slack_times) > threshold
+    
+    async def _flush_digest(self):
+        """Send everything waiting for the digest as one Slack message"""
+        if not self._digest:
+            return
+        batch, self._digest = self._digest, []
+        try:
+            await self._send(
+                settings.SLACK_WEBHOOK_URL,
+                build_digest_payload([message["review"] for _, message in batch])
+            )
+        except DeliveryError as e:
+            if e.retryable:
+                # Still in the processing list, so nothing is lost if we stop meanwhile
+                logger.warning(f"⚠️  Slack digest failed ({e}), retrying next interval")
+                self._digest = batch + self._digest
+                return
+            logger.error(f"❌ Dropping Slack digest of {len(batch)} reviews: {e}")
+        else:
+            logger.info(f"✅ Slack digest sent for {len(batch)} reviews")
+        
+        pipe = self.redis.pipeline(transaction=False)
+        for raw, _ in batch:
+            pipe.lrem(self.processing_name, 1, raw)
+        await pipe.execute()
+    
+    async def _send_digests(self):
+        while True:
+            await asyncio.sleep(settings.NOTIFY_DIGEST_INTERVAL)
+            try:
+                await self._flush_digest()
+            except Exception as e:
+                logger.error(f"❌ Slack digest failed: {e}")
+    
+    async def _promote_retries(self):
+        while True:
+            await asyncio.sleep(RETRY_POLL_SECONDS)
+            try:
+                await self._promote(keys=[self.retry_name, self.queue_name], args=[time.time()])
+            except Exception as e:
+                logger.error(f"❌ Failed to requeue notification retries: {e}")
+    
+    async def _recover(self):
+        """Requeue messages a previous run of this notifier was still sending"""
+        recovered = await self._requeue(self.processing_name)
+        if recovered:
+            logger.info(f"♻️  Requeued {recovered} unsent notifications")
+    
+    async def _requeue(self, processing_name):
+        """Move everything in a processing list back to the queue"""
+        moved = 0
+        while await self.redis.lmove(processing_name, self.queue_name, "RIGHT", "LEFT"):
+            moved += 1
+        return moved
+    
+    async def _beat(self):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.set(self.heartbeat_name, 1, ex=HEARTBEAT_TTL_SECONDS)
+        pipe.sadd(self.processors_name, self.processing_name)
+        await pipe.execute()
+    
+    async def _keep_alive(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                await self._beat()
+            except Exception as e:
+                logger.error(f"❌ Failed to renew notifier heartbeat: {e}")
+    
+    async def _sweep_orphans(self):
+        """Requeue the processing lists of notifiers whose heartbeat ran out"""
+        while True:
+            try:
+                for processing_name in await self.redis.smembers(self.processors_name):
+                    if processing_name == self.processing_name:
+                        continue
+                    if await self.redis.exists(f"{processing_name}:alive"):
+                        continue
+                    recovered = await self._requeue(processing_name)
+                    if recovered:
+                        logger.info(f"♻️  Requeued {recovered} notifications left by {processing_name}")
+                    await self.redis.srem(self.processors_name, processing_name)
+            except Exception as e:
+                logger.error(f"❌ Failed to sweep orphaned notifications: {e}")
+            await asyncio.sleep(ORPHAN_SWEEP_SECONDS)
+
+
+async def main():
+    start_metrics_server(settings.NOTIFY_METRICS_PORT)
+    notifier = Notifier()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, notifier.stop)
+    try:
+        await notifier.run()
+    finally:
+        await async_redis_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,263 @@
+"""
+Ollama Pool - Spreads generations over several Ollama hosts
+"""
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+import ollama
+
+sys.path.append('/app')
+from shared import redis_client
+from shared.config import settings
+from shared.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_REQUESTS = metrics.counter(
+    "ollama_requests_total", "Generations per Ollama host by result", ["backend", "result"]
+)
+OLLAMA_SECONDS = metrics.histogram(
+    "ollama_request_seconds", "Generation latency per Ollama host", ["backend"],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+)
+OLLAMA_IN_FLIGHT = metrics.gauge(
+    "ollama_in_flight", "Generations running on each Ollama host, across all workers", ["backend"]
+)
+OLLAMA_HEALTHY = metrics.gauge(
+    "ollama_backend_healthy", "1 while an Ollama host is in rotation, 0 while ejected", ["backend"]
+)
+
+POOL_PREFIX = "ollama_pool"
+
+# How often a generation waiting for room on a host looks again
+HOST_WAIT_POLL_SECONDS = 0.25
+
+# KEYS: in-flight zset of each candidate host
+# ARGV: request token, lease seconds, generations per host (0 = no limit)
+#
+# Picks the host with the fewest generations in flight across all workers
+# and registers the request there in one step, so concurrent callers spread
+# out instead of all seeing the same idle host. Entries expire after their
+# lease in case a worker dies mid-request. Returns the 1-based key index, or
+# 0 if every host is at its limit.
+ROUTE_SCRIPT = """
+local now = tonumber(redis.call('TIME')[1])
+local limit = tonumber(ARGV[3])
+local best, best_count
+for i, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now)
+    local count = redis.call('ZCARD', key)
+    if (limit <= 0 or count < limit) and (best == nil or count < best_count) then
+        best, best_count = i, count
+    end
+end
+if best == nil then
+    return 0
+end
+redis.call('ZADD', KEYS[best], now + tonumber(ARGV[2]), ARGV[1])
+return best
+"""
+
+
+def in_flight_key(host):
+    return f"{POOL_PREFIX}:{host}:in_flight"
+
+
+def ejected_key(host):
+    return f"{POOL_PREFIX}:{host}:ejected"
+
+
+def is_host_failure(error):
+    """Whether an error says something about the host rather than the request"""
+    if isinstance(error, ollama.ResponseError):
+        # 404 is a model this host hasn't pulled
+        return error.status_code >= 500 or error.status_code == 404
+    return True
+
+
+class OllamaPool:
+    """
+    Ollama hosts shared by every worker
+    
+    Each generation goes to the healthy host with the fewest generations in
+    flight fleet wide, and no host runs more than LLM_MAX_CONCURRENCY at once
+    - the fleet-wide slots are sized for every configured host, so while one
+    is ejected the rest would otherwise take its share. A host that fails a
+    request or a health check is left out by every worker for
+    OLLAMA_EJECT_SECONDS.
+    """
+    
+    def __init__(self, hosts=None, model=None):
+        """
+        Args:
+            hosts: Ollama hosts, host:port or URLs (defaults to OLLAMA_HOSTS)
+            model: Model health checks expect to be pulled (defaults to OLLAMA_MODEL)
+        """
+        self.hosts = hosts or settings.ollama_hosts
+        self.model = model or settings.OLLAMA_MODEL
+        self.clients = {host: ollama.Client(host=host) for host in self.hosts}
+        self.probes = {
+            host: ollama.Client(host=host, timeout=settings.OLLAMA_HEALTH_TIMEOUT)
+            for host in self.hosts
+        }
+        self._route = redis_client.client.register_script(ROUTE_SCRIPT)
+        self._stop = threading.Event()
+        self._health_thread = None
+    
+    def start(self):
+        """Start health checking in the background"""
+        if settings.OLLAMA_HEALTH_INTERVAL <= 0 or self._health_thread:
+            return
+        self._health_thread = threading.Thread(
+            target=self._check_health_loop, name="ollama-health", daemon=True
+        )
+        self._health_thread.start()
+    
+    def stop(self):
+        """Stop health checking"""
+        self._stop.set()
+    
+    def chat(self, **kwargs):
+        """
+        Run a chat request on the least loaded healthy host
+        
+        A host that fails is ejected and the request moves on to the next
+        one, until every host has been tried.
+        
+        Args:
+            kwargs: Passed to ollama.Client.chat
+        
+        Returns:
+            The chat response
+        
+        Raises:
+            TimeoutError: No host had room within LLM_SLOT_WAIT_TIMEOUT
+            Exception: The last host's error, or the request's own error
+                (e.g. a bad request) straight away
+        """
+        tried = []
+        while True:
+            host, token = self._wait_for_host(exclude=tried)
+            tried.append(host)
+            start = time.monotonic()
+            try:
+                response = self.clients[host].chat(**kwargs)
+            except Exception as e:
+                OLLAMA_REQUESTS.inc(backend=host, result="error")
+                if not is_host_failure(e) or len(tried) == len(self.hosts):
+                    raise
+                self.eject(host, e)
+                logger.warning(f"⚠️  Ollama host {host} failed ({e}), trying another")
+                continue
+            finally:
+                self._finish(host, token)
+            
+            OLLAMA_SECONDS.observe(time.monotonic() - start, backend=host)
+            OLLAMA_REQUESTS.inc(backend=host, result="ok")
+            return response
+    
+    def eject(self, host, reason):
+        """Take a host out of rotation for every worker"""
+        try:
+            redis_client.client.set(
+                ejected_key(host), str(reason)[:200], ex=settings.OLLAMA_EJECT_SECONDS
+            )
+        except Exception as e:
+            logger.error(f"Failed to eject Ollama host {host}: {e}")
+        OLLAMA_HEALTHY.set(0, backend=host)
+        logger.warning(f"🚫 Ollama host {host} ejected for {settings.OLLAMA_EJECT_SECONDS}s: {reason}")
+    
+    def stats(self):
+        """In-flight generations and health of each host"""
+        try:
+            now = time.time()
+            pipe = redis_client.client.pipeline(transaction=False)
+            for host in self.hosts:
+                pipe.zcount(in_flight_key(host), now, "+inf")
+                pipe.exists(ejected_key(host))
+            results = pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to read Ollama pool stats: {e}")
+            return {}
+        return {
+            host: {"in_flight": results[2 * index], "healthy": not results[2 * index + 1]}
+            for index, host in enumerate(self.hosts)
+        }
+    
+    def _wait_for_host(self, exclude):
+        """
+        Pick a host, waiting while every healthy one is at its limit
+        
+        Raises:
+            TimeoutError: No host had room within LLM_SLOT_WAIT_TIMEOUT
+        """
+        start = time.monotonic()
+        while True:
+            host, token = self._pick(exclude)
+            waited = time.monotonic() - start
+            if host:
+                if waited >= 1:
+                    logger.info(f"⏳ Waited {waited:.1f}s for room on an Ollama host")
+                return host, token
+            if waited >= settings.LLM_SLOT_WAIT_TIMEOUT:
+                raise TimeoutError(f"No Ollama host had room after {waited:.1f}s")
+            time.sleep(HOST_WAIT_POLL_SECONDS)
+    
+    def _pick(self, exclude):
+        """
+        Choose a host and register the request on it
+        
+        Returns:
+            (host, token to pass to _finish) - the token is None if Redis
+            couldn't be reached and the host was picked at random, and both
+            are None if every healthy host is at its limit
+        """
+        candidates = [host for host in self.hosts if host not in exclude]
+        token = str(uuid.uuid4())
+        try:
+            ejected = redis_client.client.mget([ejected_key(host) for host in candidates])
+            # With every host ejected, trying one beats failing outright
+            healthy = [host for host, out in zip(candidates, ejected) if out is None] or candidates
+            # Shuffled so ties don't all go to the first host listed
+            random.shuffle(healthy)
+            index = self._route(
+                keys=[in_flight_key(host) for host in healthy],
+                args=[token, settings.LLM_SLOT_LEASE_SECONDS, settings.LLM_MAX_CONCURRENCY],
+                client=redis_client.client
+            )
+            if not index:
+                return None, None
+            return healthy[int(index) - 1], token
+        except Exception as e:
+            logger.error(f"Failed to route Ollama request: {e}")
+            return random.choice(candidates), None
+    
+    def _finish(self, host, token):
+        if token is None:
+            return
+        try:
+            redis_client.client.zrem(in_flight_key(host), token)
+        except Exception as e:
+            logger.error(f"Failed to release Ollama request on {host}: {e}")
+    
+    def _check_health_loop(self):
+        while not self._stop.wait(settings.OLLAMA_HEALTH_INTERVAL):
+            for host in self.hosts:
+                self._check_health(host)
+            for host, stats in self.stats().items():
+                OLLAMA_IN_FLIGHT.set(stats["in_flight"], backend=host)
+                OLLAMA_HEALTHY.set(int(stats["healthy"]), backend=host)
+    
+    def _check_health(self, host):
+        """Eject a host that doesn't answer or hasn't pulled the model"""
+        try:
+            models = self.probes[host].list().get("models", [])
+        except Exception as e:
+            self.eject(host, e)
+            return
+        names = {model.get("name", "") for model in models}
+        if self.model not in names and f"{self.model}:latest" not in names:
+            self.eject(host, f"model {self.model} not pulled")
\ No newline at end of file
@@ -11,6 +11,131 @@ from shared.config import settings
 
 logger = logging.getLogger(__name__)
 
+# PRs listed individually in a digest message
+DIGEST_MAX_LINES = 20
+
+
+def build_review_payload(pr_number, pr_title, repo_owner, repo_name,
+                         issues_count, ai_summary, processing_time):
+    """Slack message for one finished review"""
+    # Determine color based on issues
+    if issues_count == 0:
+        color = "#36a64f"  # Green
+        status_emoji = "✅"
+    elif issues_count <= 3:
+        color = "#FFA500"  # Orange
+        status_emoji = "⚠️"
+    else:
+        color = "#FF0000"  # Red
+        status_emoji = "🔴"
+    
+    # Build GitHub PR URL
+    pr_url = f"https://github.com/{repo_owner}/{repo_name}/pull/{pr_number}" if repo_owner and repo_name else ""
+    
+    # Create Slack message with blocks (rich formatting)
+    payload = {
+        "text": f"🤖 Code Review Complete for PR #{pr_number}",
+        "attachments": [
+            {
+                "color": color,
+                "blocks": [
+                    {
+                        "type": "header",
+                        "text": {
+                            "type": "plain_text",
+                            "text": f"{status_emoji} Code Review Complete",
+                            "emoji": True
+                        }
+                    },
+                    {
+                        "type": "section",
+                        "fields": [
+                            {
+                                "type": "mrkdwn",
+                                "text": f"*PR:*\n#{pr_number} - {pr_title}"
+                            },
+                            {
+                                "type": "mrkdwn",
+                                "text": f"*Repository:*\n{repo_owner}/{repo_name}" if repo_owner else "*Repository:*\nDemo PR"
+                            }
+                        ]
+                    },
+                    {
+                        "type": "section",
+                        "fields": [
+                            {
+                                "type": "mrkdwn",
+                                "text": f"*Issues Found:*\n{issues_count}"
+                            },
+                            {
+                                "type": "mrkdwn",
+                                "text": f"*Processing Time:*\n{processing_time:.2f}s"
+                            }
+                        ]
+                    },
+                    {
+                        "type": "section",
+                        "text": {
+                            "type": "mrkdwn",
+                            "text": f"*AI Analysis:*\n{ai_summary[:200]}..."
+                        }
+                    }
+                ]
+            }
+        ]
+    }
+    
+    # Add button to view PR if URL available
+    if pr_url:
+        payload["attachments"][0]["blocks"].append({
+            "type": "actions",
+            "elements": [
+                {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "View PR on GitHub",
+                        "emoji": True
+                    },
+                    "url": pr_url,
+                    "style": "primary"
+                }
+            ]
+        })
+    
+    return payload
+
+
+def build_digest_payload(reviews):
+    """
+    One Slack message summarizing many finished reviews
+    
+    Args:
+        reviews: List of review notification dicts (same fields as above)
+    """
+    total_issues = sum(review["issues_count"] for review in reviews)
+    lines = []
+    for review in reviews[:DIGEST_MAX_LINES]:
+        repo = f"{review['repo_owner']}/{review['repo_name']}" if review.get("repo_owner") else "Demo PR"
+        lines.append(f"• {repo} #{review['pr_number']} - {review['pr_title']}: {review['issues_count']} issues")
+    if len(reviews) > DIGEST_MAX_LINES:
+        lines.append(f"…and {len(reviews) - DIGEST_MAX_LINES} more")
+    
+    return {
+        "text": f"🤖 {len(reviews)} code reviews completed ({total_issues} issues)",
+        "attachments": [
+            {
+                "color": "#439FE0",
+                "blocks": [
+                    {
+                        "type": "section",
+                        "text": {"type": "mrkdwn", "text": "\n".join(lines)}
+                    }
+                ]
+            }
+        ]
+    }
+
 
 class SlackNotifier:
     """Send notifications to Slack"""
@@ -43,90 +168,10 @@ class SlackNotifier:
             return False
         
         try:
-            # Determine color based on issues
-            if issues_count == 0:
-                color = "#36a64f"  # Green
-                status_emoji = "✅"
-            elif issues_count <= 3:
-                color = "#FFA500"  # Orange
-                status_emoji = "⚠️"
-            else:
-                color = "#FF0000"  # Red
-                status_emoji = "🔴"
-            
-            # Build GitHub PR URL
-            pr_url = f"https://github.com/{repo_owner}/{repo_name}/pull/{pr_number}" if repo_owner and repo_name else ""
-            
-            # Create Slack message with blocks (rich formatting)
-            payload = {
-                "text": f"🤖 Code Review Complete for PR #{pr_number}",
-                "attachments": [
-                    {
-                        "color": color,
-                        "blocks": [
-                            {
-                                "type": "header",
-                                "text": {
-                                    "type": "plain_text",
-                                    "text": f"{status_emoji} Code Review Complete",
-                                    "emoji": True
-                                }
-                            },
-                            {
-                                "type": "section",
-                                "fields": [
-                                    {
-                                        "type": "mrkdwn",
-                                        "text": f"*PR:*\n#{pr_number} - {pr_title}"
-                                    },
-                                    {
-                                        "type": "mrkdwn",
-                                        "text": f"*Repository:*\n{repo_owner}/{repo_name}" if repo_owner else "*Repository:*\nDemo PR"
-                                    }
-                                ]
-                            },
-                            {
-                                "type": "section",
-                                "fields": [
-                                    {
-                                        "type": "mrkdwn",
-                                        "text": f"*Issues Found:*\n{issues_count}"
-                                    },
-                                    {
-                                        "type": "mrkdwn",
-                                        "text": f"*Processing Time:*\n{processing_time:.2f}s"
-                                    }
-                                ]
-                            },
-                            {
-                                "type": "section",
-                                "text": {
-                                    "type": "mrkdwn",
-                                    "text": f"*AI Analysis:*\n{ai_summary[:200]}..."
-                                }
-                            }
-                        ]
-                    }
-                ]
-            }
-            
-            # Add button to view PR if URL available
-            if pr_url:
-                payload["attachments"][0]["blocks"].append({
-                    "type": "actions",
-                    "elements": [
-                        {
-                            "type": "button",
-                            "text": {
-                                "type": "plain_text",
-                                "text": "View PR on GitHub",
-                                "emoji": True
-                            },
-                            "url": pr_url,
-                            "style": "primary"
-                        }
-                    ]
-                })
+            payload = build_review_payload(
+                pr_number, pr_title, repo_owner, repo_name,
+                issues_count, ai_summary, processing_time
+            )
             
             # Send to Slack
             response = requests.post(
@@ -1,19 +1,29 @@
 """
 Worker - Polls queue and processes jobs with AI and GitHub
 """
+import hashlib
 import logging
 import sys
 import time
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
 import json
+import signal
+import uuid
 
 sys.path.append('/app')
 
-from shared import redis_client, settings, SessionLocal, PRAnalysis
-from app.code_analyzer import CodeAnalyzer
+from shared import redis_client, settings, metrics, start_metrics_server
+from shared.database import issue_fields
+from shared.redis_client import review_state_key
+from app.analysis_pool import AnalysisPool, task_bytes
+from app.code_analyzer import CodeAnalyzer, format_location
+from app.db_sink import ResultSink
+from app.diff_parser import map_unchanged_lines, parse_added_lines
 from app.llm_analyzer import LLMAnalyzer
-from app.github_client import GitHubClient
-from app.slack_notifier import SlackNotifier
+from app.github_client import FileTooLarge, GitHubClient
 
 # Setup logging
 logging.basicConfig(
@@ -22,6 +32,39 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Metrics - cheap in-process counters, scraped from WORKER_METRICS_PORT
+STAGE_SECONDS = metrics.histogram(
+    "review_stage_seconds", "Time spent in each stage of a review", ["stage"]
+)
+JOBS_TOTAL = metrics.counter("review_jobs_total", "Reviews processed by outcome", ["status"])
+CACHE_LOOKUPS = metrics.counter(
+    "review_cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"]
+)
+ISSUES_FOUND = metrics.counter(
+    "review_issues_found_total", "Static analysis issues reported", ["severity"]
+)
+LLM_SLOT_WAIT = metrics.histogram(
+    "llm_slot_wait_seconds", "Time waiting for a fleet-wide LLM slot"
+)
+FILES_SKIPPED = metrics.counter(
+    "review_files_skipped_total", "PR files left unanalyzed by the per-PR limits", ["reason"]
+)
+REVIEW_SCOPE = metrics.counter(
+    "review_scope_total", "Reviews of a whole PR or of the commits since its last review", ["scope"]
+)
+
+
+@contextmanager
+def timed_stage(stages, stage):
+    """Time a with block into the job's stage durations and the stage histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stages[stage] = stages.get(stage, 0.0) + elapsed
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+
 
 class Worker:
     """Worker that processes code review jobs with AI and GitHub"""
@@ -33,7 +76,15 @@ class Worker:
         self.code_analyzer = CodeAnalyzer()
         self.llm_analyzer = LLMAnalyzer()
         self.github_client = GitHubClient()
-        self.slack_notifier = SlackNotifier()
+        # Shared by all job threads; files of big PRs are spread across processes
+        self.analysis_pool = AnalysisPool(
+            self.code_analyzer, self.github_client.session, self.github_client.fetch_pool
+        )
+        # Status updates are written in batches instead of per job
+        self.results = ResultSink()
+        self.concurrency = max(1, settings.WORKER_CONCURRENCY)
+        # One slot per job in flight - we only pop a job once a slot is free
+        self.slots = threading.BoundedSemaphore(self.concurrency)
         self.running = True
         logger.info(f"🤖 Worker {self.worker_id} initialized (Phase 3 - with GitHub)")
     
@@ -48,11 +99,18 @@ class Worker:
             True if successful
         """
         start_time = time.time()
-        job_id = job_data.get("job_id")
+        job_id = job_data.get("job_id") or str(uuid.uuid4())
         pr_number = job_data.get("pr_number")
         pr_title = job_data.get("pr_title", "Unknown")
         repo_owner = job_data.get("repo_owner")
         repo_name = job_data.get("repo_name")
+        head_sha = job_data.get("head_sha")
+        # Orders reviews of the same PR, so an older one finishing late can't
+        # overwrite a newer one
+        queued_at = self._queued_at(job_data)
+        review_order = queued_at.replace(tzinfo=timezone.utc).timestamp() if queued_at else start_time
+        # Seconds per stage for this job, stored with the result
+        stages = {}
         
         logger.info("=" * 60)
         logger.info(f"⚙️  Worker {self.worker_id} processing: PR #{pr_number}")
@@ -61,72 +119,134 @@ class Worker:
         if repo_owner and repo_name:
             logger.info(f"   📦 Repo: {repo_owner}/{repo_name}")
         
+        # Sent with every update so the row can be inserted by whichever flush sees it first
+        row = {
+            "repo_owner": repo_owner or None,
+            "repo_name": repo_name or None,
+            "pr_number": pr_number,
+            "pr_title": pr_title,
+            "head_sha": head_sha or None
+        }
+        
+        # Don't spend a review on an event nobody is waiting for anymore
+        age = self._job_age(job_data)
+        if settings.JOB_MAX_AGE_SECONDS and age is not None and age > settings.JOB_MAX_AGE_SECONDS:
+            logger.warning(f"⌛ Dropping stale job {job_id} (queued {age:.0f}s ago)")
+            logger.info("=" * 60)
+            self.results.record(
+                job_id, **row, status="expired", message=f"Dropped after waiting {age:.0f}s"
+            )
+            JOBS_TOTAL.inc(status="expired")
+            return True
+        
+        static_only = job_data.get("mode") == "static_only"
+        
         try:
-            # Create database record
-            db = SessionLocal()
+            # Results can only be cached per commit - look the head up if the
+            # event didn't carry it (PR metadata is reused across jobs briefly)
+            if not head_sha and repo_owner and repo_name and pr_number and self.github_client.enabled:
+                pull = self.github_client.get_pull(repo_owner, repo_name, pr_number)
+                head_sha = (pull or {}).get("head", {}).get("sha")
+                row["head_sha"] = head_sha or None
             
-            pr_analysis = PRAnalysis(
-                pr_number=pr_number,
-                pr_title=pr_title,
-                status="processing"
-            )
-            db.add(pr_analysis)
-            db.commit()
-            db.refresh(pr_analysis)
+            # Create database record
+            self.results.record(job_id, **row, status="processing")
             
-            # CHECK CACHE FIRST!
-            cache_key = f"pr_analysis:{pr_number}"
-            cached_result = redis_client.cache_get(cache_key)
+            # CHECK CACHE FIRST! Only safe when we know exactly which commit this is
+            cache_key = None
+            cached_result = None
+            if head_sha:
+                cache_key = (
+                    f"pr_analysis:{repo_owner}/{repo_name}#{pr_number}"
+                    f"@{head_sha}:{settings.ANALYSIS_MODE}:{self.code_analyzer.ruleset_version}"
+                )
+                cached_result = redis_client.cache_get(cache_key)
+                CACHE_LOOKUPS.inc(cache="pr", result="hit" if cached_result else "miss")
             
             if cached_result:
                 logger.info(f"   ⚡ CACHE HIT! Using cached analysis")
                 cached_data = json.loads(cached_result)
                 
-                pr_analysis.status = "completed"
-                pr_analysis.message = f"[CACHED] {cached_data['message']}"
-                db.commit()
-                
                 duration = time.time() - start_time
+                self.results.record(
+                    job_id,
+                    **row,
+                    **issue_fields(cached_data.get("code_issues", [])),
+                    status="completed",
+                    message=f"[CACHED] {cached_data['message']}",
+                    stage_durations={**stages, "total": duration}
+                )
+                
+                STAGE_SECONDS.observe(duration, stage="total")
+                JOBS_TOTAL.inc(status="cached")
+                redis_client.record_completion()
                 logger.info(f"   ⚡ Retrieved from cache")
                 logger.info(f"✅ Completed in {duration:.2f}s (CACHED!)")
                 logger.info("=" * 60)
-                
-                db.close()
                 return True
             
             # CACHE MISS - Do real analysis
             logger.info(f"   🔍 Running code analysis...")
             
             # Fetch real code from GitHub if available
-            code_to_analyze = ""
-            if repo_owner and repo_name and self.github_client.client:
+            code_issues = None
+            complete = True
+            diffs = None
+            review_key = None
+            previous = {}
+            compare = None
+            llm_title, llm_issues = pr_title, None
+            if repo_owner and repo_name and self.github_client.enabled:
                 logger.info(f"   📡 Fetching code from GitHub: {repo_owner}/{repo_name}")
-                files = self.github_client.get_pr_files(repo_owner, repo_name, pr_number)
+                # After a plain push only the new commits need reviewing
+                if head_sha and settings.REVIEW_STATE_TTL:
+                    review_key = review_state_key(repo_owner, repo_name, pr_number)
+                    previous = redis_client.get_review_state(review_key)
+                if previous.get("head_sha") and previous["head_sha"] != head_sha:
+                    compare = self._get_compare(
+                        repo_owner, repo_name, previous["head_sha"], head_sha, stages
+                    )
                 
-                if files:
-                    # Combine all files for analysis (limit to first 5 files)
-                    for file in files[:5]:
-                        code_to_analyze += f"\n\n# File: {file['filename']}\n"
-                        code_to_analyze += file['content']
-                    logger.info(f"   ✅ Fetched {len(files)} files from GitHub")
-                else:
-                    logger.warning(f"   ⚠️  No code files found, using sample")
-                    code_to_analyze = self._get_sample_code()
+                code_issues, complete, diffs = self._analyze_pr_files(
+                    repo_owner, repo_name, pr_number, stages,
+                    files=compare["files"] if compare else None
+                )
+                REVIEW_SCOPE.inc(scope="incremental" if compare else "full")
+                if compare:
+                    # The LLM sees only the new commits, the comment keeps
+                    # earlier findings on lines they left alone
+                    llm_title = f"{pr_title} (commits pushed since the last review)"
+                    llm_issues = code_issues
+                    earlier = json.loads(previous.get("issues") or "[]")
+                    code_issues = self._carry_over_issues(earlier, compare) + code_issues
             else:
                 logger.info(f"   📝 Using sample code (no GitHub info)")
-                code_to_analyze = self._get_sample_code()
             
-            # Run code analyzer
-            code_issues = self.code_analyzer.analyze_code(code_to_analyze)
+            if code_issues is None:
+                with timed_stage(stages, "static_analysis"):
+                    code_issues = self.code_analyzer.analyze_code(self._get_sample_code())
             logger.info(f"   📋 Found {len(code_issues)} code issues")
+            for issue in code_issues:
+                ISSUES_FOUND.inc(severity=issue["severity"])
             
-            # Run LLM analyzer
-            logger.info(f"   🤖 Getting AI insights...")
-            llm_result = self.llm_analyzer.analyze_pr(
-                pr_number=pr_number,
-                pr_title=pr_title,
-                code_issues=code_issues
-            )
+            # Run LLM analyzer, unless the gateway shed it because of a backlog
+            if static_only:
+                logger.info(f"   ⏭️  Skipping AI insights (static-only mode)")
+                llm_result = {
+                    "summary": "AI analysis skipped while the review queue is overloaded.",
+                    "cached": False,
+                    "slot_wait": 0.0
+                }
+            else:
+                logger.info(f"   🤖 Getting AI insights...")
+                with timed_stage(stages, "llm"):
+                    llm_result = self.llm_analyzer.analyze_pr(
+                        pr_number=pr_number,
+                        pr_title=llm_title,
+                        code_issues=code_issues if llm_issues is None else llm_issues,
+                        diffs=diffs
+                    )
+                LLM_SLOT_WAIT.observe(llm_result.get("slot_wait", 0.0))
             
             # Build result message
             result_message = f"""
@@ -135,70 +255,337 @@ Phase 3 Analysis Complete (GitHub Integration):
 - AI Analysis: {llm_result['summary'][:200]}...
 
 Details:
-{', '.join([f"{i['type']} (line {i['line']})" for i in code_issues[:3]])}
+{', '.join([f"{i['type']} ({format_location(i)})" for i in code_issues[:3]])}
 """
             
-            # Update database with results
-            pr_analysis.status = "completed"
-            pr_analysis.message = result_message
-            db.commit()
-            
             # CACHE THE RESULT!
             cache_data = {
                 "message": result_message,
                 "issues": len(code_issues),
+                "code_issues": code_issues,
                 "ai_summary": llm_result['summary']
             }
-            redis_client.cache_set(cache_key, json.dumps(cache_data), ttl=86400)  # 24 hours
-            logger.info(f"   💾 Cached result for future requests")
-            
-            # POST COMMENT TO GITHUB
-            if repo_owner and repo_name and self.github_client.client:
-                comment = self._format_github_comment(code_issues, llm_result)
-                success = self.github_client.post_review_comment(
-                    repo_owner, repo_name, pr_number, comment
-                )
-                if success:
-                    logger.info(f"   💬 Posted review to GitHub")
-        
+            # A static-only or partial (skipped, timed-out) result must not stand in for a full review later
+            if cache_key and not static_only and complete:
+                redis_client.cache_set(cache_key, json.dumps(cache_data), ttl=86400)  # 24 hours
+                logger.info(f"   💾 Cached result for future requests")
             
             duration = time.time() - start_time
-
-            # SEND SLACK NOTIFICATION - ADD THIS!
-            self.slack_notifier.send_review_notification(
-                pr_number=pr_number,
-                pr_title=pr_title,
-                repo_owner=repo_owner,
-                repo_name=repo_name,
-                issues_count=len(code_issues),
-                ai_summary=llm_result['summary'],
-                processing_time=duration
+            
+            # The next push is reviewed from here - unless this review was
+            # partial, then it covers these commits again. Nothing is recorded
+            # or commented if a review of a later event got there first.
+            superseded = False
+            if review_key and not static_only and complete:
+                superseded = redis_client.set_review_state(
+                    review_key, review_order, head_sha=head_sha, issues=json.dumps(code_issues)
+                ) is False
+            elif review_key:
+                recorded = redis_client.get_review_state(review_key).get("queued_at")
+                superseded = recorded is not None and float(recorded) > review_order
+            if superseded:
+                logger.info(f"   ⏭️  A later review of PR #{pr_number} is recorded, not commenting")
+            
+            # GitHub comment and Slack message are sent by the notifier service
+            notifications = []
+            if repo_owner and repo_name and self.github_client.enabled and not superseded:
+                notifications.append({
+                    "kind": "github_comment",
+                    "repo_owner": repo_owner,
+                    "repo_name": repo_name,
+                    "pr_number": pr_number,
+                    "body": self._format_github_comment(
+                        code_issues, llm_result, compare, previous.get("head_sha")
+                    ),
+                    # Lets the notifier edit the PR's earlier review comment,
+                    # unless that already shows a later review
+                    "review_key": review_key,
+                    "review_order": review_order
+                })
+            if settings.SLACK_WEBHOOK_URL:
+                notifications.append({
+                    "kind": "slack_review",
+                    "review": {
+                        "pr_number": pr_number,
+                        "pr_title": pr_title,
+                        "repo_owner": repo_owner,
+                        "repo_name": repo_name,
+                        "issues_count": len(code_issues),
+                        "ai_summary": llm_result['summary'],
+                        "processing_time": duration
+                    }
+                })
+            with timed_stage(stages, "notify"):
+                if redis_client.push_notifications(notifications) and notifications:
+                    logger.info(f"   📨 Queued {len(notifications)} notifications")
+            
+            # Update database with results, now that every stage is timed
+            self.results.record(
+                job_id,
+                **row,
+                **issue_fields(code_issues),
+                status="completed",
+                message=result_message,
+                stage_durations={**stages, "total": time.time() - start_time}
             )
+            
+            STAGE_SECONDS.observe(time.time() - start_time, stage="total")
+            JOBS_TOTAL.inc(status="completed")
+            redis_client.record_completion()
 
 
             logger.info(f"   📊 Issues: {len(code_issues)}")
+            logger.info(f"   ⏳ LLM slot wait: {llm_result.get('slot_wait', 0.0):.2f}s")
             logger.info(f"   💬 AI: {llm_result['summary'][:80]}...")
             logger.info(f"✅ Completed in {duration:.2f}s")
             logger.info("=" * 60)
-            
-            db.close()
             return True
             
         except Exception as e:
             logger.error(f"❌ Job {job_id} failed: {e}")
             logger.info("=" * 60)
+            JOBS_TOTAL.inc(status="failed")
+            redis_client.record_completion()
             
-            # Try to update database with error
-            try:
-                pr_analysis.status = "failed"
-                pr_analysis.message = f"Error: {str(e)}"
-                db.commit()
-                db.close()
-            except:
-                pass
+            # Record the error with the job
+            self.results.record(
+                job_id,
+                **row,
+                status="failed",
+                message=f"Error: {str(e)}",
+                stage_durations={**stages, "total": time.time() - start_time}
+            )
             
             return False
     
+    def _get_compare(self, repo_owner, repo_name, base_sha, head_sha, stages):
+        """
+        Files changed by the commits pushed since the last review
+        
+        Returns:
+            The comparison (see GitHubClient.get_compare), or None if the PR
+            needs a full review - history was rewritten, the base is gone,
+            or the comparison lists too many files
+        """
+        with timed_stage(stages, "github_fetch"):
+            compare = self.github_client.get_compare(repo_owner, repo_name, base_sha, head_sha)
+        if not compare or compare["status"] != "ahead":
+            status = compare["status"] if compare else "unavailable"
+            logger.info(f"   🔄 Full review: comparison with {base_sha[:7]} is {status}")
+            return None
+        logger.info(
+            f"   🔁 Reviewing {compare['commits']} new commit(s) since {base_sha[:7]} "
+            f"({len(compare['files'])} code files)"
+        )
+        return compare
+    
+    def _carry_over_issues(self, earlier, compare):
+        """
+        Earlier findings that still stand after the commits in compare
+        
+        Findings in files the commits didn't touch are kept as they are. In
+        a touched file, findings on lines the patch left alone move to their
+        new line numbers; those on removed or rewritten lines are dropped, as
+        the added lines were analyzed again. A touched file GitHub gave no
+        patch for was analyzed in full, so nothing carries over for it.
+        """
+        removed = set(compare.get("removed", []))
+        # Earlier name -> (current name, line mapping or None)
+        touched = {}
+        for file in compare["files"]:
+            mapping = map_unchanged_lines(file["patch"]) if file["patch"] else None
+            touched[file.get("previous_filename") or file["filename"]] = (file["filename"], mapping)
+        
+        kept = []
+        for issue in earlier:
+            name = issue.get("file")
+            if name in removed:
+                continue
+            if name not in touched:
+                kept.append(issue)
+                continue
+            filename, mapping = touched[name]
+            line = mapping(issue["line"]) if mapping and isinstance(issue.get("line"), int) else None
+            if line is not None:
+                kept.append({**issue, "file": filename, "line": line})
+        return kept
+    
+    def _analyze_pr_files(self, repo_owner, repo_name, pr_number, stages, files=None):
+        """
+        Fetch a PR's changed files and run static analysis on each of them
+        
+        In diff mode only the lines added by the PR are analyzed, using the
+        patch from the PR files API instead of downloading whole files.
+        Files are analyzed in parallel, within ANALYSIS_MAX_PR_BYTES and
+        ANALYSIS_TIMEOUT. The byte budget is handed out in PR order before
+        anything is downloaded, so it bounds the bytes fetched and scanned
+        and the same files make it every time. A downloaded file holds
+        ANALYSIS_MAX_FILE_BYTES of it unless the files might not all fit,
+        in which case their sizes are asked for first.
+        
+        Args:
+            stages: The job's stage durations, updated in place
+            files: Analyze these instead of the PR's files - the commits
+                since the last review, so only their added lines are analyzed
+        
+        Returns:
+            (issues, complete, diffs) - complete is False if a file was
+            skipped for size, timed out or failed, diffs are the (filename,
+            patch) pairs for the LLM
+        
+        Raises:
+            RuntimeError: The PR's files couldn't be listed - failing the job
+                beats posting a review of code the PR doesn't contain
+        """
+        diff_mode = settings.ANALYSIS_MODE == "diff" or files is not None
+        if files is None:
+            with timed_stage(stages, "github_fetch"):
+                files = self.github_client.get_pr_files(
+                    repo_owner, repo_name, pr_number, fetch_content=False
+                )
+        if files is None:
+            raise RuntimeError(f"Could not list the files of PR #{pr_number}")
+        if not files:
+            logger.info(f"   📭 No code files changed")
+            return [], True, []
+        
+        # Per-file results are content addressed, so unchanged files are
+        # neither downloaded nor re-analyzed across pushes, PRs or forks
+        cache_keys = [self._file_cache_key(file, diff_mode) for file in files]
+        keyed = [index for index, key in enumerate(cache_keys) if key]
+        cached = redis_client.cache_get_many([cache_keys[index] for index in keyed])
+        
+        results = [None] * len(files)
+        for index, cached_issues in zip(keyed, cached):
+            if cached_issues is not None:
+                results[index] = json.loads(cached_issues)
+        
+        misses = [index for index, result in enumerate(results) if result is None]
+        logger.info(f"   ⚡ File cache: {len(files) - len(misses)} hits, {len(misses)} misses")
+        CACHE_LOOKUPS.inc(len(files) - len(misses), cache="file", result="hit")
+        CACHE_LOOKUPS.inc(len(misses), cache="file", result="miss")
+        
+        # In diff mode only files whose patch GitHub omitted are downloaded
+        budget = settings.ANALYSIS_MAX_PR_BYTES or None
+        max_file_bytes = settings.ANALYSIS_MAX_FILE_BYTES
+        patch_tasks = {}
+        for index in misses:
+            if diff_mode and files[index]["patch"]:
+                patch_tasks[index] = ("lines", parse_added_lines(files[index]["patch"]))
+        to_fetch = [index for index in misses if index not in patch_tasks]
+        
+        # Sizes cost a HEAD request per file, so they are only asked for
+        # when holding max_file_bytes for each download might not fit
+        sizes = {}
+        held = sum(task_bytes(task) for task in patch_tasks.values()) + len(to_fetch) * max_file_bytes
+        if to_fetch and budget is not None and held > budget:
+            with timed_stage(stages, "github_fetch"):
+                sizes = dict(zip(to_fetch, self.github_client.get_file_sizes(
+                    [files[index]["raw_url"] for index in to_fetch]
+                )))
+        
+        # One task per file, reserving the byte budget in PR order. Whole
+        # files are streamed from GitHub by whichever process analyzes them,
+        # so no file body is held in full, and none reads past its share.
+        remaining = budget
+        tasks = []
+        task_files = []
+        # Not cached as the PR's result if any file is left out, or a re-run
+        # of this head would never look at it
+        incomplete = 0
+        for index in misses:
+            file = files[index]
+            if index in patch_tasks:
+                task = patch_tasks[index]
+                size = task_bytes(task)
+            else:
+                size = sizes.get(index)
+                if size is not None and size > max_file_bytes:
+                    FILES_SKIPPED.inc(reason="size")
+                    logger.warning(f"   ⚠️  Skipping {file['filename']}: over {max_file_bytes} bytes")
+                    incomplete += 1
+                    continue
+                if size is None:
+                    # Unknown size - it holds a bounded share
+                    size = max_file_bytes
+                task = ("url", file["raw_url"], size)
+            
+            if remaining is not None:
+                if size > remaining:
+                    FILES_SKIPPED.inc(reason="size")
+                    logger.warning(f"   ⚠️  Skipping {file['filename']}: PR is over {budget} bytes of code")
+                    incomplete += 1
+                    continue
+                remaining -= size
+            tasks.append(task)
+            task_files.append(index)
+        
+        # Downloads happen during analysis, so this includes them
+        with timed_stage(stages, "static_analysis"):
+            outcomes = self.analysis_pool.analyze(tasks, timeout=settings.ANALYSIS_TIMEOUT or None)
+        
+        new_entries = {}
+        for index, outcome in zip(task_files, outcomes):
+            filename = files[index]["filename"]
+            if isinstance(outcome, Exception):
+                if isinstance(outcome, FileTooLarge):
+                    # Bigger than the size it was reserved by
+                    reason = "size"
+                elif isinstance(outcome, TimeoutError):
+                    reason = "timeout"
+                else:
+                    reason = "error"
+                FILES_SKIPPED.inc(reason=reason)
+                logger.warning(f"   ⚠️  Could not analyze {filename}: {outcome}")
+                incomplete += 1
+                continue
+            
+            issues = outcome[0]
+            results[index] = issues
+            if cache_keys[index]:
+                new_entries[cache_keys[index]] = json.dumps(issues)
+        
+        redis_client.cache_set_many(new_entries, ttl=settings.FILE_CACHE_TTL)
+        
+        # Assemble the PR result, tagging issues with this PR's file paths
+        code_issues = []
+        for file, issues in zip(files, results):
+            for issue in issues or []:
+                code_issues.append({**issue, "file": file["filename"]})
+        
+        analyzed_count = sum(1 for issues in results if issues is not None)
+        logger.info(
+            f"   ✅ Analyzed {analyzed_count}/{len(files)} files from GitHub ({'diff' if diff_mode else 'full'} mode)"
+        )
+        # GitHub leaves the patch out for very large diffs
+        diffs = [(file["filename"], file["patch"]) for file in files if file["patch"]]
+        return code_issues, incomplete == 0, diffs
+    
+    def _job_age(self, job_data):
+        """Seconds since the gateway queued the job, or None if unknown"""
+        queued_at = self._queued_at(job_data)
+        if queued_at is None:
+            return None
+        return (datetime.utcnow() - queued_at).total_seconds()
+    
+    def _queued_at(self, job_data):
+        """When the gateway queued the job (naive UTC), or None if unknown"""
+        try:
+            return datetime.fromisoformat(job_data["queued_at"])
+        except (KeyError, TypeError, ValueError):
+            return None
+    
+    def _file_cache_key(self, file, diff_mode):
+        """Cache key for one file's static analysis result"""
+        version = self.code_analyzer.ruleset_version
+        if diff_mode and file["patch"]:
+            # Changed-line results depend on the patch, not just the new blob
+            patch_hash = hashlib.sha1(file["patch"].encode()).hexdigest()
+            return f"file_analysis:{version}:patch:{patch_hash}"
+        if file.get("sha"):
+            return f"file_analysis:{version}:blob:{file['sha']}"
+        return None
+    
     def _get_sample_code(self):
         """Get sample code for demo purposes"""
         return """
@@ -210,15 +597,22 @@ def process_user_login(username):
     return False
 """
     
-    def _format_github_comment(self, code_issues, llm_result):
-        """Format a nice GitHub comment"""
+    def _format_github_comment(self, code_issues, llm_result, compare=None, base_sha=None):
+        """
+        Format a nice GitHub comment
+        
+        Args:
+            compare: Set when only the commits since base_sha were reviewed
+        """
         comment = "## 🤖 AI Code Review\n\n"
+        if compare:
+            comment += f"*Updated for {compare['commits']} new commit(s) since `{base_sha[:7]}`.*\n\n"
         
         if code_issues:
             comment += f"**Found {len(code_issues)} issues:**\n\n"
             for issue in code_issues[:5]:  # Top 5 issues
                 emoji = "🔴" if issue['severity'] == 'high' else "🟡" if issue['severity'] == 'medium' else "🔵"
-                comment += f"{emoji} **{issue['type'].upper()}** (line {issue['line']}): {issue['message']}\n"
+                comment += f"{emoji} **{issue['type'].upper()}** ({format_location(issue)}): {issue['message']}\n"
             comment += "\n"
         
         comment += "**AI Analysis:**\n\n"
@@ -233,34 +627,81 @@ def process_user_login(username):
         logger.info(f"🚀 Worker {self.worker_id} started (Phase 3 - GitHub Enabled)!")
         logger.info(f"   📡 Polling queue: {settings.REDIS_QUEUE_NAME}")
         logger.info(f"   ⏱️  Poll interval: 5 seconds")
+        logger.info(f"   🧵 Concurrency: {self.concurrency} jobs in flight")
         logger.info(f"   🔗 Redis: {settings.REDIS_HOST}")
         logger.info(f"   🗄️  Database: {settings.POSTGRES_HOST}")
         logger.info(f"   🤖 AI Model: codellama")
         logger.info(f"   ⚡ Caching: Enabled (24h TTL)")
-        logger.info(f"   🐙 GitHub: {'Enabled' if self.github_client.client else 'Disabled'}")
+        logger.info(f"   🐙 GitHub: {'Enabled' if self.github_client.enabled else 'Disabled'}")
         logger.info("")
+        
+        # docker stop sends SIGTERM - finish in-flight jobs and flush results
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self._handle_sigterm)
+        
+        try:
+            start_metrics_server(settings.WORKER_METRICS_PORT)
+        except OSError as e:
+            logger.warning(f"⚠️  Metrics listener disabled: {e}")
         logger.info(f"⏳ Worker {self.worker_id} waiting for jobs...")
         
-        while self.running:
-            try:
-                # Poll for jobs (blocks for up to 5 seconds)
-                job_data = redis_client.pop_job(timeout=5)
+        executor = ThreadPoolExecutor(
+            max_workers=self.concurrency,
+            thread_name_prefix="job"
+        )
+        
+        try:
+            while self.running:
+                # Backpressure: wait for a free slot before taking another job
+                if not self.slots.acquire(timeout=5):
+                    continue
                 
-                if job_data:
-                    # Process the job
-                    self.process_job(job_data)
-                else:
-                    # No job available - this is normal
-                    pass
-            
-            except KeyboardInterrupt:
-                logger.info("")
-                logger.info("👋 Worker shutting down...")
-                self.running = False
-            except Exception as e:
-                logger.error(f"⚠️  Worker error: {e}")
-                time.sleep(5)  # Wait before retrying
-
+                try:
+                    # Poll for jobs (blocks for up to 5 seconds)
+                    job_data = redis_client.pop_job(timeout=5)
+                    
+                    if job_data:
+                        # Process the job on the pool, slot is freed when it finishes
+                        executor.submit(self._run_job, job_data)
+                    else:
+                        # No job available - this is normal
+                        self.slots.release()
+                
+                except KeyboardInterrupt:
+                    self.slots.release()
+                    raise
+                except Exception as e:
+                    self.slots.release()
+                    logger.error(f"⚠️  Worker error: {e}")
+                    time.sleep(5)  # Wait before retrying
+        
+        except KeyboardInterrupt:
+            logger.info("")
+            logger.info("👋 Worker shutting down...")
+            self.running = False
+        
+        finally:
+            # Let in-flight jobs finish before exiting
+            executor.shutdown(wait=True)
+            self.analysis_pool.close()
+            self.llm_analyzer.close()
+            self.results.close()
+            logger.info("💾 Pending results written")
+    
+    def _handle_sigterm(self, signum, frame):
+        """Stop taking jobs; run() drains and flushes before exiting"""
+        logger.info("👋 SIGTERM received, shutting down...")
+        self.running = False
+    
+    def _run_job(self, job_data):
+        """Run a single job on a pool thread and free its slot afterwards"""
+        try:
+            self.process_job(job_data)
+            redis_client.ack_job(job_data)
+        except Exception as e:
+            logger.error(f"⚠️  Unhandled error in job {job_data.get('job_id')}: {e}")
+        finally:
+            self.slots.release()
 
 if __name__ == "__main__":
     worker = Worker()